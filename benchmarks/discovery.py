@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Discovery benchmark
+   Runs `discover_all` end to end against a simulated cluster: the switches
+   are served by a local SNMP agent and the BMCs by a fake ipmitool (see
+   simulator.py). Every scenario runs in a fresh interpreter with its own
+   configuration and inventory, and reports the wall time, the SNMP
+   requests, the IPMI calls and the peak memory of the discovery.
+
+   Usage:
+
+       python benchmarks/discovery.py [--nodes 100 1000 10000] [--json]
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulator import Simulator, Topology, request, VLAN  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, logging, resource, sys, time
+from discover import config
+config.DEFAULT_CONF_DIRS[:] = [CONFDIR]
+config.CACHE_DIR = CACHEDIR
+logging.getLogger().setLevel(logging.WARNING)
+from discover import discovery, inventory, switch
+switch.SNAPSHOT_DIR = CACHEDIR + '/fdb'
+inventory.connect(DBFILE)
+start = time.time()
+error = None
+try:
+    discovery.discover_all(parallel=True, poweron=True)
+except discovery.DiscoveryFailedError as e:
+    error = str(e)
+elapsed = time.time() - start
+sys.stderr.write(json.dumps({
+    'seconds': elapsed,
+    'discovered': sum(1 for node in inventory.iter_nodes() if node.has_all_macs()),
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    'error': error,
+}) + '\\n')
+"""
+
+IPMITOOL = """#!/bin/sh
+exec {python} {script} "$@"
+"""
+
+
+def write_config(confdir, topology, simulator, timeout):
+    """Write the configuration of the simulated cluster
+
+    JSON is valid YAML and much faster to generate for large clusters.
+    """
+    host, port = simulator.snmp_address
+    switches = dict((name, {'address': '{}:{}'.format(host, port), 'community': name})
+                    for name in topology.switches())
+    nodes = {}
+    for i in range(topology.count):
+        nodes[topology.name(i)] = {
+            'bmc': {'address': topology.bmc(i), 'user': 'USERID', 'password': 'PASSW0RD'},
+            'nics': dict(('nic{}'.format(nic + 1), {'switch': switch, 'port': port,
+                                                    'vlan': VLAN, 'mac': ''})
+                         for nic, (switch, port, _) in enumerate(topology.switchports(i))),
+        }
+    settings = {
+        'snmp': {'workers': 16, 'max_repetitions': 40},
+        'ipmi': {'workers': 32},
+        'discovery': {'initial_delay': 1, 'backoff': 1.5, 'max_delay': 5,
+                      'timeout': timeout,
+                      # The simulated switches have no LLDP neighbors
+                      'lldp': False},
+        'traps': {'enabled': False},
+    }
+    logconf = {
+        'version': 1,
+        'handlers': {'console': {'class': 'logging.StreamHandler', 'level': 'WARNING'}},
+        'root': {'level': 'WARNING', 'handlers': ['console']},
+    }
+    for filename, data in (('switches.yml', switches), ('nodes.yml', nodes),
+                           ('settings.yml', settings), ('logging.yml', logconf)):
+        with open(os.path.join(confdir, filename), 'w') as conffile:
+            json.dump(data, conffile)
+
+
+def run(count, options):
+    """Run a scenario returning its measures"""
+    workdir = tempfile.mkdtemp(prefix='discover-bench-')
+    topology = Topology(count)
+    simulator = Simulator(topology, arrival=options.arrival, known=options.known,
+                          noise=options.noise, ipmi_latency=options.ipmi_latency,
+                          ipmi_failure_rate=options.ipmi_failure_rate).start()
+    try:
+        confdir = os.path.join(workdir, 'config')
+        bindir = os.path.join(workdir, 'bin')
+        os.mkdir(confdir)
+        os.mkdir(bindir)
+        write_config(confdir, topology, simulator, options.timeout)
+        # The fake ipmitool goes first in the PATH of the discovery
+        ipmitool = os.path.join(bindir, 'ipmitool')
+        with open(ipmitool, 'w') as script:
+            script.write(IPMITOOL.format(python=sys.executable, script=os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), 'fake_ipmitool.py')))
+        os.chmod(ipmitool, os.stat(ipmitool).st_mode | stat.S_IEXEC)
+        env = dict(os.environ)
+        env['PATH'] = bindir + os.pathsep + env.get('PATH', '')
+        env['PYTHONPATH'] = ROOT
+        env['DISCOVER_SIMULATOR'] = '{}:{}'.format(*simulator.control_address)
+        code = (PROBE.replace('CONFDIR', repr(confdir))
+                .replace('CACHEDIR', repr(os.path.join(workdir, 'cache')))
+                .replace('DBFILE', repr(os.path.join(workdir, 'inventory.sqlite'))))
+        process = subprocess.Popen([sys.executable, '-c', code], cwd=workdir, env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+        _, err = process.communicate()
+        try:
+            result = json.loads(err.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            raise RuntimeError('Discovery of {} nodes crashed:\n{}'.format(count, err))
+        result['nodes'] = count
+        result.update(request(simulator.control_address, {'stats': True}))
+        return result
+    finally:
+        simulator.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--arrival', type=float, nargs=2, default=[1.0, 5.0],
+                        metavar=('MIN', 'MAX'),
+                        help='seconds from power on until the MACs are seen')
+    parser.add_argument('--known', type=float, default=0.1,
+                        help='fraction of nodes whose MACs the switches already know')
+    parser.add_argument('--noise', type=int, default=200,
+                        help='MACs of other hosts in the FDB table of every switch')
+    parser.add_argument('--ipmi-latency', type=float, default=0.05)
+    parser.add_argument('--ipmi-failure-rate', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='seconds before a node is given up')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    options = parser.parse_args()
+    try:
+        import snimpy  # noqa: F401
+    except ImportError:
+        # The discovery walks the simulated switches through snimpy
+        parser.error('snimpy is required, see the installation section of the README')
+    results = []
+    if not options.json:
+        print('{:>6} {:>9} {:>10} {:>9} {:>10} {:>9} {:>8}'.format(
+            'nodes', 'seconds', 'found', 'snmp req', 'ipmi calls', 'ipmi err', 'peak MB'))
+    for count in options.nodes:
+        result = run(count, options)
+        results.append(result)
+        if not options.json:
+            print('{nodes:6} {seconds:9.2f} {discovered:10} {snmp_requests:9} '
+                  '{ipmi_calls:10} {ipmi_failures:9} {peak_rss_mb:8.1f}'.format(**result))
+            sys.stdout.flush()
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Fake Cobbler
+   Local XML-RPC server standing in for Cobbler in the benchmarks and the
+   tests. It implements the subset of the Cobbler API discover uses.
+"""
+from __future__ import print_function, with_statement
+import threading
+import time
+import SocketServer
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+# Fields of modify_interface and their name in the system records
+INTERFACE_FIELDS = {'macaddress': 'mac_address', 'ipaddress': 'ip_address',
+                    'netmask': 'netmask'}
+
+
+def _record(fields):
+    """Turn the edits of a system into a record like get_systems returns"""
+    record = dict((field, value) for field, value in fields.items()
+                  if field != 'modify_interface')
+    record['interfaces'] = {}
+    for key, value in fields.get('modify_interface', {}).items():
+        field, device = key.split('-', 1)
+        record['interfaces'].setdefault(device, {})[INTERFACE_FIELDS.get(field, field)] = value
+    return record
+
+
+class _QuietHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/cobbler_api',)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeCobbler(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    """XML-RPC server implementing the subset of the Cobbler API we use
+
+    Every HTTP request takes `latency` seconds, like a round trip to a
+    remote Cobbler server would. The API methods called are recorded in
+    `calls`, including the ones inside a multicall. Systems are kept
+    across runs, so the same server can be exported to again.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.005, multicall=True):
+        SimpleXMLRPCServer.__init__(self, ('127.0.0.1', 0), requestHandler=_QuietHandler,
+                                    allow_none=True, logRequests=False)
+        self.latency = latency
+        self.requests = 0
+        self.calls = []
+        self.systems = {}
+        self._new = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        if multicall:
+            self.register_multicall_functions()
+        self.url = 'http://127.0.0.1:{}/cobbler_api'.format(self.server_address[1])
+
+    def _marshaled_dispatch(self, *args, **kwargs):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return SimpleXMLRPCServer._marshaled_dispatch(self, *args, **kwargs)
+
+    def _dispatch(self, method, params):
+        if method in self.funcs:
+            return SimpleXMLRPCServer._dispatch(self, method, params)
+        with self._lock:
+            self.calls.append(method)
+        if method.startswith('_') or not hasattr(self, 'api_' + method):
+            # Like Cobbler, without naming the method
+            raise Exception('unknown remote method')
+        return getattr(self, 'api_' + method)(*params)
+
+    def api_login(self, login, password):
+        return 'token'
+
+    def api_new_system(self, token):
+        with self._lock:
+            system_id = '___NEW___system::{}'.format(self._next_id)
+            self._next_id += 1
+            self._new[system_id] = {}
+        return system_id
+
+    def api_get_system_handle(self, name, token):
+        with self._lock:
+            system_id = 'system::{}'.format(name)
+            self._new[system_id] = {'name': name}
+        return system_id
+
+    def api_modify_system(self, system_id, field, value, token):
+        self._new[system_id][field] = value
+        return True
+
+    def api_save_system(self, system_id, token):
+        system = self._new.pop(system_id)
+        self.systems[system['name']] = _record(system)
+        return True
+
+    def api_remove_system(self, name, token):
+        self.systems.pop(name, None)
+        return True
+
+    def api_get_systems(self):
+        return list(self.systems.values())
+
+    def api_sync(self, token):
+        return True
+
+    def start(self):
+        """Serve in a background thread"""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""Fake ipmitool
+   Stands in for ipmitool in the benchmarks: the commands are answered by
+   the simulator whose control address is in DISCOVER_SIMULATOR.
+
+   Usage:
+
+       fake_ipmitool.py -I lanplus -H ADDRESS -U USER -P PASSWORD COMMAND...
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from simulator import request  # noqa: E402
+
+
+def main(args):
+    options = {}
+    while args and args[0].startswith('-'):
+        options[args[0]] = args[1]
+        args = args[2:]
+    host, port = os.environ['DISCOVER_SIMULATOR'].rsplit(':', 1)
+    reply = request((host, int(port)), {'host': options.get('-H'), 'args': args})
+    time.sleep(reply['latency'])
+    sys.stdout.write(reply['output'])
+    return reply['status']
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
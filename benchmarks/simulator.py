@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""Cluster simulator
+   Simulates the switches and BMCs of a cluster for the benchmarks.
+
+   A single UDP agent answers the SNMP requests of every switch, told apart
+   by the community (the switch name), serving a synthetic Q-BRIDGE-MIB
+   dot1qTpFdbPort table. A control socket answers the commands of the fake
+   ipmitool: when a node is powered on its MACs show up in the FDB tables
+   of its switches after a random arrival delay, like a booting node that
+   starts sending frames.
+"""
+from __future__ import print_function, with_statement
+import bisect
+import heapq
+import json
+import os
+import random
+import select
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from discover import ber  # noqa: E402
+
+# Q-BRIDGE-MIB::dot1qTpFdbPort
+FDB_PORT = (1, 3, 6, 1, 2, 1, 17, 7, 1, 2, 2, 1, 2)
+# Port where the MACs of the rest of the network are seen
+UPLINK_PORT = 48
+# Vlan of the rest of the network
+UPLINK_VLAN = 1
+# Vlan of the nodes
+VLAN = 119
+
+
+class Topology(object):
+    """Synthetic cluster: racks of nodes with one switch per NIC
+
+    Node i is at position i % nodes_per_switch + 1 of rack i // nodes_per_switch,
+    and its NIC k is connected to switch SW<rack>-<k> on the port of its
+    position.
+    """
+    def __init__(self, nodes, nodes_per_switch=40, nics=2):
+        self.count = nodes
+        self.nodes_per_switch = nodes_per_switch
+        self.nics = nics
+
+    def name(self, i):
+        rack, position = divmod(i, self.nodes_per_switch)
+        return 'node-{}-{}'.format(rack, position + 1)
+
+    def bmc(self, i):
+        rack, position = divmod(i, self.nodes_per_switch)
+        return '10.{}.{}.{}'.format(100 + rack // 250, rack % 250, position + 1)
+
+    def switchports(self, i):
+        """Return the (switch, port, mac) of every NIC of a node"""
+        rack, position = divmod(i, self.nodes_per_switch)
+        return [('SW{}-{}'.format(rack, nic), position + 1, 0x020000000000 | (nic << 32) | i)
+                for nic in range(1, self.nics + 1)]
+
+    def switches(self):
+        racks = (self.count + self.nodes_per_switch - 1) // self.nodes_per_switch
+        return ['SW{}-{}'.format(rack, nic) for rack in range(racks)
+                for nic in range(1, self.nics + 1)]
+
+
+class FDB(object):
+    """dot1qTpFdbPort table of a switch, sorted by OID"""
+    def __init__(self):
+        self.oids = []
+        self.ports = {}
+
+    def add(self, vlan, mac, port):
+        oid = FDB_PORT + (vlan,) + tuple((mac >> shift) & 0xff
+                                         for shift in (40, 32, 24, 16, 8, 0))
+        if oid not in self.ports:
+            bisect.insort(self.oids, oid)
+        self.ports[oid] = port
+
+    def next(self, oid):
+        """Return the first (oid, port) after the given OID, None at the end"""
+        index = bisect.bisect_right(self.oids, tuple(oid))
+        if index == len(self.oids):
+            return None
+        return self.oids[index], self.ports[self.oids[index]]
+
+
+class Simulator(object):
+    """SNMP agent and BMC controller of a simulated cluster
+
+    :param arrival: (min, max) seconds from power on until the MACs of a
+                    node are seen by its switches
+    :param known: fraction of the nodes already on with their MACs learned
+    :param noise: MACs of other hosts seen on the uplink of every switch
+    :param ipmi_latency: seconds every ipmitool command takes
+    :param ipmi_failure_rate: fraction of ipmitool commands that fail
+    """
+    def __init__(self, topology, arrival=(1.0, 5.0), known=0.0, noise=0,
+                 ipmi_latency=0.0, ipmi_failure_rate=0.0, seed=0):
+        self.topology = topology
+        self.arrival = arrival
+        self.ipmi_latency = ipmi_latency
+        self.ipmi_failure_rate = ipmi_failure_rate
+        self.stats = {'snmp_requests': 0, 'snmp_varbinds': 0,
+                      'ipmi_calls': 0, 'ipmi_failures': 0}
+        self._random = random.Random(seed)
+        self._tables = dict((name, FDB()) for name in topology.switches())
+        self._nodes = dict((topology.bmc(i), i) for i in range(topology.count))
+        self._power = {}
+        self._arrivals = []
+        self._seen = set()
+        for i in range(topology.count):
+            if self._random.random() < known:
+                self._power[i] = True
+                self._learn(i)
+        for table in self._tables.values():
+            for n in range(noise):
+                table.add(UPLINK_VLAN, 0x0e0000000000 | n, UPLINK_PORT)
+        self._snmp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._snmp.bind(('127.0.0.1', 0))
+        self._control = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._control.bind(('127.0.0.1', 0))
+        self.snmp_address = self._snmp.getsockname()
+        self.control_address = self._control.getsockname()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self._serve, name='simulator')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self._snmp.close()
+        self._control.close()
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            ready, _, _ = select.select([self._snmp, self._control], [], [], 0.2)
+            for sock in ready:
+                data, source = sock.recvfrom(65535)
+                if sock is self._snmp:
+                    reply = self._handle_snmp(data)
+                else:
+                    reply = json.dumps(self._handle_control(json.loads(data.decode('utf-8'))))
+                    reply = reply.encode('utf-8')
+                if reply is not None:
+                    sock.sendto(reply, source)
+
+    def _learn(self, i):
+        """Make the MACs of a node visible in its switches"""
+        self._seen.add(i)
+        for switch, port, mac in self.topology.switchports(i):
+            self._tables[switch].add(VLAN, mac, port)
+
+    def _process_arrivals(self):
+        now = time.time()
+        while self._arrivals and self._arrivals[0][0] <= now:
+            _, i = heapq.heappop(self._arrivals)
+            self._learn(i)
+
+    def _handle_snmp(self, data):
+        try:
+            message = ber.decode_message(data)
+        except (ber.BERError, ValueError, IndexError):
+            return None
+        table = self._tables.get(message['community'].decode('ascii', 'replace'))
+        if table is None:
+            # Wrong community: real agents do not answer
+            return None
+        self.stats['snmp_requests'] += 1
+        self._process_arrivals()
+        pdu = message['pdu']
+        varbinds = []
+        if pdu == ber.GET:
+            for oid, _ in message['varbinds']:
+                port = table.ports.get(tuple(oid))
+                varbinds.append((oid, (ber.INTEGER, port) if port is not None
+                                 else (ber.NO_SUCH_INSTANCE, None)))
+        elif pdu in (ber.GETNEXT, ber.GETBULK):
+            if pdu == ber.GETBULK:
+                non_repeaters = message['error_status']
+                repetitions = max(message['error_index'], 1)
+            else:
+                non_repeaters, repetitions = len(message['varbinds']), 1
+            requested = [oid for oid, _ in message['varbinds']]
+            for oid in requested[:non_repeaters]:
+                varbinds.append(self._next(table, oid))
+            current = requested[non_repeaters:]
+            for _ in range(repetitions if current else 0):
+                step = [self._next(table, oid) for oid in current]
+                varbinds.extend(step)
+                current = [oid for oid, _ in step]
+                if all(value[0] == ber.END_OF_MIB_VIEW for _, value in step):
+                    break
+        else:
+            return None
+        self.stats['snmp_varbinds'] += len(varbinds)
+        return ber.encode_message(message['community'], ber.RESPONSE,
+                                  message['request_id'], varbinds)
+
+    @staticmethod
+    def _next(table, oid):
+        entry = table.next(oid)
+        if entry is None:
+            return oid, (ber.END_OF_MIB_VIEW, None)
+        return entry[0], (ber.INTEGER, entry[1])
+
+    def _handle_control(self, request):
+        if request.get('stats'):
+            return self.stats
+        self.stats['ipmi_calls'] += 1
+        i = self._nodes.get(request['host'])
+        command = ' '.join(request['args'])
+        if i is None or self._random.random() < self.ipmi_failure_rate:
+            self.stats['ipmi_failures'] += 1
+            return {'status': 1, 'latency': self.ipmi_latency,
+                    'output': 'Error: Unable to establish IPMI v2 / RMCP+ session\n'}
+        if command == 'chassis power status':
+            state = 'on' if self._power.get(i) else 'off'
+            output = 'Chassis Power is {}\n'.format(state)
+        elif command == 'chassis power on':
+            if not self._power.get(i) and i not in self._seen:
+                delay = self._random.uniform(*self.arrival)
+                heapq.heappush(self._arrivals, (time.time() + delay, i))
+            self._power[i] = True
+            output = 'Chassis Power Control: Up/On\n'
+        elif command in ('chassis power off', 'chassis power soft'):
+            self._power[i] = False
+            output = 'Chassis Power Control: Down/Off\n'
+        elif command == 'chassis bootdev pxe':
+            output = 'Set Boot Device to pxe\n'
+        else:
+            return {'status': 1, 'latency': 0, 'output': 'Invalid command\n'}
+        return {'status': 0, 'latency': self.ipmi_latency, 'output': output}
+
+
+def request(address, message, timeout=10):
+    """Send a request to the control socket of a simulator"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.settimeout(timeout)
+        sock.sendto(json.dumps(message).encode('utf-8'), address)
+        data, _ = sock.recvfrom(65535)
+    finally:
+        sock.close()
+    return json.loads(data.decode('utf-8'))
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Startup benchmark
+   Measures the import and run time of each CLI subcommand and the heavy
+   subsystems it loads. Every measure runs in a fresh interpreter.
+
+   Usage:
+
+       python benchmarks/startup.py [--repeat N]
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Commands that are safe to run against the real inventory
+COMMANDS = [
+    ['--help'],
+    ['learn', '--help'],
+    ['show'],
+    ['export', 'csv', 'all'],
+]
+
+# Modules that only the commands talking to the hardware should load
+HEAVY_MODULES = ['snimpy', 'xmlrpclib', 'xmlrpc.client', 'discover.switch',
+                 'discover.power', 'discover.discovery',
+                 'discover.cobbler']
+
+PROBE = """
+import json, sys, time
+start = time.time()
+from discover import cli
+imported = time.time()
+try:
+    cli.cli.main(args=ARGS, prog_name='discover')
+except SystemExit:
+    pass
+finished = time.time()
+sys.stderr.write(json.dumps({
+    'import': imported - start,
+    'total': finished - start,
+    'modules': [m for m in HEAVY if m in sys.modules],
+}) + '\\n')
+"""
+
+
+def measure(args, repeat=5):
+    """Return the best import and total time of a command and its modules"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = PROBE.replace('ARGS', repr(args)).replace('HEAVY', repr(HEAVY_MODULES))
+    best = None
+    for _ in range(repeat):
+        process = subprocess.Popen([sys.executable, '-c', code], cwd=root,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+        _, err = process.communicate()
+        result = json.loads(err.strip().splitlines()[-1])
+        if best is None or result['total'] < best['total']:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+    print('{:24} {:>10} {:>10}  {}'.format('command', 'import ms', 'total ms', 'heavy modules'))
+    for args in COMMANDS:
+        result = measure(args, options.repeat)
+        print('{:24} {:10.1f} {:10.1f}  {}'.format(
+            ' '.join(args), 1000 * result['import'], 1000 * result['total'],
+            ', '.join(result['modules']) or '-'))
+
+
+if __name__ == '__main__':
+    main()
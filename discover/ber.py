@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""BER module
+   Implements the minimal BER encoding of SNMP messages needed to receive
+   notifications and to simulate agents
+"""
+from __future__ import print_function, with_statement
+
+# Universal types
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OID = 0x06
+SEQUENCE = 0x30
+# SNMP application types
+IPADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+COUNTER64 = 0x46
+# SNMP exceptions in responses
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+# SNMP PDUs
+GET = 0xA0
+GETNEXT = 0xA1
+RESPONSE = 0xA2
+SET = 0xA3
+TRAP_V1 = 0xA4
+GETBULK = 0xA5
+INFORM = 0xA6
+TRAP_V2 = 0xA7
+REPORT = 0xA8
+
+VERSION_1 = 0
+VERSION_2C = 1
+
+_UNSIGNED = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+
+
+class BERError(Exception):
+    """Malformed BER data"""
+    pass
+
+
+def parse_oid(text):
+    """Convert a dotted OID string to a tuple of integers"""
+    return tuple(int(arc) for arc in text.strip('.').split('.'))
+
+
+def format_oid(oid):
+    """Convert a tuple of integers to a dotted OID string"""
+    return '.'.join(str(arc) for arc in oid)
+
+
+def decode(data, offset=0):
+    """Decode the TLV starting at offset
+
+    :returns: a (tag, value, next_offset) tuple. Constructed values are
+              returned as lists of (tag, value) tuples.
+    """
+    return _decode(bytearray(data), offset)
+
+
+def _decode(data, offset):
+    """Decode the TLV starting at offset of a bytearray"""
+    if offset + 2 > len(data):
+        raise BERError('Truncated data')
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = 0
+        for byte in data[offset:offset + size]:
+            length = (length << 8) | byte
+        offset += size
+    end = offset + length
+    if end > len(data):
+        raise BERError('Truncated value')
+    content = data[offset:end]
+    if tag & 0x20:
+        items = []
+        position = offset
+        while position < end:
+            item_tag, item_value, position = _decode(data, position)
+            items.append((item_tag, item_value))
+        return tag, items, end
+    return tag, _decode_primitive(tag, content), end
+
+
+def _decode_primitive(tag, content):
+    """Decode the content of a primitive type"""
+    if tag == INTEGER or tag in _UNSIGNED:
+        value = 0
+        for byte in content:
+            value = (value << 8) | byte
+        if tag == INTEGER and content and content[0] & 0x80:
+            value -= 1 << (8 * len(content))
+        return value
+    elif tag == OID:
+        if not content:
+            return ()
+        arcs = [content[0] // 40, content[0] % 40]
+        value = 0
+        for byte in content[1:]:
+            value = (value << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                arcs.append(value)
+                value = 0
+        return tuple(arcs)
+    elif tag in (NULL, NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW):
+        return None
+    return bytes(content)
+
+
+def _encode_length(length):
+    """Encode a BER length"""
+    if length < 0x80:
+        return bytearray([length])
+    octets = bytearray()
+    while length:
+        octets.insert(0, length & 0xff)
+        length >>= 8
+    return bytearray([0x80 | len(octets)]) + octets
+
+
+def _tlv(tag, content):
+    """Build a TLV from its tag and content"""
+    return bytes(bytearray([tag]) + _encode_length(len(content)) + bytearray(content))
+
+
+def encode_integer(value, tag=INTEGER):
+    """Encode an integer of the given type"""
+    octets = bytearray()
+    while True:
+        octets.insert(0, value & 0xff)
+        value >>= 8
+        if value in (0, -1):
+            break
+    # Keep the sign bit right: negative for INTEGER only
+    if tag == INTEGER and value == -1 and not octets[0] & 0x80:
+        octets.insert(0, 0xff)
+    elif value == 0 and octets[0] & 0x80:
+        octets.insert(0, 0)
+    return _tlv(tag, octets)
+
+
+def encode_octets(value, tag=OCTET_STRING):
+    """Encode an octet string of the given type"""
+    if not isinstance(value, (bytes, bytearray)):
+        value = value.encode('utf-8')
+    return _tlv(tag, bytearray(value))
+
+
+def encode_null(tag=NULL):
+    """Encode a NULL or an SNMP exception"""
+    return _tlv(tag, b'')
+
+
+def encode_oid(oid):
+    """Encode an OID given as a tuple or a dotted string"""
+    if not isinstance(oid, tuple):
+        oid = parse_oid(oid)
+    octets = bytearray([40 * oid[0] + oid[1]])
+    for arc in oid[2:]:
+        chunk = bytearray([arc & 0x7f])
+        arc >>= 7
+        while arc:
+            chunk.insert(0, 0x80 | (arc & 0x7f))
+            arc >>= 7
+        octets += chunk
+    return _tlv(OID, octets)
+
+
+def encode_constructed(tag, *items):
+    """Encode a sequence or a PDU from already encoded items"""
+    return _tlv(tag, b''.join(items))
+
+
+def encode_value(tag, value):
+    """Encode a (tag, value) tuple as returned by decode"""
+    if tag == INTEGER or tag in _UNSIGNED:
+        return encode_integer(value, tag)
+    elif tag == OID:
+        return encode_oid(value)
+    elif tag in (NULL, NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW):
+        return encode_null(tag)
+    elif tag & 0x20:
+        return encode_constructed(tag, *[encode_value(*item) for item in value])
+    return encode_octets(value, tag)
+
+
+def encode_message(community, pdu_tag, request_id, varbinds,
+                   version=VERSION_2C, error_status=0, error_index=0):
+    """Encode an SNMP v1/v2c message
+
+    :param varbinds: list of (oid, (tag, value)) tuples
+    """
+    encoded = [encode_constructed(SEQUENCE, encode_oid(oid), encode_value(*value))
+               for oid, value in varbinds]
+    pdu = encode_constructed(
+        pdu_tag, encode_integer(request_id), encode_integer(error_status),
+        encode_integer(error_index), encode_constructed(SEQUENCE, *encoded))
+    return encode_constructed(
+        SEQUENCE, encode_integer(version), encode_octets(community), pdu)
+
+
+def decode_message(data):
+    """Decode an SNMP v1/v2c message
+
+    :returns: a dict with the version, community, pdu tag and varbinds
+              (as a list of (oid, (tag, value)) tuples) of the message, plus
+              the request_id, error_status and error_index of regular PDUs or
+              the enterprise, agent_addr, generic, specific and timestamp of
+              SNMPv1 traps
+    """
+    tag, items, _ = decode(data)
+    if tag != SEQUENCE or len(items) != 3:
+        raise BERError('Not an SNMP message')
+    (_, version), (_, community), (pdu_tag, pdu) = items
+    message = {'version': version, 'community': community, 'pdu': pdu_tag}
+    if pdu_tag == TRAP_V1:
+        if len(pdu) != 6:
+            raise BERError('Malformed SNMPv1 trap')
+        fields = ('enterprise', 'agent_addr', 'generic', 'specific', 'timestamp')
+        for field, (_, value) in zip(fields, pdu[:5]):
+            message[field] = value
+        varbinds = pdu[5][1]
+    else:
+        if len(pdu) != 4:
+            raise BERError('Malformed SNMP PDU')
+        fields = ('request_id', 'error_status', 'error_index')
+        for field, (_, value) in zip(fields, pdu[:3]):
+            message[field] = value
+        varbinds = pdu[3][1]
+    message['varbinds'] = [(varbind[0][1], varbind[1]) for _, varbind in varbinds]
+    return message
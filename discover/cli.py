@@ -3,13 +3,16 @@
    Implements the CLI interface using click
 """
 from __future__ import print_function
+import contextlib
 import logging
+import os
 import click
-from . import discovery
-from . import inventory
 # we need the config module to load the logging configuration
 from . import config
 
+# The subsystems are imported by the commands that need them, so read-only
+# commands never load the SNMP, IPMI or XML-RPC code
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,44 +32,131 @@ def cli():
 @click.option('--poweroff/--no-poweroff', default=False, help="Poweroff nodes for discovery")
 @click.option('--parallel/--no-parallel', default=True, help="Discover in parallel/sequential way")
 @click.option('--intelligent/--no-intelligent', default=True, help="Intelligent mode")
+@click.option('--profile/--no-profile', default=False,
+              help="Save a cProfile dump of the run with the metrics")
+@click.option('--refresh/--no-refresh', default=False,
+              help="Walk the switches instead of reusing the MAC tables of recent runs")
 @click.argument('nodename')
-def learn_cmd(poweron, poweroff, parallel, intelligent, nodename):
-    # The special keyword 'all' means to discover all nodes
-    if nodename.lower() == 'all':
-        try:
-            discovery.discover_all(parallel=parallel, poweron=poweron, poweroff=poweroff)
-        except discovery.ReachedRetryCount:
-            if intelligent:
-                # In intelligent mode: Let's try again in sequential mode
-                try:
-                    discovery.discover_all(
-                        parallel=False, poweron=poweron, poweroff=poweroff)
-                except discovery.DiscoveryFailedError as e:
-                    logger.error(e)
-                    click.echo('Unable to discover all nodes using intelligent mode')
-        inventory.show()
-    else:
-        try:
-            discovery.discover_node(nodename, poweron, poweroff)
-        except discovery.DiscoveryFailedError as e:
-            logger.error(e)
-            click.echo('Discovery failed: ' + str(e))
+def learn_cmd(poweron, poweroff, parallel, intelligent, profile, refresh, nodename):
+    """Discover the MACs of the nodes chosen by NODENAME
+
+    NODENAME is a node name, all, a range like node-10-[1-19], a glob like
+    'node-10-*' or a rack like rack:10.
+    """
+    from . import daemon
+    from . import selectors
+    # Fail before starting a run if the selector does not choose any node
+    with _selector_errors():
+        selectors.select(nodename)
+    if refresh:
+        from . import switch
+        switch.refresh_all()
+    elif not profile and daemon.running():
+        # The daemon has the MAC tables of the switches already warm
+        reply = daemon.request('learn', nodename=nodename, poweron=poweron,
+                               poweroff=poweroff, parallel=parallel, intelligent=intelligent)
+        _echo_error(reply.get('error'))
+        _show(nodename)
+        return
+    from . import metrics
+    metrics.reset()
+    try:
+        if profile:
+            path = metrics.directory()
+            if not os.path.exists(path):
+                os.makedirs(path)
+            with metrics.profile(os.path.join(path, 'profile.pstats')):
+                _learn(poweron, poweroff, parallel, intelligent, nodename)
+        else:
+            _learn(poweron, poweroff, parallel, intelligent, nodename)
+    finally:
+        # Even interrupted runs leave their metrics behind
+        metrics.write_run()
+
+
+@contextlib.contextmanager
+def _selector_errors():
+    """Report the selectors that do not choose any node as command errors"""
+    from . import selectors
+    try:
+        yield
+    except selectors.SelectorError as e:
+        raise click.ClickException(str(e))
+
+
+def _learn(poweron, poweroff, parallel, intelligent, nodename):
+    from . import discovery
+    _echo_error(discovery.learn(nodename, poweron, poweroff, parallel, intelligent))
+    _show(nodename)
+
+
+def _echo_error(error):
+    if error:
+        click.echo(error)
+
+
+def _show(nodename='all'):
+    """Show the inventory, through the daemon if it is running"""
+    from . import daemon
+    from . import inventory
+    if daemon.running():
+        reply = daemon.request('show', nodename=nodename)
+        if reply['ok']:
+            click.echo(reply['output'], nl=False)
+            return
+        logger.error('The daemon is unable to show the inventory: {}'.format(reply['error']))
+    with _selector_errors():
         inventory.show(nodename)
 
 
 @cli.command('show')
 def show_cmd():
-    inventory.show()
+    _show()
+
+
+@cli.command('lookup')
+@click.argument('mac')
+def lookup_cmd(mac):
+    """Show where a MAC is seen in the switches"""
+    from . import daemon
+    if daemon.running():
+        reply = daemon.request('lookup', mac=mac)
+        if not reply['ok']:
+            raise click.ClickException(reply['error'])
+        locations = reply['locations']
+    else:
+        from . import switch
+        switch.update(switch.all_switches(), max_age=switch.snapshot_ttl())
+        locations = switch.locate(mac)
+    for name, port, vlan in locations:
+        click.echo('{} port {} vlan {}'.format(name, port, vlan))
+    if not locations:
+        click.echo('MAC {} not found'.format(mac))
+
+
+@cli.command('serve')
+def serve_cmd():
+    """Keep the MAC tables warm and serve the other commands"""
+    from . import daemon
+    try:
+        daemon.Daemon().serve_forever()
+    except KeyboardInterrupt:
+        pass
 
 
 @cli.command('export')
+@click.option('--output', '-o', type=click.File('w'), default='-', help="Output file")
 @click.argument('format')
 @click.argument('nodename')
-def export_cmd(format, nodename):
-    supported_formats = ('cobbler', 'csv')
+def export_cmd(output, format, nodename):
+    from . import exporters
+    from . import inventory
+    supported_formats = ('cobbler', 'csv', 'jsonl', 'dhcpd', 'dnsmasq', 'ethers')
     if format == 'cobbler':
-        inventory.export_to_cobbler(nodename)
-    elif format == 'csv':
-        inventory.export_to_csv(nodename)
+        with _selector_errors():
+            inventory.export_to_cobbler(nodename)
+    elif format in supported_formats:
+        with _selector_errors():
+            exporters.export(format, nodename, output)
     else:
         click.echo('ERROR: Supported export formats: ' + str(supported_formats))
@@ -4,48 +4,311 @@
 """
 from __future__ import print_function, with_statement
 import logging
+import threading
 import xmlrpclib
+from multiprocessing.pool import ThreadPool
 from . import config
 
+# Maximum number of systems exported at the same time
+WORKERS = 8
+# Comment that marks the Cobbler systems created by discover
+MANAGED = 'Managed by discover'
+# Interface fields of modify_interface and their name in the system records
+_INTERFACE_FIELDS = {
+    'macaddress': 'mac_address',
+    'ipaddress': 'ip_address',
+    'netmask': 'netmask',
+}
+# Fields whose values are compared ignoring the case
+_MAC_FIELDS = ('mac_address',)
+_BOOLEAN_FIELDS = ('netboot_enabled',)
+
 logger = logging.getLogger(__name__)
 
-URL = config.settings['cobbler']['url']
-LOGIN = config.settings['cobbler']['login']
-PASSWORD = config.settings['cobbler']['password']
 
+class CobblerExportError(Exception):
+    """Unable to export some systems to Cobbler"""
+    pass
 
-def add(node):
-    """Add a node to cobbler"""
-    server = xmlrpclib.Server(URL)
-    token = server.login(LOGIN, PASSWORD)
-    logger.info('Adding {} to cobbler server {}'.format(node, URL))
 
-    system_id = server.new_system(token)
-    server.modify_system(system_id, 'name', node.name, token)
-    server.modify_system(system_id, 'hostname', node.name + '.local', token)
+def system_fields(node):
+    """Return the Cobbler fields of the system of a node, in edit order"""
     #FIXME: Find a way of given cobbler specific settings in the nodes.yml
     #       - node IP address
     #       - netmask
     #       - gateway
     #       - interface name
     #       - cobbler profile
-    server.modify_system(system_id, 'modify_interface', {
-        #"macaddress-eno1"   : node.switchports['SW14-1']['mac'],
-        #"ipaddress-eno1"    : node.bmcaddr.replace('.131.', '.119.'),
-        #"netmask-eno1"      : "255.255.0.0",
-        #"gateway-eno1"      : "10.119.0.1",
-        "macaddress-ens3f0"   : node.get_mac('x1'),
-        "ipaddress-ens3f0"    : node.bmcaddr.replace('.131.', '.119.'),
-        "netmask-ens3f0"      : "255.255.0.0",
-        "gateway-ens3f0"      : "10.119.0.1",
-    }, token)
-    server.modify_system(system_id, 'gateway', '10.119.0.1', token)
-    server.modify_system(system_id, 'profile', 'CentOS7-x86_64', token)
-    server.modify_system(system_id, 'power_type', 'imm', token)
-    server.modify_system(system_id, 'power_address', node.bmc.address, token)
-    server.modify_system(system_id, 'power_user', node.bmc.user, token)
-    server.modify_system(system_id, 'power_pass', node.bmc.passwd, token)
-    server.modify_system(system_id, 'netboot_enabled', True, token)
-
-    server.save_system(system_id, token)
-    server.sync(token)
+    return [
+        ('name', node.name),
+        ('hostname', node.name + '.local'),
+        ('modify_interface', {
+            "macaddress-ens3f0": node.get_mac('x1'),
+            "ipaddress-ens3f0": node.bmc.address.replace('.131.', '.119.'),
+            "netmask-ens3f0": "255.255.0.0",
+            "gateway-ens3f0": "10.119.0.1",
+        }),
+        ('gateway', '10.119.0.1'),
+        ('profile', 'CentOS7-x86_64'),
+        ('power_type', 'imm'),
+        ('power_address', node.bmc.address),
+        ('power_user', node.bmc.user),
+        ('power_pass', node.bmc.password),
+        ('netboot_enabled', True),
+        ('comment', MANAGED),
+    ]
+
+
+def _normalize(field, value):
+    """Normalize a field value so records and edits can be compared
+
+    Only MACs and booleans are case-insensitive, any other value has to
+    match exactly.
+    """
+    if field in _BOOLEAN_FIELDS:
+        if isinstance(value, bool):
+            return value
+        return str(value).strip().lower() in ('true', '1', 'yes')
+    value = str(value).strip()
+    if field in _MAC_FIELDS:
+        return value.lower()
+    return value
+
+
+def desired_state(fields):
+    """Return the comparable state of a system from its edit fields"""
+    state = {}
+    for field, value in fields:
+        if field == 'modify_interface':
+            for key, item in value.items():
+                name, device = key.split('-', 1)
+                if name in _INTERFACE_FIELDS:
+                    attribute = _INTERFACE_FIELDS[name]
+                    state[(device, attribute)] = _normalize(attribute, item)
+        elif field != 'name':
+            state[field] = _normalize(field, value)
+    return state
+
+
+def current_state(system, keys):
+    """Return the comparable state of a Cobbler system record
+
+    Only the given keys, as returned by `desired_state`, are taken into
+    account, so other settings edited by hand in Cobbler are left alone.
+    """
+    interfaces = system.get('interfaces') or {}
+    state = {}
+    for key in keys:
+        if isinstance(key, tuple):
+            device, name = key
+            value = interfaces.get(device, {}).get(name)
+        else:
+            name = key
+            value = system.get(key)
+        state[key] = None if value is None else _normalize(name, value)
+    return state
+
+
+class Plan(object):
+    """Changes needed to bring Cobbler in line with the inventory"""
+    def __init__(self):
+        self.created = []
+        self.changed = []
+        self.removed = []
+        self.unchanged = []
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.created) + len(self.changed) + len(self.removed)
+
+    def __repr__(self):
+        return '<Plan: {} created, {} changed, {} removed, {} unchanged>'.format(
+            len(self.created), len(self.changed), len(self.removed), len(self.unchanged))
+
+
+class Exporter(object):
+    """Bulk exporter of nodes to Cobbler
+
+    It logs in once, fetches the current systems in a single call and
+    only pushes the systems that were created, changed or removed, with a
+    bounded pool of workers, each one with its own connection. The edits
+    of each system are sent in a single XML-RPC multicall when the server
+    supports it. Cobbler is synced only once, at the end of the export,
+    and only if something was pushed.
+    """
+    def __init__(self, url=None, login=None, password=None, workers=None, multicall=None):
+        settings = config.settings.get('cobbler', {})
+        self.url = url or settings['url']
+        self.login = login or settings['login']
+        self.password = password or settings['password']
+        self.workers = workers or settings.get('workers', WORKERS)
+        if multicall is None:
+            multicall = settings.get('multicall', True)
+        self.multicall = multicall
+        self._local = threading.local()
+        self._token = None
+
+    def _server(self):
+        """Return the connection of the current thread"""
+        if not hasattr(self._local, 'server'):
+            self._local.server = xmlrpclib.ServerProxy(self.url, allow_none=True)
+        return self._local.server
+
+    def plan(self, nodes, prune=False):
+        """Compare the nodes with the systems currently in Cobbler
+
+        :param prune: remove the systems managed by discover that are not
+                      in the given nodes
+        """
+        systems = dict((system['name'], system) for system in self._server().get_systems())
+        plan = Plan()
+        names = set()
+        for node in nodes:
+            names.add(node.name)
+            try:
+                desired = desired_state(system_fields(node))
+            except Exception as error:
+                # Missing MACs and other data problems of the node
+                plan.errors[node.name] = '{}: {}'.format(error.__class__.__name__, error)
+                continue
+            system = systems.get(node.name)
+            if system is None:
+                plan.created.append(node)
+            elif current_state(system, desired) != desired:
+                plan.changed.append(node)
+            else:
+                plan.unchanged.append(node)
+        if prune:
+            plan.removed = sorted(name for name, system in systems.items()
+                                  if name not in names and system.get('comment') == MANAGED)
+        return plan
+
+    def export(self, nodes, sync=True, prune=False):
+        """Bring the systems of the given nodes up to date in Cobbler
+
+        :param prune: also remove the systems managed by discover that are
+                      not in the given nodes
+        :returns: a dict with the error of every node that failed
+        """
+        nodes = list(nodes)
+        if not nodes and not prune:
+            return {}
+        self._token = self._server().login(self.login, self.password)
+        plan = self.plan(nodes, prune)
+        errors = plan.errors
+        for name, error in errors.items():
+            logger.error('Unable to add {} to cobbler: {}'.format(name, error))
+        logger.info('Cobbler server {}: {!r}'.format(self.url, plan))
+        if not plan:
+            logger.info('Cobbler is up to date, skipping sync')
+            return errors
+        if self.multicall:
+            self.multicall = self._supports_multicall()
+        tasks = ([(self._add, node, node.name) for node in plan.created] +
+                 [(self._edit, node, node.name) for node in plan.changed] +
+                 [(self._remove, name, name) for name in plan.removed])
+        pool = ThreadPool(max(1, min(self.workers, len(tasks))))
+        try:
+            outcomes = pool.map(lambda task: task[0](task[1]), tasks)
+        finally:
+            pool.close()
+            pool.join()
+        for (_, _, name), error in zip(tasks, outcomes):
+            if error is not None:
+                logger.error('Unable to update {} in cobbler: {}'.format(name, error))
+                errors[name] = error
+        if sync and len(errors) - len(plan.errors) < len(tasks):
+            self.sync()
+        return errors
+
+    def _supports_multicall(self):
+        """Check if the server supports multicall with an empty one
+
+        Cobbler rejects the unknown methods with a fault that does not
+        always name them, so any fault means it is not supported.
+        """
+        try:
+            self._server().system.multicall([])
+        except xmlrpclib.Fault as fault:
+            logger.info('Cobbler server does not support multicall: {}'.format(
+                fault.faultString))
+            return False
+        return True
+
+    def sync(self):
+        """Sync the Cobbler configuration"""
+        logger.info('Syncing cobbler server {}'.format(self.url))
+        self._server().sync(self._token)
+
+    def _add(self, node):
+        """Add a node returning the error message if it fails"""
+        return self._call(self.add, node)
+
+    def _edit(self, node):
+        """Edit a node returning the error message if it fails"""
+        return self._call(self.edit, node)
+
+    def _remove(self, name):
+        """Remove a system returning the error message if it fails"""
+        return self._call(self.remove, name)
+
+    @staticmethod
+    def _call(method, arg):
+        """Call the method returning the error message if it fails"""
+        try:
+            method(arg)
+        except (xmlrpclib.Error, IOError) as error:
+            return str(error)
+        except Exception as error:
+            return '{}: {}'.format(error.__class__.__name__, error)
+        return None
+
+    def add(self, node):
+        """Add a single node to Cobbler"""
+        logger.debug('Adding {} to cobbler server {}'.format(node.name, self.url))
+        self._save(self._server().new_system(self._token), system_fields(node))
+
+    def edit(self, node):
+        """Update the system of a node already in Cobbler"""
+        logger.debug('Updating {} in cobbler server {}'.format(node.name, self.url))
+        self._save(self._server().get_system_handle(node.name, self._token),
+                   system_fields(node))
+
+    def remove(self, name):
+        """Remove a system from Cobbler"""
+        logger.debug('Removing {} from cobbler server {}'.format(name, self.url))
+        self._server().remove_system(name, self._token)
+
+    def _save(self, system_id, fields):
+        """Apply the fields to the system and save it"""
+        server = self._server()
+        token = self._token
+        if self.multicall:
+            calls = xmlrpclib.MultiCall(server)
+            for field, value in fields:
+                calls.modify_system(system_id, field, value, token)
+            calls.save_system(system_id, token)
+            # Raises the first fault of the calls
+            tuple(calls())
+            return
+        for field, value in fields:
+            server.modify_system(system_id, field, value, token)
+        server.save_system(system_id, token)
+
+
+def add(node):
+    """Add a node to cobbler"""
+    errors = Exporter().export([node])
+    if errors:
+        raise CobblerExportError(errors[node.name])
+
+
+def export(nodes):
+    """Make cobbler match the given nodes syncing it at most once
+
+    Systems created by discover that are not in the nodes are removed.
+    """
+    errors = Exporter().export(nodes, prune=True)
+    if errors:
+        raise CobblerExportError('Unable to export {} systems: {}'.format(
+            len(errors), ', '.join(sorted(errors))))
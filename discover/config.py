@@ -4,10 +4,15 @@
 """
 from __future__ import print_function, with_statement
 import os
+import glob
+import hashlib
 import logging
 import logging.config
-import yaml
-from jinja2 import Environment, FileSystemLoader
+import cPickle as pickle
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 
 DEFAULT_CONF_DIRS = [os.path.expanduser('~/.discover'), '/etc/discover', './config']
@@ -17,10 +22,10 @@ NODESFILE = 'nodes.yml'
 LOGCONFFILE = 'logging.yml'
 SETTINGSFILE = 'settings.yml'
 
-switches = {}
-nodes = {}
-logconf = {}
-settings = {}
+# Rendered and parsed config files are cached here
+CACHE_DIR = os.path.expanduser('~/.discover/cache')
+
+_env = None
 
 
 class Config():
@@ -56,13 +61,7 @@ class Config():
 
     def _load_file(self, filename):
         """Return a object representing the contents of a yaml file"""
-        env = Environment(loader=FileSystemLoader(DEFAULT_CONF_DIRS, followlinks=True))
-        template = env.get_template(filename)
-        ymlfile = template.render(switches=switches, nodes=nodes)
-        return yaml.load(ymlfile)
-
-        #with open(filename, 'r') as ymlfile:
-        #    return yaml.load(ymlfile)
+        return _load_file(filename)
 
     def __repr__(self):
         return '<{}(switches={}, nodes={}, logconf={})>'.format(
@@ -73,13 +72,147 @@ class Config():
         )
 
 
-# Load config and expose it globally
-for confdir in DEFAULT_CONF_DIRS:
-    if os.path.exists(confdir):
-        cfg = Config(confdir)
-        logging.config.dictConfig(cfg.logconf)
-        switches = cfg.switches
-        nodes = cfg.nodes
-        logconf = cfg.logconf
-        settings = cfg.settings
-        logging.debug('Configuration loaded from {}'.format(confdir))
+class LazyFile(Mapping):
+    """Read-only mapping with the contents of a configuration file
+
+    The file is only rendered and parsed the first time it is accessed, so
+    commands that do not need it do not pay for it.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._data = None
+        self._key = None
+
+    def _contents(self):
+        if self._data is None:
+            if any(os.path.exists(confdir) for confdir in DEFAULT_CONF_DIRS):
+                self._key = _cache_key(self.filename)
+                self._data = _load_file(self.filename, self._key) or {}
+                logging.debug('Configuration file {} loaded'.format(self.filename))
+            else:
+                self._data = {}
+        return self._data
+
+    def reload(self):
+        """Forget the contents if the config files changed since they were loaded
+
+        They are loaded again the next time they are accessed.
+
+        :returns: True if the contents were forgotten
+        """
+        if self._data is None or self._key is None or self._key == _cache_key(self.filename):
+            return False
+        logging.info('Configuration file {} changed'.format(self.filename))
+        self._data = None
+        return True
+
+    def __getitem__(self, key):
+        return self._contents()[key]
+
+    def __iter__(self):
+        return iter(self._contents())
+
+    def __len__(self):
+        return len(self._contents())
+
+    def __repr__(self):
+        return '<{}({})>'.format(self.__class__.__name__, self.filename)
+
+
+def _load_file(filename, key=None):
+    """Return a object representing the contents of a yaml file
+
+    The rendered and parsed contents are cached on disk, keyed by a hash of
+    the files in DEFAULT_CONF_DIRS, so the cache is invalidated whenever any
+    of them changes.
+    """
+    if key is None:
+        key = _cache_key(filename)
+    cachefile = os.path.join(CACHE_DIR, '{}.{}.pickle'.format(filename, key))
+    try:
+        with open(cachefile, 'rb') as cached:
+            return pickle.load(cached)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        pass
+    data = _render_file(filename, _template_inputs(filename))
+    _write_cache(filename, cachefile, data)
+    return data
+
+
+def _template_inputs(filename):
+    """Return the contents of the config files a template can use
+
+    The files are always loaded in the same order, the switches and then
+    the nodes, and a template only sees the files before its own. So the
+    rendered contents only depend on the config files themselves.
+    """
+    inputs = {'switches': {}, 'nodes': {}}
+    if filename != SWFILE:
+        inputs['switches'] = switches
+    if filename not in (SWFILE, NODESFILE):
+        inputs['nodes'] = nodes
+    return inputs
+
+
+def _render_file(filename, inputs):
+    """Render a yaml template and parse it"""
+    global _env
+    import yaml
+    if _env is None:
+        from jinja2 import Environment, FileSystemLoader
+        _env = Environment(loader=FileSystemLoader(DEFAULT_CONF_DIRS, followlinks=True))
+    ymlfile = _env.get_template(filename).render(**inputs)
+    # Use the libyaml parser when available: it is much faster
+    return yaml.load(ymlfile, Loader=getattr(yaml, 'CLoader', yaml.Loader))
+
+
+def _cache_key(filename):
+    """Hash the config files"""
+    digest = hashlib.sha1(filename.encode('utf-8'))
+    for confdir in DEFAULT_CONF_DIRS:
+        for path in sorted(glob.glob(os.path.join(confdir, '*'))):
+            if os.path.isfile(path):
+                digest.update(path.encode('utf-8'))
+                with open(path, 'rb') as conffile:
+                    digest.update(conffile.read())
+    return digest.hexdigest()
+
+
+def _write_cache(filename, cachefile, data):
+    """Atomically replace the cached versions of a config file"""
+    try:
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        for stale in glob.glob(os.path.join(CACHE_DIR, filename + '.*.pickle')):
+            os.remove(stale)
+        tmpfile = '{}.{}.tmp'.format(cachefile, os.getpid())
+        with open(tmpfile, 'wb') as cached:
+            pickle.dump(data, cached, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfile, cachefile)
+    except (IOError, OSError) as error:
+        logging.debug('Unable to cache {}: {}'.format(filename, error))
+
+
+def reload():
+    """Forget the config files that changed since they were loaded
+
+    Long-running processes call it to pick up the changes of the
+    configuration. The logging configuration is not applied again.
+
+    :returns: True if any of them changed
+    """
+    changed = False
+    for lazyfile in (switches, nodes, logconf, settings):
+        changed = lazyfile.reload() or changed
+    return changed
+
+
+# Expose the config globally: each file is loaded when first used
+switches = LazyFile(SWFILE)
+nodes = LazyFile(NODESFILE)
+logconf = LazyFile(LOGCONFFILE)
+settings = LazyFile(SETTINGSFILE)
+
+# The logging configuration is needed right away
+if logconf:
+    logging.config.dictConfig(dict(logconf))
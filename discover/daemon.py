@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""Daemon module
+   Implements `discover serve`: a long-running process that keeps the MAC
+   tables of all the switches warm and answers the requests of the CLI
+   over a local Unix socket.
+
+   The protocol is one JSON object per line: the client sends a request
+   with a "command" and its parameters and the daemon answers with
+   {"ok": true, ...} or {"ok": false, "error": "..."}.
+"""
+from __future__ import print_function, with_statement
+import errno
+import io
+import json
+import logging
+import os
+import socket
+import SocketServer
+import threading
+from . import config
+from . import metrics
+
+# Unix socket where the daemon listens
+DEFAULT_SOCKET = os.path.expanduser('~/.discover/discover.sock')
+# Seconds between two background refreshes of the MAC tables
+REFRESH_INTERVAL = 30
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonNotRunning(Exception):
+    """There is no daemon listening on the socket"""
+    pass
+
+
+def _settings():
+    return config.settings.get('daemon', {})
+
+
+def socket_path():
+    """Return the path of the socket of the daemon"""
+    return os.path.expanduser(_settings().get('socket', DEFAULT_SOCKET))
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    """Answers a single request"""
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            command = request.pop('command')
+            method = self.server.commands[command]
+        except (ValueError, KeyError, TypeError):
+            reply = {'ok': False, 'error': 'Invalid request'}
+        else:
+            try:
+                reply = method(**request)
+                reply['ok'] = True
+            except Exception as error:
+                logger.exception('Request {} failed'.format(command))
+                reply = {'ok': False, 'error': '{}: {}'.format(
+                    error.__class__.__name__, error)}
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon(object):
+    """Keeps the MAC tables of the switches warm and serves the CLI
+
+    The tables are refreshed every refresh_interval seconds in a
+    background thread, so the requests never wait for a switch walk.
+    """
+    def __init__(self, path=None, refresh_interval=None):
+        self.path = path or socket_path()
+        self.refresh_interval = refresh_interval or _settings().get(
+            'refresh_interval', REFRESH_INTERVAL)
+        self._stopped = threading.Event()
+        self._refreshed = threading.Event()
+        # Learns power the nodes on and off: only one runs at a time
+        self._learn_lock = threading.Lock()
+        self._config_lock = threading.Lock()
+        self._server = None
+        self.commands = {
+            'ping': self.ping,
+            'learn': self.learn,
+            'lookup': self.lookup,
+            'show': self.show,
+        }
+
+    def serve_forever(self):
+        """Serve until stopped, listening for traps if they are enabled"""
+        from . import traps
+        self.start()
+        try:
+            with traps.listen():
+                while not self._stopped.wait(1):
+                    pass
+        finally:
+            self.stop()
+
+    def start(self):
+        """Start listening and refreshing in background threads"""
+        _remove_stale_socket(self.path)
+        self._server = _Server(self.path, _Handler)
+        self._server.commands = self.commands
+        # Only the user running the daemon can talk to it
+        os.chmod(self.path, 0o600)
+        for target, name in ((self._server.serve_forever, 'daemon-server'),
+                             (self._refresh_loop, 'daemon-refresh')):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+        logger.info('Listening on {}'.format(self.path))
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def wait_refreshed(self, timeout=None):
+        """Wait for the first refresh of the tables"""
+        return self._refreshed.wait(timeout)
+
+    def reload_config(self):
+        """Pick up the changes of the config files, rebuilding the switches"""
+        from . import switch
+        with self._config_lock:
+            if config.reload():
+                switch.reconfigure()
+
+    def _refresh_loop(self):
+        from . import switch
+        while not self._stopped.is_set():
+            try:
+                self.reload_config()
+                switch.update(switch.all_switches())
+            except Exception:
+                logger.exception('Unable to refresh the MAC tables')
+            self._refreshed.set()
+            self._stopped.wait(self.refresh_interval)
+
+    def ping(self):
+        return {'pid': os.getpid()}
+
+    def learn(self, nodename, poweron=True, poweroff=False, parallel=True,
+              intelligent=True):
+        from . import discovery
+        with self._learn_lock:
+            self.reload_config()
+            metrics.reset()
+            try:
+                error = discovery.learn(nodename, poweron, poweroff, parallel, intelligent)
+            finally:
+                metrics.write_run()
+        return {'error': error}
+
+    def lookup(self, mac):
+        from . import switch
+        return {'locations': switch.locate(mac)}
+
+    def show(self, format='table', nodename='all'):
+        from . import exporters
+        output = io.StringIO()
+        exporters.export(format, nodename, _TextWriter(output))
+        return {'output': output.getvalue()}
+
+
+class _TextWriter(object):
+    """Text stream that accepts byte and unicode strings"""
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        self.output.write(text)
+
+    def flush(self):
+        pass
+
+
+def _remove_stale_socket(path):
+    """Remove the socket of a daemon that is not running anymore"""
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        return
+    try:
+        request('ping', path=path)
+    except DaemonNotRunning:
+        os.remove(path)
+        return
+    raise RuntimeError('A daemon is already listening on {}'.format(path))
+
+
+def request(command, path=None, timeout=None, **params):
+    """Send a request to the daemon and return its answer
+
+    :raises DaemonNotRunning: if no daemon is listening
+    """
+    path = path or socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except socket.error as error:
+            if error.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                raise DaemonNotRunning(path)
+            raise
+        params['command'] = command
+        sock.sendall((json.dumps(params) + '\n').encode('utf-8'))
+        reply = sock.makefile('rb').readline()
+    finally:
+        sock.close()
+    return json.loads(reply.decode('utf-8'))
+
+
+def running():
+    """Check if the daemon is running"""
+    if not os.path.exists(socket_path()):
+        return False
+    try:
+        request('ping', timeout=5)
+    except (DaemonNotRunning, socket.error):
+        return False
+    return True
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""DHCP module
+   Implements the passive listeners of the DHCP requests sent by the nodes
+   when they PXE boot, so a booting node is resolved right away instead of
+   at the next poll of the switches.
+
+   The requests are received either on a local BOOTP socket or by following
+   the log of a dhcpd or dnsmasq server. Nothing is ever answered.
+"""
+from __future__ import print_function, with_statement
+import contextlib
+import logging
+import os
+import re
+import socket
+import struct
+import threading
+import time
+from . import config
+from . import inventory
+from . import switch
+from .fdb import mac_to_int, mac_to_str
+
+# Port where the DHCP servers receive the requests
+SERVER_PORT = 67
+# First bytes of the options of a DHCP message
+MAGIC_COOKIE = b'\x63\x82\x53\x63'
+# BOOTP op of the messages sent by the clients
+BOOTREQUEST = 1
+# BOOTP htype and hlen of Ethernet
+HTYPE_ETHERNET = 1
+HLEN_ETHERNET = 6
+# DHCP options
+OPTION_PAD = 0
+OPTION_MESSAGE_TYPE = 53
+OPTION_VENDOR_CLASS = 60
+OPTION_END = 255
+# DHCP message types sent by a booting client
+DHCPDISCOVER = 1
+DHCPREQUEST = 3
+# Vendor class identifier sent by the PXE firmware, other requests are ignored
+PXE_VENDOR_CLASS = b'PXEClient'
+# Minimum seconds between two walks of the switches triggered by requests:
+# short, so nodes booting close together are still resolved right away
+MIN_WALK_INTERVAL = 5
+# Seconds between two reads of a log that did not grow
+LOG_POLL_INTERVAL = 0.5
+
+# op, htype, hlen, hops, xid, secs, flags, ciaddr, yiaddr, siaddr, giaddr,
+# chaddr, sname and file
+_BOOTP = struct.Struct('!BBBBIHH4s4s4s4s16s64s128s')
+# Requests logged by dhcpd ("DHCPDISCOVER from 00:11:22:33:44:55 via eth0")
+# and dnsmasq ("DHCPDISCOVER(eth0) 00:11:22:33:44:55")
+_LOG_REQUEST = re.compile(r'\bDHCP(?:DISCOVER|REQUEST)\b.*?\b((?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2})\b')
+
+# MACs that requested an address and are not in the known MAC tables
+_unlocated = set()
+_lock = threading.Lock()
+# Time of the last walk triggered by requests
+_last_walk = 0
+# Timer that wakes the resolve up when the next walk is allowed
+_retry = None
+
+logger = logging.getLogger(__name__)
+
+
+def parse_request(data):
+    """Extract the client MAC of a DHCPDISCOVER or DHCPREQUEST of a PXE client
+
+    :returns: the MAC as a 48-bit integer, None if the packet is not a
+              request of the PXE firmware of an Ethernet client
+    """
+    if len(data) < _BOOTP.size + len(MAGIC_COOKIE):
+        return None
+    fields = _BOOTP.unpack_from(data)
+    op, htype, hlen, chaddr = fields[0], fields[1], fields[2], fields[11]
+    if op != BOOTREQUEST or htype != HTYPE_ETHERNET or hlen != HLEN_ETHERNET:
+        return None
+    if data[_BOOTP.size:_BOOTP.size + len(MAGIC_COOKIE)] != MAGIC_COOKIE:
+        return None
+    options = _options(bytearray(data[_BOOTP.size + len(MAGIC_COOKIE):]))
+    message_type = options.get(OPTION_MESSAGE_TYPE, bytearray())
+    if len(message_type) != 1 or message_type[0] not in (DHCPDISCOVER, DHCPREQUEST):
+        return None
+    if not options.get(OPTION_VENDOR_CLASS, bytearray()).startswith(PXE_VENDOR_CLASS):
+        return None
+    mac = 0
+    for octet in bytearray(chaddr[:HLEN_ETHERNET]):
+        mac = (mac << 8) | octet
+    return mac
+
+
+def _options(options):
+    """Return the values of the DHCP options by code"""
+    values = {}
+    offset = 0
+    while offset < len(options):
+        code = options[offset]
+        if code == OPTION_END:
+            break
+        if code == OPTION_PAD:
+            offset += 1
+            continue
+        if offset + 1 >= len(options):
+            break
+        length = options[offset + 1]
+        if offset + 2 + length > len(options):
+            break
+        values[code] = options[offset + 2:offset + 2 + length]
+        offset += 2 + length
+    return values
+
+
+def encode_request(mac, message_type=DHCPDISCOVER, xid=0,
+                   vendor_class=PXE_VENDOR_CLASS + b':Arch:00000:UNDI:002001'):
+    """Encode the DHCP request a PXE client broadcasts
+
+    It can be used to stand in for booting nodes when testing the listener.
+    """
+    chaddr = struct.pack('!Q', mac_to_int(mac))[2:]
+    options = bytearray([OPTION_MESSAGE_TYPE, 1, message_type])
+    if vendor_class:
+        options += bytearray([OPTION_VENDOR_CLASS, len(vendor_class)]) + bytearray(vendor_class)
+    options.append(OPTION_END)
+    return (_BOOTP.pack(BOOTREQUEST, HTYPE_ETHERNET, HLEN_ETHERNET, 0, xid, 0, 0x8000,
+                        b'\0' * 4, b'\0' * 4, b'\0' * 4, b'\0' * 4, chaddr, b'', b'') +
+            MAGIC_COOKIE + bytes(options))
+
+
+def parse_log_line(line):
+    """Extract the client MAC of a request logged by dhcpd or dnsmasq
+
+    :returns: the MAC as a 48-bit integer, None if the line is not a request
+    """
+    match = _LOG_REQUEST.search(line)
+    if match is None:
+        return None
+    return mac_to_int(match.group(1))
+
+
+class DHCPListener(threading.Thread):
+    """Receives the DHCP requests on a local UDP socket in a background thread
+
+    The handler is called with the MAC of every request received. The
+    socket is only read: the DHCP server of the network answers.
+    """
+    def __init__(self, handler, address='0.0.0.0', port=SERVER_PORT):
+        super(DHCPListener, self).__init__(name='dhcp-listener')
+        self.daemon = True
+        self.handler = handler
+        self._stopped = threading.Event()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self._sock.bind((address, port))
+        self._sock.settimeout(0.5)
+        self.address = self._sock.getsockname()
+
+    def run(self):
+        logger.info('Listening for DHCP requests on {}:{}'.format(*self.address))
+        while not self._stopped.is_set():
+            try:
+                data, _ = self._sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            mac = parse_request(data)
+            if mac is None:
+                continue
+            try:
+                self.handler(mac)
+            except Exception:
+                logger.exception('Unable to process DHCP request of {}'.format(mac_to_str(mac)))
+        self._sock.close()
+
+    def stop(self):
+        """Stop listening"""
+        self._stopped.set()
+        self.join()
+
+
+class LogFollower(threading.Thread):
+    """Follows the log of a DHCP server in a background thread
+
+    Only the lines written after it starts are read. The log is opened
+    again when it is rotated. The handler is called with the MAC of every
+    request logged.
+    """
+    def __init__(self, handler, filename, interval=LOG_POLL_INTERVAL):
+        super(LogFollower, self).__init__(name='dhcp-log-follower')
+        self.daemon = True
+        self.handler = handler
+        self.filename = filename
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._file = None
+        self._inode = None
+        self._open(at_end=True)
+
+    def _open(self, at_end=False):
+        """Open the log, at its end the first time, returning if it was opened"""
+        try:
+            logfile = open(self.filename)
+        except IOError:
+            return False
+        if self._file is not None:
+            self._file.close()
+        if at_end:
+            logfile.seek(0, os.SEEK_END)
+        self._file = logfile
+        self._inode = os.fstat(logfile.fileno()).st_ino
+        return True
+
+    def _rotated(self):
+        """Check if the log was replaced or truncated"""
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        return stat.st_ino != self._inode or stat.st_size < self._file.tell()
+
+    def run(self):
+        logger.info('Following the DHCP requests logged in {}'.format(self.filename))
+        while not self._stopped.is_set():
+            line = ''
+            if self._file is not None:
+                position = self._file.tell()
+                line = self._file.readline()
+                if line and not line.endswith('\n'):
+                    # Wait for the rest of a line being written
+                    self._file.seek(position)
+                    line = ''
+            if not line:
+                if (self._file is None or self._rotated()) and self._open():
+                    continue
+                self._stopped.wait(self.interval)
+                continue
+            mac = parse_log_line(line)
+            if mac is None:
+                continue
+            try:
+                self.handler(mac)
+            except Exception:
+                logger.exception('Unable to process DHCP request of {}'.format(mac_to_str(mac)))
+        if self._file is not None:
+            self._file.close()
+
+    def stop(self):
+        """Stop following the log"""
+        self._stopped.set()
+        self.join()
+
+
+def apply_request(mac, wakeup=None):
+    """Correlate the MAC of a DHCP request with the MAC tables
+
+    The MACs of the nodes already in the inventory are ignored. The other
+    ones are kept as unlocated if the known MAC tables do not have them, so
+    the next resolve walks the switches to locate them. If a walk is not
+    allowed yet, the wakeup is set again as soon as it is.
+    """
+    global _retry
+    if inventory.find_by_mac(mac_to_str(mac)):
+        return
+    locations = switch.locate(mac)
+    if locations:
+        logger.debug('DHCP request of {} seen on {}'.format(mac_to_str(mac), locations))
+    else:
+        logger.debug('DHCP request of unlocated {}'.format(mac_to_str(mac)))
+        with _lock:
+            _unlocated.add(mac)
+            delay = _last_walk + _min_walk_interval() - time.time()
+            if wakeup is not None and delay > 0 and (_retry is None or not _retry.is_alive()):
+                _retry = threading.Timer(delay, wakeup.set)
+                _retry.daemon = True
+                _retry.start()
+    if wakeup is not None:
+        wakeup.set()
+
+
+def _min_walk_interval():
+    return config.settings.get('dhcp', {}).get('min_walk_interval', MIN_WALK_INTERVAL)
+
+
+def take_unlocated(min_interval=None):
+    """Return and forget the MACs that requested an address and were not located
+
+    The MACs located since their request are dropped. The others are only
+    returned once every min_interval seconds, dhcp.min_walk_interval in the
+    settings by default, so booting nodes do not make the switches be walked
+    over and over: until then they are kept for later.
+    """
+    global _last_walk
+    if min_interval is None:
+        min_interval = _min_walk_interval()
+    with _lock:
+        macs = set(_unlocated)
+    located = set(mac for mac in macs if switch.locate(mac))
+    with _lock:
+        _unlocated.difference_update(located)
+        macs -= located
+        if not macs or time.time() - _last_walk < min_interval:
+            return set()
+        _unlocated.difference_update(macs)
+        _last_walk = time.time()
+    return macs
+
+
+@contextlib.contextmanager
+def listen(wakeup=None, settings=None):
+    """Listen for DHCP requests while in the context if enabled in the settings
+
+    :param wakeup: event set whenever a node sends a request
+    """
+    if settings is None:
+        settings = config.settings.get('dhcp', {})
+    if not settings.get('enabled', False):
+        yield None
+        return
+    handler = lambda mac: apply_request(mac, wakeup)
+    if settings.get('log'):
+        listener = LogFollower(handler, settings['log'])
+    else:
+        listener = DHCPListener(handler, settings.get('address', '0.0.0.0'),
+                                settings.get('port', SERVER_PORT))
+    listener.start()
+    try:
+        yield listener
+    finally:
+        listener.stop()
+        with _lock:
+            _unlocated.clear()
+            if _retry is not None:
+                _retry.cancel()
@@ -4,16 +4,20 @@
 """
 from __future__ import print_function, with_statement
 import logging
-import time
-from .node import Node
+from .node import Node, config_hash
+from .scheduler import Scheduler
+from . import power
 from . import switch
+from . import traps
 from . import config
+from . import dhcp
 from . import inventory
+from . import metrics
+from . import selectors
 
-# Number of retries
-RETRIES = 6
-# Time between retries
-DELAY = 60
+# Look for the MACs among the LLDP neighbors of the switches before
+# booting the nodes
+LLDP = True
 
 logger = logging.getLogger(__name__)
 
@@ -33,73 +37,132 @@ class ReachedRetryCount(DiscoveryFailedError):
     pass
 
 
+def learn(nodename, poweron=True, poweroff=False, parallel=True, intelligent=True):
+    """Discover the nodes chosen by a selector, as the learn command does
+
+    The selector can be a node name, 'all' or any of the selectors of the
+    selectors module, like node-10-[1-19] or rack:10.
+
+    :returns: a message describing the failure, None if it succeeded
+    """
+    try:
+        nodenames = selectors.select(nodename)
+    except selectors.SelectorError as e:
+        return str(e)
+    if nodenames != [nodename]:
+        try:
+            discover_nodes(nodenames, parallel=parallel, poweron=poweron, poweroff=poweroff)
+        except ReachedRetryCount as e:
+            if not intelligent:
+                return str(e)
+            # In intelligent mode: Let's try again in sequential mode
+            try:
+                discover_nodes(nodenames, parallel=False, poweron=poweron, poweroff=poweroff)
+            except DiscoveryFailedError as e:
+                logger.error(e)
+                return 'Unable to discover all nodes using intelligent mode'
+    else:
+        try:
+            discover_node(nodename, poweron, poweroff)
+        except DiscoveryFailedError as e:
+            logger.error(e)
+            return 'Discovery failed: ' + str(e)
+    return None
+
+
 def discover_all(parallel=True, poweron=True, poweroff=False):
     """Discover all nodes given in the configuration"""
+    return discover_nodes(list(config.nodes), parallel, poweron, poweroff)
+
+
+def discover_nodes(nodenames, parallel=True, poweron=True, poweroff=False):
+    """Discover the given nodes
+
+    In parallel mode all the nodes are resolved together: every switch
+    involved is walked once per round whatever the number of nodes on it.
+    """
     nodes = []
 
-    # If we have to do sequential discovery
-    if not parallel:
-        for nodename in config.nodes:
-            node = discover_node(nodename, poweron=poweron)
-            nodes.append(node)
-        return nodes
+    with inventory.Session() as session, metrics.timer('discovery_run'):
+        # If we have to do sequential discovery
+        if not parallel:
+            for nodename in nodenames:
+                node = discover_node(nodename, poweron=poweron, session=session)
+                nodes.append(node)
+            return nodes
 
-    # In other case let's do it in parallel
-    for nodename in config.nodes:
-        node = discover_node(nodename, poweron=False)
-        nodes.append(node)
-    for node in nodes:
-        if node.has_missing_macs():
-            if node.is_off():
-                # Temporarily activating PXE helps in the discovery
-                logger.info('Temporarily activating PXE on node {}'.format(node.name))
-                node.activate_pxe()
-                logger.info('Powering on node {}'.format(node.name))
-                node.power_on()
-            else:
-                if poweroff:
-                    logger.info('Powering off node {}'.format(node.name))
-                    node.power_off()
-                    # Temporarily activating PXE helps in the discovery
-                    logger.info('Temporarily activating PXE on node {}'.format(node.name))
-                    node.activate_pxe()
-                    logger.info('Powering on node {}'.format(node.name))
-                    node.power_on()
-                else:
-                    logger.warn(
-                        '{} with missing MACs is already on'.format(node.name))
-                    logger.warn(
-                        'CLI is run without poweroff option so you should reboot the node manually')
-    for attempt in range(RETRIES):
-        logger.info('Attempt {}/{}'.format(attempt+1, RETRIES))
-        logger.debug('Waiting {} seconds to retry'.format(DELAY))
-        time.sleep(DELAY)
-        finished = True
-        for node in nodes:
-            if node.has_missing_macs():
-                _query_switches(node)
-            if node.has_missing_macs():
-                finished = False
-        if finished:
-            for node in nodes:
-                inventory.save(node)
+        # In other case let's do it in parallel
+        stored = session.load_many(nodenames)
+        for nodename in nodenames:
+            node = _apply_config(nodename, stored.get(nodename))
+            session.save(node)
+            nodes.append(node)
+        # First try: we retrieve what the switches already know, reusing
+        # the tables recently saved by other runs
+        _collect(nodes, max_age=switch.snapshot_ttl())
+        missing = [node for node in nodes if node.has_missing_macs()]
+        # Second try: the nodes running an LLDP agent need no reboot
+        if missing and _lldp_enabled():
+            _collect_lldp(missing)
+            missing = [node for node in missing if node.has_missing_macs()]
+        if not poweron:
+            for node in missing:
+                logger.warn('Unable to discover all MACs of {}'.format(node.name))
             return nodes
 
-    for node in nodes:
-        inventory.save(node)
+        def poll(pending):
+            _collect(pending)
+            session.flush()
+
+        def boot(wave):
+            booted = _boot_wave(wave, poweroff)
+            if booted:
+                scheduler.add(booted)
+
+        # The nodes are booted in waves that respect the power budget of
+        # every PDU, and the nodes of the first waves are polled while the
+        # next ones wait
+        scheduler = Scheduler()
+        interval = power.wave_interval()
+        for number, wave in enumerate(power.waves(missing)):
+            scheduler.call_later(number * interval, boot, wave)
+        with traps.listen(scheduler.wakeup), dhcp.listen(scheduler.wakeup):
+            failed = scheduler.run(poll, _resolve)
+
+    if failed:
+        raise ReachedRetryCount('Unable to discover all nodes')
+    return nodes
 
-    raise ReachedRetryCount('Unable to discover all nodes')
 
+def _boot_wave(wave, poweroff=False):
+    """Boot the nodes of a wave that are still missing MACs
 
-def discover_node(nodename, poweron=True, poweroff=False):
+    The wave is resolved first against the known tables: the walks done
+    for the previous waves, the traps and the DHCP requests may have found
+    its MACs while it was waiting.
+
+    :returns: the nodes booted
+    """
+    _join(wave, _wanted(wave))
+    wave = [node for node in wave if node.has_missing_macs()]
+    if not wave:
+        return wave
+    logger.info('Booting a wave of {} nodes'.format(len(wave)))
+    metrics.inc('discovery_power_waves_total')
+    with metrics.timer('discovery_boot'):
+        power.boot_for_discovery(wave, poweroff=poweroff)
+    return wave
+
+
+def discover_node(nodename, poweron=True, poweroff=False, session=None):
     """Find the MAC addresses of a given node"""
-    try:
-        node = inventory.load(nodename)
-    except inventory.NodeNotFoundError:
-        nodecfg = config.nodes[nodename]
-        node = Node(nodename, nodecfg['switchports'],
-                    nodecfg['bmc']['address'], nodecfg['bmc']['user'],
-                    nodecfg['bmc']['password'])
+    if session is None:
+        with inventory.Session() as session:
+            return discover_node(nodename, poweron, poweroff, session)
+
+    node = _get_node(nodename, session)
+    # Whatever happens the node is written when the session ends
+    session.save(node)
 
     # Nothing to do if it already has all the macs discovered from inventory
     if node.has_all_macs():
@@ -107,6 +170,8 @@ def discover_node(nodename, poweron=True, poweroff=False):
 
     # First try: we retrieve what the switches already now
     _query_switches(node)
+    if node.has_missing_macs() and _lldp_enabled():
+        _collect_lldp([node])
 
     if poweron:
         # Second try: we turn on the node and retry
@@ -132,45 +197,138 @@ def discover_node(nodename, poweron=True, poweroff=False):
                         '{} with missing MACs is already on'.format(node.name))
                     logger.warn(
                         'CLI is run without poweroff option so you should reboot the node manually')
-            for attempt in range(RETRIES):
-                logger.info('Attempt {}/{}'.format(attempt+1, RETRIES))
-                if node.has_missing_macs():
-                    logger.debug('Waiting {} seconds to retry'.format(DELAY))
-                    time.sleep(DELAY)
-                else:
-                    inventory.save(node)
-                    return node
-                _query_switches(node)
+            scheduler = Scheduler()
+            scheduler.add([node])
+            with traps.listen(scheduler.wakeup), dhcp.listen(scheduler.wakeup):
+                scheduler.run(_collect, _resolve)
         # Recap
-        if node.has_all_macs():
-            inventory.save(node)
-            return node
-        else:
-            logger.warn(
-                'Unable to find all MACs for node {} after {} retries'
-                .format(node.name, RETRIES))
+        if node.has_missing_macs():
             logger.info('MACs found: {}'.format(node.switchports))
-            inventory.save(node)
-            return node
     else:
         # If poweron=False just return what we found until now
-        inventory.save(node)
         logger.warn('Unable to discover all MACs of {}'.format(node.name))
-        return node
+    return node
+
+
+def _get_node(nodename, session):
+    """Get a node from the inventory or create it from the configuration"""
+    try:
+        stored = session.load(nodename)
+    except inventory.NodeNotFoundError:
+        stored = None
+    return _apply_config(nodename, stored)
+
+
+def _apply_config(nodename, stored):
+    """Return the stored node updated with the changes in its configuration
+
+    Nodes whose configuration did not change are returned as they were
+    stored. Otherwise the node is created again from the configuration
+    keeping the MACs of the switchports that did not change, so only the
+    NICs that changed are rediscovered.
+    """
+    nodecfg = config.nodes.get(nodename)
+    if nodecfg is None:
+        if stored is None:
+            raise KeyError(nodename)
+        # Nodes only found in the inventory are used as they are
+        return stored
+    if stored is not None and stored.config_hash == config_hash(nodecfg):
+        return stored
+    node = Node.from_config(nodename, nodecfg)
+    if stored is not None:
+        node.keep_macs(stored)
+        logger.info('Configuration of node {} changed: {} MACs to rediscover'.format(
+            nodename, len(node.missing_ports())))
+    return node
+
+
+def _collect(nodes, max_age=0):
+    """Query the switches for the missing MACs of the given nodes
+
+    The MAC tables of all the switches involved are refreshed concurrently
+    and then every node is resolved from the fresh tables.
+
+    :param max_age: seconds the tables saved by previous runs can be reused
+    """
+    with metrics.timer('discovery_collect'):
+        wanted = _wanted(nodes)
+        switch.update(wanted, max_age=max_age)
+        _join(nodes, wanted)
 
 
-def _query_switches(node):
+def _resolve(nodes):
+    """Resolve the given nodes from the MACs the switches already know
+
+    If nodes that are not in the known MAC tables sent DHCP requests, the
+    switches of the nodes still missing MACs are walked to locate them, at
+    most once every dhcp.min_walk_interval seconds.
+    """
+    _join(nodes, _wanted(nodes))
+    if dhcp.take_unlocated():
+        logger.info('New DHCP clients: refreshing the MAC tables')
+        _collect([node for node in nodes if node.has_missing_macs()])
+
+
+def _lldp_enabled():
+    return config.settings.get('discovery', {}).get('lldp', LLDP)
+
+
+def _collect_lldp(nodes):
+    """Resolve the missing MACs of the nodes from the LLDP neighbors
+
+    The neighbors of all the switches involved are retrieved with a single
+    walk per switch, and no power action is needed.
+    """
+    with metrics.timer('discovery_lldp'):
+        switch.update_neighbors(_wanted(nodes))
+        for node in nodes:
+            for port in node.missing_ports():
+                macs = switch.neighbors(port.switch, port.port)
+                if len(macs) == 1:
+                    logger.info('Found MAC {} of node {} on switch {} through LLDP'.format(
+                        macs[0], node.name, port.switch))
+                    node.add_mac(port.switch, macs[0])
+                    metrics.inc('discovery_lldp_macs_total')
+                elif len(macs) > 1:
+                    logger.warn('Ignoring the {} LLDP neighbors of node {} on switch {}'
+                                .format(len(macs), node.name, port.switch))
+
+
+def _wanted(nodes):
+    """Group the (port, vlan) of the missing MACs of the nodes by switch"""
+    wanted = {}
+    for node in nodes:
+        for port in node.missing_ports():
+            wanted.setdefault(port.switch, set()).add((port.port, port.vlan))
+    return wanted
+
+
+def _join(nodes, wanted):
+    """Resolve the missing MACs of the nodes against the tables in bulk"""
+    found = switch.join(wanted)
+    for node in nodes:
+        for port in node.missing_ports():
+            _add_mac(node, port, found[(port.switch, port.port, port.vlan)])
+
+
+def _query_switches(node, query=switch.query):
     """Query switches for the MACs of the given node"""
-    for swname, swopts in node.switchports.items():
-        if 'mac' not in swopts:
-            macs = switch.query(swname, swopts['port'], swopts['vlan'])
-            if len(macs) == 1:
-                node.add_mac(swname, macs[0])
-            elif len(macs) > 1:
-                logger.error('Found {} MACs for node {} on switch {}'.format(
-                    len(macs), node.name, swname))
-                raise MultipleMacError(
-                    'Found more than one MAC in the given port')
-            else:
-                logger.debug('MAC not found for node {} on switch {}'.format(
-                    node.name, swname))
+    for port in node.missing_ports():
+        _add_mac(node, port, query(port.switch, port.port, port.vlan))
+
+
+def _add_mac(node, port, macs):
+    """Add the MAC seen on a switchport of a node if there is only one"""
+    if len(macs) == 1:
+        logger.info('Found MAC {} of node {} on switch {}'.format(
+            macs[0], node.name, port.switch))
+        node.add_mac(port.switch, macs[0])
+    elif len(macs) > 1:
+        logger.error('Found {} MACs for node {} on switch {}'.format(
+            len(macs), node.name, port.switch))
+        raise MultipleMacError(
+            'Found more than one MAC in the given port')
+    else:
+        logger.debug('MAC not found for node {} on switch {}'.format(
+            node.name, port.switch))
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Exporters module
+   Implements the streaming exporters of the inventory to text formats
+"""
+from __future__ import print_function, with_statement
+import json
+import sys
+from . import config
+from . import inventory
+from . import selectors
+
+# Bytes buffered before writing to the output
+BUFFER_SIZE = 64 * 1024
+
+# Values of the MAC columns of the NICs not discovered yet or not present
+UNKNOWN = 'UNKNOWN'
+NOT_AVAILABLE = 'N/A'
+
+
+class BufferedWriter(object):
+    """Writes lines to a stream in chunks of about BUFFER_SIZE bytes"""
+    def __init__(self, stream, size=BUFFER_SIZE):
+        self.stream = stream
+        self.size = size
+        self._lines = []
+        self._length = 0
+
+    def write(self, line):
+        """Write a line, adding the new line character"""
+        self._lines.append(line)
+        self._length += len(line) + 1
+        if self._length >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            self.stream.write('\n'.join(self._lines) + '\n')
+            self._lines = []
+            self._length = 0
+        self.stream.flush()
+
+
+def _macs(node, nics):
+    """Return the MAC of every NIC of the schema for a node"""
+    macs = dict((nic, NOT_AVAILABLE) for nic in nics)
+    for port in node.ports:
+        macs[port.nic] = port.mac_address or UNKNOWN
+    return [macs[nic] for nic in nics]
+
+
+def _discovered(node):
+    """Return the (nic, mac) pairs of the discovered NICs of a node"""
+    return sorted((port.nic, port.mac_address) for port in node.ports
+                  if port.mac is not None)
+
+
+def _address(node, nic):
+    """Return the IP address configured for a NIC of a node, if any"""
+    settings = (config.nodes.get(node.name) or {}).get('cobbler') or {}
+    if settings.get('nic') == nic:
+        return settings.get('address')
+    return None
+
+
+def table_lines(nodes, nics):
+    """Human readable table, as shown by `discover show`"""
+    yield '{:10}'.format('Nodename') + ''.join('   {:^17}'.format(nic) for nic in nics)
+    yield '-'*(10 + 20*len(nics))
+    for node in nodes:
+        yield '{:10}'.format(node.name) + ''.join('   {:17}'.format(mac)
+                                                  for mac in _macs(node, nics))
+
+
+def csv_lines(nodes, nics):
+    """One row per node with a MAC column per NIC"""
+    yield '#node,' + ','.join(nics)
+    for node in nodes:
+        yield '{},'.format(node.name) + ','.join(_macs(node, nics))
+
+
+def jsonl_lines(nodes, nics):
+    """One JSON object per node"""
+    for node in nodes:
+        yield json.dumps({
+            'name': node.name,
+            'bmc': {'address': node.bmc.address, 'user': node.bmc.user},
+            'nics': dict((port.nic, {'switch': port.switch, 'port': port.port,
+                                     'vlan': port.vlan, 'mac': port.mac_address})
+                         for port in node.ports),
+        }, sort_keys=True)
+
+
+def dhcpd_lines(nodes, nics):
+    """ISC dhcpd.conf host declarations of the discovered NICs"""
+    for node in nodes:
+        for nic, mac in _discovered(node):
+            yield 'host {}-{} {{'.format(node.name, nic)
+            yield '  hardware ethernet {};'.format(mac)
+            address = _address(node, nic)
+            if address:
+                yield '  fixed-address {};'.format(address)
+            yield '  option host-name "{}";'.format(node.name)
+            yield '}'
+
+
+def dnsmasq_lines(nodes, nics):
+    """dnsmasq dhcp-host entries of the discovered NICs"""
+    for node in nodes:
+        for nic, mac in _discovered(node):
+            fields = [mac, node.name]
+            address = _address(node, nic)
+            if address:
+                fields.append(address)
+            yield 'dhcp-host=' + ','.join(fields)
+
+
+def ethers_lines(nodes, nics):
+    """/etc/ethers entries of the discovered NICs"""
+    for node in nodes:
+        for nic, mac in _discovered(node):
+            yield '{} {}'.format(mac, node.name)
+
+
+FORMATS = {
+    'table': table_lines,
+    'csv': csv_lines,
+    'jsonl': jsonl_lines,
+    'dhcpd': dhcpd_lines,
+    'dnsmasq': dnsmasq_lines,
+    'ethers': ethers_lines,
+}
+
+
+def export(fmt, nodename='all', out=None):
+    """Export the inventory, or the nodes chosen by a selector, in the given format
+
+    Nodes are streamed from the inventory and the output is buffered, so
+    memory stays flat whatever the size of the inventory. The NIC columns
+    are the NICs in the inventory, always in the same order.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('Unsupported export format: {}'.format(fmt))
+    if nodename.lower() == 'all':
+        nodes = inventory.iter_nodes()
+        nics = inventory.nic_names()
+    else:
+        nodenames = selectors.select(nodename, inventory.names())
+        if nodenames == [nodename]:
+            nodes = [inventory.load(nodename)]
+        else:
+            nodes = inventory.load_many(nodenames)
+        nics = sorted(set(port.nic for node in nodes for port in node.ports),
+                      key=inventory.natural_key)
+    writer = BufferedWriter(out or sys.stdout)
+    for line in FORMATS[fmt](nodes, nics):
+        writer.write(line)
+    writer.flush()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""FDB module
+   Implements the compact in-memory forwarding database of a switch
+"""
+from __future__ import print_function, with_statement
+import struct
+from array import array
+from numbers import Integral
+
+try:
+    array('Q')
+    MAC_TYPECODE = 'Q'
+except ValueError:
+    # Python 2 lacks 'Q' but 'L' is 64 bits wide on LP64 platforms
+    MAC_TYPECODE = 'L'
+
+# Conversion tables between MAC octets and their integer values
+_OCTETS = {}
+for _value in range(256):
+    for _text in ('{:x}'.format(_value), '{:02x}'.format(_value)):
+        _OCTETS[_text] = _value
+        _OCTETS[_text.upper()] = _value
+_HEX = ['{:02X}'.format(_value) for _value in range(256)]
+
+# Header of the serialized tables: magic, item sizes of the columns and
+# number of entries. The columns follow in native byte order.
+_MAGIC = b'FDB1'
+_HEADER = struct.Struct('=4sBBBI')
+
+
+def mac_to_int(mac):
+    """Convert a MAC address like 0:1a:2B:3:4:5 to a 48-bit integer"""
+    if isinstance(mac, Integral):
+        return mac
+    value = 0
+    for octet in str(mac).replace('-', ':').split(':'):
+        value = (value << 8) | _OCTETS[octet]
+    return value
+
+
+def mac_to_str(value):
+    """Format a 48-bit integer MAC to the canonical format: A1:F2:03:04:05:06"""
+    return ':'.join([_HEX[(value >> shift) & 0xff] for shift in (40, 32, 24, 16, 8, 0)])
+
+
+def normalize_mac(mac):
+    """Format a MAC address to a canonical format: A1:F2:03:04:05:06"""
+    return mac_to_str(mac_to_int(mac))
+
+
+class FDBTable(object):
+    """Forwarding database of a switch
+
+    The entries are stored in three array-backed columns (port, vlan and
+    the MAC as a 48-bit integer) sorted by (port, vlan), and an index maps
+    every (port, vlan) to its slice of rows. Entries added afterwards, for
+    example from notifications, are kept apart until the next refresh.
+    """
+    def __init__(self, ports=(), vlans=(), macs=()):
+        self.ports = array('I', ports)
+        self.vlans = array('H', vlans)
+        self.macs = array(MAC_TYPECODE, macs)
+        self._index = {}
+        self._added = {}
+        self._build_index()
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Build the table from an iterable of (port, vlan, mac) tuples
+
+        The MACs can be given as integers or strings and are converted in
+        a single pass before sorting and indexing the table once.
+        """
+        to_int = mac_to_int
+        rows = sorted((int(port), int(vlan), to_int(mac)) for port, vlan, mac in entries)
+        return cls([row[0] for row in rows], [row[1] for row in rows],
+                   [row[2] for row in rows])
+
+    def to_bytes(self):
+        """Serialize the table, without the entries added afterwards"""
+        header = _HEADER.pack(_MAGIC, self.ports.itemsize, self.vlans.itemsize,
+                              self.macs.itemsize, len(self.macs))
+        return header + b''.join(_array_bytes(column)
+                                 for column in (self.ports, self.vlans, self.macs))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Load a table serialized by `to_bytes`
+
+        :raises ValueError: if the data is not a table serialized on this
+                            platform
+        """
+        if len(data) < _HEADER.size:
+            raise ValueError('Truncated FDB table')
+        magic, port_size, vlan_size, mac_size, count = _HEADER.unpack_from(data)
+        table = cls()
+        columns = (table.ports, table.vlans, table.macs)
+        if magic != _MAGIC or (port_size, vlan_size, mac_size) != tuple(
+                column.itemsize for column in columns):
+            raise ValueError('Incompatible FDB table')
+        offset = _HEADER.size
+        for column in columns:
+            size = column.itemsize * count
+            if len(data) < offset + size:
+                raise ValueError('Truncated FDB table')
+            _array_load(column, data[offset:offset + size])
+            offset += size
+        table._build_index()
+        return table
+
+    def _build_index(self):
+        """Index the (port, vlan) slices of the sorted columns"""
+        index = {}
+        start = 0
+        ports, vlans = self.ports, self.vlans
+        for row in range(1, len(ports) + 1):
+            if row == len(ports) or ports[row] != ports[start] or vlans[row] != vlans[start]:
+                index[(ports[start], vlans[start])] = (start, row)
+                start = row
+        self._index = index
+
+    def add(self, port, vlan, mac):
+        """Add a single entry without rebuilding the index"""
+        macs = self._added.setdefault((int(port), int(vlan)), [])
+        mac = mac_to_int(mac)
+        if mac not in macs:
+            macs.append(mac)
+
+    def mac_values(self, port, vlan):
+        """Return the integer MACs seen on a given port and vlan"""
+        key = (port, vlan)
+        values = []
+        if key in self._index:
+            start, stop = self._index[key]
+            values.extend(self.macs[start:stop])
+        for mac in self._added.get(key, ()):
+            if mac not in values:
+                values.append(mac)
+        return values
+
+    def join(self, keys):
+        """Return the integer MACs seen on each of the given (port, vlan)
+
+        :returns: a dictionary from each key to its list of MACs
+        """
+        return dict((key, self.mac_values(*key)) for key in keys)
+
+    def macs_seen_on_port(self, port, vlan):
+        """Return the MACs seen on a given port and vlan"""
+        return [mac_to_str(mac) for mac in self.mac_values(port, vlan)]
+
+    def find(self, mac):
+        """Return the (port, vlan) pairs where a MAC is seen"""
+        value = mac_to_int(mac)
+        ports, vlans = self.ports, self.vlans
+        found = set((ports[row], vlans[row])
+                    for row, seen in enumerate(self.macs) if seen == value)
+        found.update(key for key, macs in self._added.items() if value in macs)
+        return sorted(found)
+
+    def __len__(self):
+        return len(self.macs) + sum(len(macs) for macs in self._added.values())
+
+    def __repr__(self):
+        return '<{}(entries={}, keys={})>'.format(
+            self.__class__.__name__, len(self), len(self._index))
+
+
+def _array_bytes(column):
+    """Return the contents of an array as bytes"""
+    return column.tobytes() if hasattr(column, 'tobytes') else column.tostring()
+
+
+def _array_load(column, data):
+    """Append the items in the bytes to an array"""
+    if hasattr(column, 'frombytes'):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
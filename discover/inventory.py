@@ -7,143 +7,357 @@ import os
 import glob
 import re
 import logging
+import sqlite3
+import threading
+import time
 import cPickle as pickle
-from . import cobbler
+from . import metrics
+from .node import Node
 
 logger = logging.getLogger(__name__)
 
 DEFAULT_DB_DIR = os.path.expanduser('~/.discover/db')
+DEFAULT_DB_FILE = os.path.join(DEFAULT_DB_DIR, 'inventory.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    name TEXT PRIMARY KEY,
+    bmc_address TEXT,
+    bmc_user TEXT,
+    bmc_password TEXT,
+    bmc_timeout REAL,
+    config_hash TEXT,
+    sort_key TEXT
+);
+CREATE TABLE IF NOT EXISTS nics (
+    node TEXT NOT NULL REFERENCES nodes (name) ON DELETE CASCADE,
+    switch TEXT NOT NULL,
+    nic TEXT,
+    port,
+    vlan INTEGER,
+    mac TEXT,
+    PRIMARY KEY (node, switch)
+);
+CREATE INDEX IF NOT EXISTS nics_nic ON nics (nic);
+CREATE INDEX IF NOT EXISTS nics_mac ON nics (mac);
+"""
+
+# Seconds between the writes of a session
+FLUSH_INTERVAL = 30
+# Number of nodes read from the database at a time when streaming
+BATCH_SIZE = 500
 
 if not os.path.exists(DEFAULT_DB_DIR):
     os.makedirs(DEFAULT_DB_DIR)
 
+_connection = None
+_lock = threading.RLock()
+
 
 class NodeNotFoundError(Exception):
     pass
 
 
+def connect(filename=None):
+    """Open the inventory database creating it if needed
+
+    The first time it is opened the nodes of the old per-node pickle files
+    found in DEFAULT_DB_DIR are migrated into it.
+    """
+    global _connection
+    if filename is None:
+        filename = DEFAULT_DB_FILE
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+        _connection = sqlite3.connect(filename, check_same_thread=False)
+        _connection.create_collation('nodename', _natural_cmp)
+        _connection.execute('PRAGMA foreign_keys = ON')
+        # The write-ahead log needs fewer fsyncs than the rollback journal
+        _connection.execute('PRAGMA journal_mode = WAL')
+        _connection.executescript(SCHEMA)
+        _upgrade(_connection)
+        _migrate_pickles(_connection, os.path.dirname(filename))
+    return _connection
+
+
+def _upgrade(db):
+    """Add the columns missing in databases created by older versions"""
+    columns = [row[1] for row in db.execute('PRAGMA table_info(nodes)')]
+    with db:
+        if 'config_hash' not in columns:
+            db.execute('ALTER TABLE nodes ADD COLUMN config_hash TEXT')
+        if 'sort_key' not in columns:
+            db.execute('ALTER TABLE nodes ADD COLUMN sort_key TEXT')
+            names = [name for name, in db.execute('SELECT name FROM nodes')]
+            db.executemany('UPDATE nodes SET sort_key = ? WHERE name = ?',
+                           [(_sort_key(name), name) for name in names])
+        db.execute('CREATE UNIQUE INDEX IF NOT EXISTS nodes_sort_key ON nodes (sort_key)')
+
+
+def _db():
+    """Return the connection to the inventory database"""
+    with _lock:
+        if _connection is None:
+            connect()
+        return _connection
+
+
 def save(node):
     """Save a given node in the inventory"""
-    filename = os.path.join(DEFAULT_DB_DIR, node.name + '.p')
-    with open(filename, 'w') as dumpfile:
-        logger.info('Adding {} to the inventory database'.format(node.name))
-        pickle.dump(node, dumpfile)
+    save_all([node])
+
+
+def save_all(nodes):
+    """Save the given nodes in the inventory in a single transaction"""
+    nodes = list(nodes)
+    with _lock, metrics.timer('inventory_write'):
+        with _db() as db:
+            for node in nodes:
+                logger.info('Adding {} to the inventory database'.format(node.name))
+                _insert(db, node)
+    metrics.inc('inventory_written_nodes_total', len(nodes))
+
+
+def _insert(db, node):
+    """Insert or replace the records of a node"""
+    db.execute('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?)',
+               (node.name, node.bmc.address, node.bmc.user, node.bmc.password,
+                node.bmc.timeout, node.config_hash, _sort_key(node.name)))
+    db.execute('DELETE FROM nics WHERE node = ?', (node.name,))
+    db.executemany('INSERT INTO nics VALUES (?, ?, ?, ?, ?, ?)', [
+        (node.name, port.switch, port.nic, port.port, port.vlan, port.mac_address)
+        for port in node.ports])
+
+
+class Session(object):
+    """Write-behind inventory session
+
+    Nodes saved in the session are kept in memory and written in batches,
+    every flush_interval seconds and when the session ends, even if it ends
+    with an error or an interruption. Each batch is a single transaction,
+    so a stopped run never leaves half-written records, and only the nodes
+    that changed since they were loaded are written.
+
+    Usage:
+
+        with inventory.Session() as session:
+            node = session.load('c14-10')
+            ...
+            session.save(node)
+    """
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._stored = {}
+        self._last_flush = time.time()
+
+    def load(self, nodename):
+        """Load a node from the inventory remembering its stored state"""
+        node = load(nodename)
+        self._stored[node.name] = _fingerprint(node)
+        return node
+
+    def load_many(self, nodenames):
+        """Load the given nodes remembering their stored state
+
+        :returns: a dictionary with the nodes found in the inventory by name
+        """
+        nodes = dict((node.name, node) for node in load_many(nodenames))
+        for node in nodes.values():
+            self._stored[node.name] = _fingerprint(node)
+        return nodes
+
+    def save(self, node):
+        """Schedule the node to be written in the next flush
+
+        The node is written as it is at the time of the flush, so later
+        changes to it do not need another save.
+        """
+        self._pending[node.name] = node
+        if time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the pending nodes that changed"""
+        changed = [node for name, node in sorted(self._pending.items())
+                   if self._stored.get(name) != _fingerprint(node)]
+        if changed:
+            save_all(changed)
+            for node in changed:
+                self._stored[node.name] = _fingerprint(node)
+        logger.debug('Inventory flush: {} of {} nodes changed'.format(
+            len(changed), len(self._pending)))
+        self._last_flush = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+        self._pending.clear()
+        return False
+
+
+def _fingerprint(node):
+    """Return the stored state of a node to detect changes"""
+    return (node.bmc.address, node.bmc.user, node.bmc.password, node.config_hash,
+            tuple((port.switch, port.nic, port.port, port.vlan, port.mac)
+                  for port in node.ports))
 
 
 def load(nodename):
-    """Load a given node from the inventory"""
-    #FIXME: Detect if there are changes in the node configuration so they
-    #       are applied to the inventory object if needed
-    filename = os.path.join(DEFAULT_DB_DIR, nodename + '.p')
-    try:
-        with open(filename, 'r') as dumpfile:
-            return pickle.load(dumpfile)
-    except IOError:
+    """Load a given node from the inventory
+
+    The node is as it was stored: discovery applies the changes of its
+    configuration comparing it with its config_hash.
+    """
+    nodes = _select('WHERE name = ?', (nodename,))
+    if not nodes:
         logger.info('Node {} not found in inventory'.format(nodename))
         raise NodeNotFoundError('Node not found in inventory')
+    return nodes[0]
 
 
-def show(nodename='all'):
-    """Show the information about nodes in the inventory"""
-    if nodename.lower() == 'all':
-        nodes = _load_all_nodes_from_inventory()
-        nics = _nic_names(nodes)
-        print('{:10}'.format('Nodename') + ''.join('   {:^17}'.format(nic) for nic in nics))
-        print('-'*(10 + 20*len(nics)))
-        # Sort the nodes in numerical order: pad the numeric parts for the right output
-        #nodes.sort(key=lambda node: re.sub('(\d+)', lambda m: '{:08d}'.format(int(m.group(0))), node.name))
-        digits = re.compile(r'(\d+)')
-
-        def expanded_nodename(node):
-            def pad_numbers(m):
-                return '{:08d}'.format(int(m.group(0)))
-            return digits.sub(pad_numbers, node.name)
-
-        nodes.sort(key=expanded_nodename)
+def load_many(nodenames, batch=BATCH_SIZE):
+    """Load the given nodes in natural name order, skipping the unknown ones"""
+    nodenames = list(nodenames)
+    nodes = []
+    for start in range(0, len(nodenames), batch):
+        chunk = nodenames[start:start + batch]
+        nodes.extend(_select('WHERE name IN ({})'.format(', '.join('?' * len(chunk))),
+                             chunk))
+    return sorted(nodes, key=lambda node: natural_key(node.name))
+
+
+def names():
+    """Return the names of all the nodes in the inventory"""
+    with _lock:
+        return [name for name, in _db().execute('SELECT name FROM nodes')]
+
+
+def load_all():
+    """Load all the nodes available in the inventory"""
+    return _select()
+
+
+def find_by_mac(mac):
+    """Return the nodes that have the given MAC"""
+    return _select('WHERE name IN (SELECT node FROM nics WHERE mac = ?)', (mac.upper(),))
+
+
+def find_by_nic(nic):
+    """Return the nodes that have the given NIC"""
+    return _select('WHERE name IN (SELECT node FROM nics WHERE nic = ?)', (nic,))
+
+
+def iter_nodes(batch=BATCH_SIZE):
+    """Iterate over all the nodes of the inventory in natural name order
+
+    Nodes are read in batches, so memory does not grow with the size of
+    the inventory. The batches are paged on the indexed sort_key column,
+    so each of them costs the same whatever the size of the inventory.
+    """
+    last = ''
+    while True:
+        nodes = _select('WHERE sort_key > ? ORDER BY sort_key LIMIT ?', (last, batch))
         for node in nodes:
-            _print_node(node, nics)
-    else:
-        filename = os.path.join(DEFAULT_DB_DIR, nodename + '.p')
-        with open(filename) as nodefile:
-            node = pickle.load(nodefile)
-        nics = set()
-        for sw, opts in node.switchports.items():
-            nics.add(opts['nic'])
-        _print_node(node, nics)
+            yield node
+        if len(nodes) < batch:
+            return
+        last = _sort_key(nodes[-1].name)
+
+
+def nic_names():
+    """Return the names of all the NICs in the inventory in natural order"""
+    with _lock:
+        rows = _db().execute('SELECT DISTINCT nic FROM nics WHERE nic IS NOT NULL '
+                             'ORDER BY nic COLLATE nodename').fetchall()
+    return [nic for nic, in rows]
+
 
+_digits = re.compile(r'(\d+)')
 
-def _load_all_nodes_from_inventory():
-    """Loads all the nodes available in the inventory"""
+
+def natural_key(name):
+    """Sort key that orders the numeric parts of a name numerically"""
+    # Pad the numeric parts, so node-2 sorts before node-10
+    return (_digits.sub(lambda m: '{:08d}'.format(int(m.group(0))), name), name)
+
+
+def _sort_key(name):
+    """Natural sort key of a name as a string, stored to sort the nodes"""
+    # The NUL separator sorts before any character, so the strings sort
+    # like the natural_key tuples
+    return '\0'.join(natural_key(name))
+
+
+def _natural_cmp(first, second):
+    """Compare function of the nodename collation of the database"""
+    first, second = natural_key(first), natural_key(second)
+    return (first > second) - (first < second)
+
+
+def _select(where='', params=()):
+    """Load the nodes matching the given WHERE clause"""
+    with _lock, metrics.timer('inventory_read'):
+        db = _db()
+        rows = db.execute('SELECT name, bmc_address, bmc_user, bmc_password, bmc_timeout, '
+                          'config_hash FROM nodes ' + where, params).fetchall()
+        switchports = {}
+        if rows:
+            nics = db.execute('SELECT node, switch, nic, port, vlan, mac FROM nics '
+                              'WHERE node IN (SELECT name FROM nodes ' + where + ')',
+                              params)
+            for nodename, swname, nic, port, vlan, mac in nics:
+                swopts = {'nic': nic, 'port': port, 'vlan': vlan}
+                if mac is not None:
+                    swopts['mac'] = mac
+                switchports.setdefault(nodename, {})[swname] = swopts
     nodes = []
-    for filename in glob.glob(os.path.join(DEFAULT_DB_DIR, '*.p')):
-        with open(filename) as nodefile:
-            nodes.append(pickle.load(nodefile))
+    for name, address, user, password, timeout, digest in rows:
+        node = Node(name, switchports.get(name, {}), address, user, password, timeout)
+        node.config_hash = digest
+        nodes.append(node)
     return nodes
 
 
-def _nic_names(nodes):
-    """Get the names of the NICs of the given nodes"""
-    nics = set()
-    for node in nodes:
-        for sw, opts in node.switchports.items():
-            nics.add(opts['nic'])
-    return nics
-
-
-def _print_node(node, nics):
-    """Print the information about a given node"""
-    macs = {}
-    for sw, opts in node.switchports.items():
-        if 'mac' in opts:
-            macs[opts['nic']] = opts['mac']
-        else:
-            macs[opts['nic']] = 'UNKNOWN'
-    for nic in nics:
-        if nic not in macs:
-            macs[nic] = 'N/A'
-    print('{:10}'.format(node.name) + ''.join('   {:17}'.format(macs[nic]) for nic in nics))
-
-
-def _export_node_to_csv(node, nics):
-    """Export to csv a given node"""
-    macs = {}
-    for sw, opts in node.switchports.items():
-        if 'mac' in opts:
-            macs[opts['nic']] = opts['mac']
-        else:
-            macs[opts['nic']] = 'UNKNOWN'
-    # Mark non-existent NICs as not available for this node 
-    for nic in nics:
-        if nic not in macs:
-            macs[nic] = 'N/A'
-    print('{},'.format(node.name) + ','.join(macs[nic] for nic in nics))
+def _migrate_pickles(db, dbdir):
+    """Move the nodes of the old per-node pickle files into the database"""
+    filenames = glob.glob(os.path.join(dbdir, '*.p'))
+    if not filenames:
+        return
+    logger.info('Migrating {} nodes to the inventory database'.format(len(filenames)))
+    with db:
+        for filename in filenames:
+            with open(filename, 'rb') as nodefile:
+                _insert(db, pickle.load(nodefile))
+    # Keep the old files around but out of the way
+    for filename in filenames:
+        os.rename(filename, filename + '.migrated')
 
 
-def export_to_csv(nodename='all'):
+def show(nodename='all'):
     """Show the information about nodes in the inventory"""
-    if nodename.lower() == 'all':
-        nodes = _load_all_nodes_from_inventory()
-        nics = _nic_names(nodes)
-        print('#node,' + ','.join(nics))
-        for node in nodes:
-            _export_node_to_csv(node, nics)
-    else:
-        filename = os.path.join(DEFAULT_DB_DIR, nodename + '.p')
-        with open(filename) as nodefile:
-            node = pickle.load(nodefile)
-        nics = set()
-        for sw, opts in node.switchports.items():
-            nics.add(opts['nic'])
-        print('#node,' + ','.join(nics))
-        _export_node_to_csv(node, nics)
+    from . import exporters
+    exporters.export('table', nodename)
+
+
+def export_to_csv(nodename='all'):
+    """Export the inventory to csv format"""
+    from . import exporters
+    exporters.export('csv', nodename)
 
 
 def export_to_cobbler(nodename):
     """Export the inventory to cobbler format"""
+    from . import cobbler
+    from . import selectors
     if nodename.lower() == 'all':
-        nodes = _load_all_nodes_from_inventory()
-        for node in nodes:
-            cobbler.add(node)
+        cobbler.export(load_all())
+        return
+    nodenames = selectors.select(nodename, names())
+    if nodenames == [nodename]:
+        cobbler.add(load(nodename))
     else:
-        node = load(nodename)
-        cobbler.add(node)
+        cobbler.Exporter().export(load_many(nodenames))
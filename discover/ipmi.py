@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""IPMI module
+   Implements the transports used to send IPMI commands to the BMCs
+"""
+from __future__ import print_function, with_statement
+import logging
+import subprocess
+import threading
+from . import config
+
+# Transport used when none is given in the settings
+DEFAULT_TRANSPORT = 'ipmitool'
+
+logger = logging.getLogger(__name__)
+
+_transports = {}
+_lock = threading.Lock()
+
+
+class IPMIError(Exception):
+    """IPMI command failed"""
+    pass
+
+
+class IpmitoolTransport(object):
+    """Runs every command in a new ipmitool process
+
+    Each command pays for a fork/exec and a new RMCP+ session, but it only
+    needs the ipmitool binary.
+    """
+    def run(self, bmc, cmd, timeout):
+        """Run an ipmitool command such as 'chassis power status'
+
+        The command is killed if it does not finish in `timeout` seconds.
+
+        :returns: the output of the command
+        """
+        args = ['ipmitool', '-I', 'lanplus', '-H', bmc.address,
+                '-U', bmc.user, '-P', bmc.password] + cmd.split()
+        process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   universal_newlines=True)
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        try:
+            output, _ = process.communicate()
+        finally:
+            timer.cancel()
+        if process.returncode != 0:
+            logger.error('IPMI command failed on {}: {}'.format(bmc.address, cmd))
+            logger.error('  OUTPUT: {}'.format(output))
+            logger.error('  Exit status: {}'.format(process.returncode))
+            raise IPMIError('IPMI command "{}" failed on {} with exit status {}'
+                            .format(cmd, bmc.address, process.returncode))
+        return output
+
+
+class PyghmiTransport(object):
+    """Sends the commands in process through pyghmi
+
+    One IPMI session is kept open per BMC and reused by all the commands,
+    so there is neither a new process nor a new handshake per command. The
+    commands are the ipmitool ones and the output mimics ipmitool's.
+    pyghmi handles the retries and timeouts of its sessions itself.
+    """
+    def __init__(self):
+        from pyghmi.ipmi import command
+        from pyghmi import exceptions
+        self._command = command
+        self._exceptions = exceptions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, bmc):
+        """Return the session of a BMC opening it if needed"""
+        key = (bmc.address, bmc.user, bmc.password)
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is None:
+            logger.debug('Opening IPMI session with {}'.format(bmc.address))
+            session = self._command.Command(bmc=bmc.address, userid=bmc.user,
+                                            password=bmc.password)
+            with self._lock:
+                self._sessions[key] = session
+        return session
+
+    def run(self, bmc, cmd, timeout):
+        """Run an ipmitool command such as 'chassis power status'
+
+        :returns: the output ipmitool would have given
+        """
+        try:
+            return self._run(self._session(bmc), cmd)
+        except self._exceptions.IpmiException as error:
+            # The session may be broken: open a new one the next time
+            with self._lock:
+                self._sessions.pop((bmc.address, bmc.user, bmc.password), None)
+            raise IPMIError('IPMI command "{}" failed on {}: {}'.format(
+                cmd, bmc.address, error))
+
+    @staticmethod
+    def _run(session, cmd):
+        words = cmd.split()
+        if words == ['chassis', 'power', 'status']:
+            return 'Chassis Power is {}\n'.format(session.get_power()['powerstate'])
+        elif words[:2] == ['chassis', 'power'] and len(words) == 3:
+            state = {'on': 'on', 'off': 'off', 'soft': 'softoff'}.get(words[2])
+            if state is not None:
+                session.set_power(state)
+                return 'Chassis Power Control: {}\n'.format(words[2])
+        elif words == ['chassis', 'bootdev', 'pxe']:
+            session.set_bootdev('network')
+            return 'Set Boot Device to pxe\n'
+        raise IPMIError('IPMI command "{}" is not supported by pyghmi transport'.format(cmd))
+
+
+TRANSPORTS = {
+    'ipmitool': IpmitoolTransport,
+    'pyghmi': PyghmiTransport,
+}
+
+
+def transport(name=None):
+    """Return the transport with the given name, by default the configured one
+
+    Transports are created once and shared, so the sessions they keep are
+    reused by all the BMCs.
+    """
+    if name is None:
+        name = config.settings.get('ipmi', {}).get('transport', DEFAULT_TRANSPORT)
+    with _lock:
+        if name not in _transports:
+            if name not in TRANSPORTS:
+                raise ValueError('Unknown IPMI transport: {}'.format(name))
+            _transports[name] = TRANSPORTS[name]()
+        return _transports[name]
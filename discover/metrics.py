@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Metrics module
+   Implements the instrumentation of discovery runs: counters and timings
+   collected in memory and written as JSON and Prometheus text files, and
+   the optional profiling of a run.
+"""
+from __future__ import print_function, with_statement
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from . import config
+
+# Directory where the metrics of the last run are written
+DEFAULT_DIR = os.path.expanduser('~/.discover/metrics')
+# Prefix of the metric names in the Prometheus file
+PREFIX = 'discover_'
+
+logger = logging.getLogger(__name__)
+
+
+class Registry(object):
+    """Thread-safe collection of counters and observations
+
+    Every metric is identified by its name and labels. Observations keep
+    their count, sum, minimum and maximum.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._summaries = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record an observation such as a duration or a size"""
+        key = self._key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                self._summaries[key] = [1, value, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = min(summary[2], value)
+                summary[3] = max(summary[3], value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the block in <name>_seconds
+
+        If the block raises an exception <name>_failures_total is
+        incremented.
+        """
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            self.inc(name + '_failures_total', **labels)
+            raise
+        finally:
+            self.observe(name + '_seconds', time.time() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def to_dict(self):
+        """Return the metrics as a JSON serializable dictionary"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            summaries = sorted((key, list(value)) for key, value in self._summaries.items())
+        return {
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in counters],
+            'summaries': [{'name': name, 'labels': dict(labels), 'count': count,
+                           'sum': total, 'min': low, 'max': high}
+                          for (name, labels), (count, total, low, high) in summaries],
+        }
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text format"""
+        data = self.to_dict()
+        lines = []
+        typed = set()
+
+        def add(name, kind, labels, value):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, kind))
+            lines.append('{}{} {}'.format(name, _format_labels(labels), repr(float(value))))
+
+        for counter in data['counters']:
+            add(PREFIX + counter['name'], 'counter', counter['labels'], counter['value'])
+        for summary in data['summaries']:
+            name = PREFIX + summary['name']
+            add(name, 'summary', summary['labels'], summary['sum'])
+            lines[-1] = lines[-1].replace(name, name + '_sum', 1)
+            lines.append('{}_count{} {}'.format(name, _format_labels(summary['labels']),
+                                                summary['count']))
+            add(name + '_max', 'gauge', summary['labels'], summary['max'])
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items())) + '}'
+
+
+# The metrics of the current run
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+reset = registry.reset
+
+
+def directory():
+    """Return the directory where the metrics are written"""
+    return os.path.expanduser(
+        config.settings.get('metrics', {}).get('directory', DEFAULT_DIR))
+
+
+def write(path=None):
+    """Write the metrics as metrics.json and metrics.prom in the given directory
+
+    :returns: the path of the directory
+    """
+    path = path or directory()
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for filename, contents in (('metrics.json', json.dumps(registry.to_dict(), indent=2,
+                                                             sort_keys=True) + '\n'),
+                               ('metrics.prom', registry.to_prometheus())):
+        # Replace the files atomically so collectors never read half a file
+        tmpfile = os.path.join(path, '.{}.tmp'.format(filename))
+        with open(tmpfile, 'w') as output:
+            output.write(contents)
+        os.rename(tmpfile, os.path.join(path, filename))
+    logger.info('Metrics written to {}'.format(path))
+    return path
+
+
+def write_run(path=None):
+    """Write the metrics at the end of a run, logging instead of raising
+
+    A metrics directory that cannot be written must not hide the outcome
+    of the run.
+    """
+    try:
+        write(path)
+    except (IOError, OSError) as error:
+        logger.warn('Unable to write the metrics: {}'.format(error))
+
+
+@contextlib.contextmanager
+def profile(filename):
+    """Profile the block, including the threads it starts, with cProfile
+
+    The stats of all the threads are merged and dumped to the file, which
+    can be read with pstats or tools such as snakeviz.
+    """
+    import cProfile
+    import pstats
+    profilers = []
+    lock = threading.Lock()
+
+    def start_thread_profiler(frame, event, arg):
+        # Called once in every new thread: replace itself with a profiler
+        profiler = cProfile.Profile()
+        with lock:
+            profilers.append(profiler)
+        profiler.enable()
+
+    main = cProfile.Profile()
+    threading.setprofile(start_thread_profiler)
+    main.enable()
+    try:
+        yield
+    finally:
+        main.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(main)
+        with lock:
+            for profiler in profilers:
+                profiler.disable()
+                stats.add(profiler)
+        stats.dump_stats(filename)
+        logger.info('Profile written to {}'.format(filename))
@@ -3,13 +3,29 @@
    Implements the node object and its functionality
 """
 from __future__ import print_function, with_statement
-import subprocess
+import hashlib
+import logging
 import re
 import time
-from .helpers import ToDictMixin
+from . import config
+from . import ipmi
+from . import metrics
+# Raised by the BMC operations
+from .ipmi import IPMIError
+from .fdb import mac_to_int, mac_to_str
 
 # Seconds to wait for the OS to shutdown gracefully
 SHUTDOWN_GRACE_TIME = 5
+# Seconds to wait for an IPMI command before killing it
+IPMI_TIMEOUT = 30
+# Seconds during which a power status is reused
+STATUS_TTL = 2
+
+ON = 'on'
+OFF = 'off'
+UNKNOWN = 'unknown'
+
+logger = logging.getLogger(__name__)
 
 
 class MacAddressNotFoundError(Exception):
@@ -19,91 +35,296 @@ class MacAddressNotFoundError(Exception):
 
 class BMC(object):
     """BMC representation"""
-    def __init__(self, address, user, password):
+    __slots__ = ('address', 'user', 'password', 'timeout', '_status', '_status_time')
+
+    def __init__(self, address, user, password, timeout=IPMI_TIMEOUT):
         self.address = address
         self.user = user
         self.password = password
+        self.timeout = timeout
+        # Last power status read and when
+        self._status = None
+        self._status_time = 0
 
-    def is_on(self):
-        """Check the node power status is on"""
-        output = self._run_ipmi_cmd('chassis power status')
+    def to_dict(self):
+        """Convert the BMC to a dictionary"""
+        return {'address': self.address, 'user': self.user,
+                'password': self.password, 'timeout': self.timeout}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a BMC from a dictionary as returned by `to_dict`"""
+        # BMCs saved by older versions have no timeout
+        return cls(data['address'], data['user'], data['password'],
+                   data.get('timeout') or IPMI_TIMEOUT)
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(state['address'], state['user'], state['password'],
+                      state.get('timeout') or IPMI_TIMEOUT)
+
+    def power_status(self, timeout=None, max_age=None):
+        """Return the node power status: on, off or unknown
+
+        :param max_age: seconds a previous status can be reused, by default
+                        the ipmi.status_ttl setting. Use 0 to read it again.
+        """
+        if max_age is None:
+            max_age = config.settings.get('ipmi', {}).get('status_ttl', STATUS_TTL)
+        if self._status is not None and time.time() - self._status_time < max_age:
+            return self._status
+        output = self._run_ipmi_cmd('chassis power status', timeout)
         if re.search(r'power is on', output, flags=re.IGNORECASE):
-            return True
+            status = ON
+        elif re.search(r'power is off', output, flags=re.IGNORECASE):
+            status = OFF
         else:
-            return False
+            status = UNKNOWN
+        self._status, self._status_time = status, time.time()
+        return status
 
-    def is_off(self):
+    def is_on(self, timeout=None):
+        """Check the node power status is on"""
+        return self.power_status(timeout) == ON
+
+    def is_off(self, timeout=None):
         """Check the node power status is off"""
-        output = self._run_ipmi_cmd('chassis power status')
-        if re.search(r'power is off', output, flags=re.IGNORECASE):
-            return True
-        else:
-            return False
+        return self.power_status(timeout) == OFF
 
-    def power_on(self):
+    def power_on(self, timeout=None):
         """Power on the node"""
-        return self._run_ipmi_cmd('chassis power on')
+        return self._run_ipmi_cmd('chassis power on', timeout)
 
-    def power_off(self):
+    def power_soft(self, timeout=None):
+        """Request a soft-shutdown of the OS via ACPI"""
+        return self._run_ipmi_cmd('chassis power soft', timeout)
+
+    def power_off(self, timeout=None):
         """Power off the node"""
         # First try soft-shutdown of OS via ACPI
-        self._run_ipmi_cmd('chassis power soft')
+        self.power_soft(timeout)
         for _ in range(SHUTDOWN_GRACE_TIME):
             time.sleep(1)
-            if self.is_off():
+            if self.power_status(timeout, max_age=0) == OFF:
                 return True
-        return self._run_ipmi_cmd('chassis power off')
+        return self.power_hard_off(timeout)
 
-    def activate_pxe(self):
+    def power_hard_off(self, timeout=None):
+        """Power off the node immediately"""
+        return self._run_ipmi_cmd('chassis power off', timeout)
+
+    def activate_pxe(self, timeout=None):
         """Temporarily activate pxe for next boot"""
-        return self._run_ipmi_cmd('chassis bootdev pxe')
-
-    def _run_ipmi_cmd(self, cmd):
-        """Run a given ipmi command"""
-        ipmicmd = 'ipmitool -I lanplus -H {} -U {} -P {} {}'.format(
-            self.address, self.user, self.password, cmd)
-        try:
-            output = subprocess.check_output(ipmicmd, shell=True)
-        except subprocess.CalledProcessError as error:
-            print('ERROR: IPMI command failed')
-            print('  CMD: {}'.format(ipmicmd))
-            print('  OUTPUT: {}'.format(error.output))
-            print('  Exit status: {}'.format(error.returncode))
-        return output
-
-
-class Node(ToDictMixin):
-    """Representation of a given node"""
-    def __init__(self, name, switchports={}, bmcaddr='', bmcuser='', bmcpasswd=''):
-        self.bmc = BMC(bmcaddr, bmcuser, bmcpasswd)
+        return self._run_ipmi_cmd('chassis bootdev pxe', timeout)
+
+    def _run_ipmi_cmd(self, cmd, timeout=None):
+        """Run a given ipmi command through the configured transport
+
+        The command fails if it does not finish in `timeout` seconds (by
+        default the BMC timeout). Its latency and failures are recorded.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if cmd != 'chassis power status':
+            # The command may change the power status
+            self._status = None
+        with metrics.timer('ipmi_call', command=cmd):
+            return ipmi.transport().run(self, cmd, timeout)
+
+
+class Switchport(object):
+    """Switch port where a NIC of a node is connected
+
+    The MAC is kept as a 48-bit integer, None while it is not discovered.
+    """
+    __slots__ = ('switch', 'nic', 'port', 'vlan', 'mac')
+
+    def __init__(self, switch, nic=None, port=None, vlan=None, mac=None):
+        self.switch = switch
+        self.nic = nic
+        self.port = port
+        self.vlan = vlan
+        # The configuration uses an empty MAC for the ones to discover
+        self.mac = None if mac in (None, '') else mac_to_int(mac)
+
+    @property
+    def mac_address(self):
+        """MAC in its canonical text format, None if not discovered"""
+        return None if self.mac is None else mac_to_str(self.mac)
+
+    def to_dict(self):
+        """Convert the switchport options to a dictionary"""
+        swopts = {'nic': self.nic, 'port': self.port, 'vlan': self.vlan}
+        if self.mac is not None:
+            swopts['mac'] = mac_to_str(self.mac)
+        return swopts
+
+    def __repr__(self):
+        return '<Switchport({}, nic={}, port={}, vlan={}, mac={})>'.format(
+            self.switch, self.nic, self.port, self.vlan, self.mac_address)
+
+
+def config_switchports(nodecfg):
+    """Return the switchport options by switch of a node in nodes.yml
+
+    nodes.yml lists the NICs of a node by name, each one with the switch,
+    port and vlan where it is connected and optionally its MAC.
+    """
+    switchports = {}
+    for nic, nicopts in (nodecfg.get('nics') or {}).items():
+        swopts = dict((key, value) for key, value in nicopts.items() if key != 'switch')
+        swopts['nic'] = nic
+        switchports[nicopts['switch']] = swopts
+    return switchports
+
+
+def config_hash(nodecfg):
+    """Hash of the settings of a node in nodes.yml its discovery depends on"""
+    bmc = nodecfg.get('bmc', {})
+    ports = sorted((switch, swopts.get('nic'), swopts.get('port'), swopts.get('vlan'),
+                    swopts.get('mac') or '')
+                   for switch, swopts in config_switchports(nodecfg).items())
+    settings = ((bmc.get('address'), bmc.get('user'), bmc.get('password'),
+                 bmc.get('timeout', IPMI_TIMEOUT)), ports)
+    return hashlib.sha1(repr(settings).encode('utf-8')).hexdigest()
+
+
+class Node(object):
+    """Representation of a given node
+
+    The switchports are kept as a list of Switchport sorted by switch and
+    the number of MACs still to discover is kept up to date by `add_mac`.
+    config_hash is the hash of the configuration the node was created from.
+    """
+    __slots__ = ('name', 'bmc', 'ports', '_missing', 'config_hash')
+
+    def __init__(self, name, switchports={}, bmcaddr='', bmcuser='', bmcpasswd='',
+                 bmctimeout=IPMI_TIMEOUT):
+        self.bmc = BMC(bmcaddr, bmcuser, bmcpasswd, bmctimeout)
         self.name = name
-        self.switchports = switchports
+        self.config_hash = None
+        self._set_switchports(switchports)
+
+    @classmethod
+    def from_config(cls, name, nodecfg):
+        """Create a node from its configuration in nodes.yml"""
+        bmc = nodecfg['bmc']
+        node = cls(name, config_switchports(nodecfg), bmc['address'], bmc['user'],
+                   bmc['password'], bmc.get('timeout', IPMI_TIMEOUT))
+        node.config_hash = config_hash(nodecfg)
+        return node
+
+    def keep_macs(self, stored):
+        """Keep the MACs discovered in a previous version of the node
+
+        Only the MACs of the switchports whose switch, port and vlan did
+        not change are kept, so only the NICs that changed are rediscovered.
+        """
+        known = dict(((port.switch, port.port, port.vlan), port.mac) for port in stored.ports)
+        for port in self.missing_ports():
+            mac = known.get((port.switch, port.port, port.vlan))
+            if mac is not None:
+                self.add_mac(port.switch, mac)
+
+    def _set_switchports(self, switchports):
+        self.ports = [Switchport(sw, swopts.get('nic'), swopts.get('port'),
+                                 swopts.get('vlan'), swopts.get('mac'))
+                      for sw, swopts in sorted(switchports.items())]
+        self._missing = sum(1 for port in self.ports if port.mac is None)
+
+    @property
+    def switchports(self):
+        """Switchport options by switch name, as found in nodes.yml
+
+        It is a copy: use `add_mac` to change the MACs of the node.
+        """
+        return dict((port.switch, port.to_dict()) for port in self.ports)
+
+    def to_dict(self):
+        """Convert the node to a dictionary"""
+        return {'name': self.name, 'bmc': self.bmc.to_dict(),
+                'switchports': self.switchports}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a node from a dictionary as returned by `to_dict`"""
+        node = cls.__new__(cls)
+        node.__setstate__(data)
+        return node
+
+    def __getstate__(self):
+        return (self.name, self.bmc.address, self.bmc.user, self.bmc.password,
+                self.bmc.timeout, [(port.switch, port.nic, port.port, port.vlan, port.mac)
+                                   for port in self.ports], self.config_hash)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Dictionaries of from_dict and nodes pickled by older versions,
+            # which hold a BMC object
+            self.name = state['name']
+            bmc = state['bmc']
+            self.bmc = bmc if isinstance(bmc, BMC) else BMC.from_dict(bmc)
+            self._set_switchports(state['switchports'])
+            self.config_hash = state.get('config_hash')
+            return
+        # Nodes pickled by older versions have no config_hash
+        self.name, address, user, password, timeout, ports = state[:6]
+        self.config_hash = state[6] if len(state) > 6 else None
+        self.bmc = BMC(address, user, password, timeout)
+        self.ports = [Switchport(*port) for port in ports]
+        self._missing = sum(1 for port in self.ports if port.mac is None)
 
     def __repr__(self):
-        return ('<{}({}, switchports={}, bmcaddr={}, bmcuser={}, bmcpasswd={})>'
-                .format(
-                    self.__class__, self.name, self.switchports,
-                    self.bmcaddr, self.bmcuser, self.bmcpasswd
-                ))
+        return '<{}({}, switchports={}, bmcaddr={})>'.format(
+            self.__class__.__name__, self.name, self.switchports, self.bmc.address)
+
+    def is_on(self):
+        """Check the node power status is on"""
+        return self.bmc.is_on()
+
+    def is_off(self):
+        """Check the node power status is off"""
+        return self.bmc.is_off()
+
+    def power_on(self):
+        """Power on the node"""
+        return self.bmc.power_on()
+
+    def power_off(self):
+        """Power off the node"""
+        return self.bmc.power_off()
+
+    def activate_pxe(self):
+        """Temporarily activate pxe for next boot"""
+        return self.bmc.activate_pxe()
+
+    def missing_ports(self):
+        """Return the switchports whose MAC is not discovered yet"""
+        return [port for port in self.ports if port.mac is None]
 
     def add_mac(self, switch, mac):
         """Associate the given mac to the switchport"""
-        self.switchports[switch]['mac'] = mac
+        for port in self.ports:
+            if port.switch == switch:
+                if port.mac is None:
+                    self._missing -= 1
+                port.mac = mac_to_int(mac)
+                return
+        raise KeyError(switch)
 
     def has_all_macs(self):
         """Confirm if all the MACs are available"""
-        for sw, swopts in self.switchports.items():
-            if 'mac' not in swopts:
-                return False
-        return True
+        return self._missing == 0
 
     def has_missing_macs(self):
         """Confirm if there are missing MACs"""
-        return not self.has_all_macs()
+        return self._missing > 0
 
     def get_mac(self, nic):
         """Get the MAC address for the given NIC interface"""
-        for sw, swopts in self.switchports.items():
-            if swopts['nic'] == nic:
-                return swopts['mac']
+        for port in self.ports:
+            if port.nic == nic and port.mac is not None:
+                return mac_to_str(port.mac)
         raise MacAddressNotFoundError('No MAC address found for NIC {}'.format(nic))
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Power module
+   Implements batch power operations over many BMCs concurrently
+"""
+from __future__ import print_function, with_statement
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+from .node import IPMIError, SHUTDOWN_GRACE_TIME, ON, OFF
+from . import config
+
+# Maximum number of BMCs contacted at the same time
+WORKERS = 32
+# Maximum number of nodes of the same PDU or rack powered on in each wave
+# of a discovery, 0 for no limit
+WAVE_SIZE = 0
+# Seconds between two power-on waves
+WAVE_INTERVAL = 30
+
+logger = logging.getLogger(__name__)
+
+
+class PowerReport(object):
+    """Per-node outcome of a batch power operation
+
+    results: maps each node name to the result of the operation
+    errors: maps each node name to the error that made it fail
+    """
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+
+    def add(self, name, result=None, error=None):
+        """Record the outcome of the operation on a node"""
+        if error is None:
+            self.results[name] = result
+            self.errors.pop(name, None)
+        else:
+            self.errors[name] = error
+            self.results.pop(name, None)
+
+    def merge(self, other):
+        """Merge the errors of another report into this one"""
+        self.errors.update(other.errors)
+
+    def succeeded(self):
+        """Names of the nodes where the operation succeeded"""
+        return sorted(self.results)
+
+    def failed(self):
+        """Names of the nodes where the operation failed"""
+        return sorted(self.errors)
+
+    def __repr__(self):
+        return '<{}(results={}, errors={})>'.format(
+            self.__class__.__name__, self.results, self.errors)
+
+
+def status(targets, workers=None, timeout=None, max_age=None):
+    """Get the power status of the given nodes or BMCs
+
+    :param max_age: seconds a previous status can be reused, see
+                    BMC.power_status
+    """
+    return _run(targets, lambda bmc: bmc.power_status(timeout, max_age), workers)
+
+
+def activate_pxe(targets, workers=None, timeout=None):
+    """Temporarily activate PXE for next boot on the given nodes or BMCs"""
+    return _run(targets, lambda bmc: bmc.activate_pxe(timeout), workers)
+
+
+def power_on(targets, workers=None, timeout=None):
+    """Power on the given nodes or BMCs"""
+    return _run(targets, lambda bmc: bmc.power_on(timeout), workers)
+
+
+def power_off(targets, workers=None, timeout=None, grace_time=SHUTDOWN_GRACE_TIME):
+    """Power off the given nodes or BMCs
+
+    A soft-shutdown is requested on all of them at once and the grace time
+    is waited only once for the whole batch. The nodes that are still on
+    after it are powered off immediately.
+    """
+    targets = list(targets)
+    report = _run(targets, lambda bmc: bmc.power_soft(timeout), workers)
+    pending = [t for t in targets if _name(t) in report.results]
+    deadline = time.time() + grace_time
+    while pending and time.time() < deadline:
+        time.sleep(1)
+        current = status(pending, workers, timeout, max_age=0)
+        for target in pending:
+            if current.results.get(_name(target)) == OFF:
+                report.add(_name(target), OFF)
+        pending = [t for t in pending if current.results.get(_name(t)) != OFF]
+    if pending:
+        hard = _run(pending, lambda bmc: bmc.power_hard_off(timeout), workers)
+        for name, error in hard.errors.items():
+            report.add(name, error=error)
+        for name in hard.results:
+            report.add(name, OFF)
+    return report
+
+
+def boot_for_discovery(targets, poweroff=False, workers=None, timeout=None):
+    """Boot the given nodes through PXE so that they show up in the switches
+
+    Nodes that are off are powered on with PXE temporarily activated. Nodes
+    that are already on are only rebooted if poweroff is set.
+
+    The results of the report are 'booted' for the nodes that were powered
+    on and 'on' for the nodes that were left running.
+    """
+    targets = list(targets)
+    report = PowerReport()
+    current = status(targets, workers, timeout)
+    report.merge(current)
+    off = [t for t in targets if current.results.get(_name(t)) == OFF]
+    running = [t for t in targets if current.results.get(_name(t)) == ON]
+    for target in targets:
+        if current.results.get(_name(target)) not in (ON, OFF, None):
+            report.add(_name(target), error='Unknown power status')
+    if running:
+        if poweroff:
+            logger.info('Powering off {} nodes'.format(len(running)))
+            shutdown = power_off(running, workers, timeout)
+            report.merge(shutdown)
+            off.extend(t for t in running if _name(t) in shutdown.results)
+        else:
+            for target in running:
+                logger.warn('{} with missing MACs is already on'.format(_name(target)))
+                report.add(_name(target), ON)
+            logger.warn(
+                'CLI is run without poweroff option so you should reboot the nodes manually')
+    # Temporarily activating PXE helps in the discovery
+    logger.info('Temporarily activating PXE on {} nodes'.format(len(off)))
+    pxe = activate_pxe(off, workers, timeout)
+    report.merge(pxe)
+    ready = [t for t in off if _name(t) in pxe.results]
+    logger.info('Powering on {} nodes'.format(len(ready)))
+    boot = power_on(ready, workers, timeout)
+    report.merge(boot)
+    for name in boot.results:
+        report.add(name, 'booted')
+    for name, error in sorted(report.errors.items()):
+        logger.error('Unable to boot {} for discovery: {}'.format(name, error))
+    return report
+
+
+def power_group(target):
+    """Return the PDU feeding a node, or its rack, as given in nodes.yml
+
+    Nodes with neither of them are all in the same group.
+    """
+    nodecfg = config.nodes.get(_name(target)) or {}
+    return nodecfg.get('pdu', nodecfg.get('rack'))
+
+
+def waves(targets, size=None, group=power_group):
+    """Split the targets in power-on waves
+
+    Every wave has at most `size` targets of each group, so the inrush
+    current of a PDU stays within its limit however many nodes there are.
+
+    :param size: targets of each group per wave, by default the wave_size
+                 of the power settings; 0 puts all the targets in one wave
+    :param group: function returning the group of a target
+    """
+    targets = list(targets)
+    if size is None:
+        size = config.settings.get('power', {}).get('wave_size', WAVE_SIZE)
+    if not targets:
+        return []
+    if not size:
+        return [targets]
+    groups = {}
+    order = []
+    for target in targets:
+        key = group(target)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(target)
+    largest = max(len(members) for members in groups.values())
+    return [[target for key in order for target in groups[key][start:start + size]]
+            for start in range(0, largest, size)]
+
+
+def wave_interval():
+    """Seconds between two power-on waves"""
+    return config.settings.get('power', {}).get('wave_interval', WAVE_INTERVAL)
+
+
+def _run(targets, operation, workers=None):
+    """Run the operation on the BMC of every target concurrently"""
+    targets = list(targets)
+    report = PowerReport()
+    if not targets:
+        return report
+    if workers is None:
+        workers = config.settings.get('ipmi', {}).get('workers', WORKERS)
+    pool = ThreadPool(max(1, min(workers, len(targets))))
+    try:
+        outcomes = pool.map(lambda target: _apply(operation, target), targets)
+    finally:
+        pool.close()
+        pool.join()
+    for target, (result, error) in zip(targets, outcomes):
+        report.add(_name(target), result, error)
+    return report
+
+
+def _apply(operation, target):
+    """Apply the operation to a target returning a (result, error) tuple"""
+    try:
+        return operation(_bmc(target)), None
+    except (IPMIError, OSError) as error:
+        return None, str(error)
+
+
+def _bmc(target):
+    """Return the BMC of a node or the BMC itself"""
+    return getattr(target, 'bmc', target)
+
+
+def _name(target):
+    """Return the name used to report a node or a BMC"""
+    return getattr(target, 'name', None) or _bmc(target).address
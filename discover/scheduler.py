@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Scheduler module
+   Implements the scheduling of the polls done while discovering nodes
+"""
+from __future__ import print_function, with_statement
+import itertools
+import logging
+import threading
+import time
+from . import config
+from . import metrics
+
+# Seconds to wait before the first poll of a node
+INITIAL_DELAY = 5
+# The delay is multiplied by this factor after every poll
+BACKOFF = 1.5
+# Maximum number of seconds between two polls of the same node
+MAX_DELAY = 60
+# Seconds after which a node that is still missing MACs is given up
+TIMEOUT = 360
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy(object):
+    """Timing policy of the discovery polls
+
+    Nodes are polled often at first and then less frequently, until they
+    reach their timeout.
+    """
+    def __init__(self, initial_delay=INITIAL_DELAY, backoff=BACKOFF,
+                 max_delay=MAX_DELAY, timeout=TIMEOUT):
+        self.initial_delay = initial_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+    @classmethod
+    def from_settings(cls, settings=None):
+        """Build the policy from the discovery section of the settings"""
+        if settings is None:
+            settings = config.settings.get('discovery', {})
+        return cls(settings.get('initial_delay', INITIAL_DELAY),
+                   settings.get('backoff', BACKOFF),
+                   settings.get('max_delay', MAX_DELAY),
+                   settings.get('timeout', TIMEOUT))
+
+    def delay(self, attempt):
+        """Seconds to wait before the given poll attempt (starting at 0)"""
+        return min(self.initial_delay * self.backoff ** attempt, self.max_delay)
+
+    def __repr__(self):
+        return '<{}(initial_delay={}, backoff={}, max_delay={}, timeout={})>'.format(
+            self.__class__.__name__, self.initial_delay, self.backoff,
+            self.max_delay, self.timeout)
+
+
+class _Entry(object):
+    """Scheduling state of a node"""
+    __slots__ = ('node', 'attempt', 'added', 'next_poll', 'deadline')
+
+    def __init__(self, node, now, policy):
+        self.node = node
+        self.attempt = 0
+        self.added = now
+        self.next_poll = now + policy.delay(0)
+        self.deadline = now + policy.timeout
+
+
+class Scheduler(object):
+    """Polls the pending nodes until all their MACs are found
+
+    Every node has its own poll times and deadline. A node leaves the
+    scheduler as soon as all its MACs are found or its deadline is reached,
+    and the run finishes when the last node leaves.
+
+    Setting the wakeup event interrupts the wait between polls, so MACs
+    pushed by other sources are picked up without waiting for the next poll.
+
+    Functions can be scheduled with `call_later`, for example to power on
+    more nodes and add them while the previous ones are being polled. The
+    run does not finish while there are calls pending.
+    """
+    def __init__(self, policy=None, clock=time.time, sleep=None):
+        self.policy = policy or RetryPolicy.from_settings()
+        self.wakeup = threading.Event()
+        self._clock = clock
+        self._sleep = sleep
+        self._entries = {}
+        self._calls = []
+        self._sequence = itertools.count()
+
+    def add(self, nodes):
+        """Start tracking the given nodes"""
+        now = self._clock()
+        for node in nodes:
+            self._entries[node.name] = _Entry(node, now, self.policy)
+
+    def call_later(self, delay, function, *args):
+        """Call a function from the run loop after the given seconds"""
+        self._calls.append((self._clock() + delay, next(self._sequence), function, args))
+        self._calls.sort()
+
+    def pending(self):
+        """Nodes that are still being polled"""
+        return [entry.node for entry in self._entries.values()]
+
+    def run(self, poll, resolve=None):
+        """Poll the nodes until all are finished
+
+        :param poll: function called with the list of nodes to poll
+        :param resolve: function called with all the pending nodes when the
+                        wakeup event is set, to resolve them without polling
+        :returns: the list of nodes that reached their deadline
+        """
+        failed = []
+        while self._entries or self._calls:
+            now = self._clock()
+            if self._calls and self._calls[0][0] <= now:
+                _, _, function, args = self._calls.pop(0)
+                function(*args)
+                continue
+            next_poll = min([entry.next_poll for entry in self._entries.values()] +
+                            [call[0] for call in self._calls[:1]])
+            if next_poll > now:
+                logger.debug('Waiting {:.1f} seconds to retry'.format(next_poll - now))
+                if self._wait(next_poll - now):
+                    metrics.inc('discovery_wakeups_total')
+                    if resolve is not None:
+                        resolve(self.pending())
+                        self._finish_discovered()
+                # Check again what is due after the wait
+                continue
+            due = [entry for entry in self._entries.values() if entry.next_poll <= now]
+            logger.info('Polling {} of {} pending nodes'.format(
+                len(due), len(self._entries)))
+            metrics.inc('discovery_poll_rounds_total')
+            metrics.observe('discovery_polled_nodes', len(due))
+            poll([entry.node for entry in due])
+            now = self._clock()
+            self._finish_discovered()
+            for entry in list(self._entries.values()):
+                if entry.next_poll > now:
+                    continue
+                elif now >= entry.deadline:
+                    logger.warn('Unable to find all MACs for node {} after {} seconds'
+                                .format(entry.node.name, self.policy.timeout))
+                    del self._entries[entry.node.name]
+                    failed.append(entry.node)
+                    metrics.inc('discovery_failed_nodes_total')
+                else:
+                    entry.attempt += 1
+                    delay = self.policy.delay(entry.attempt)
+                    entry.next_poll = min(now + delay, entry.deadline)
+        return failed
+
+    def _wait(self, seconds):
+        """Wait the given seconds unless woken up
+
+        :returns: True if the wakeup event interrupted the wait
+        """
+        if self._sleep is not None:
+            self._sleep(seconds)
+            return False
+        woken = self.wakeup.wait(seconds)
+        self.wakeup.clear()
+        return woken
+
+    def _finish_discovered(self):
+        """Stop tracking the nodes that have all their MACs"""
+        now = self._clock()
+        for entry in list(self._entries.values()):
+            if entry.node.has_all_macs():
+                logger.info('Node {} discovered after {:.1f} seconds'.format(
+                    entry.node.name, now - entry.added))
+                # Not labelled by node: a series per node is too many
+                metrics.observe('discovery_node_seconds', now - entry.added)
+                metrics.observe('discovery_node_attempts', entry.attempt + 1)
+                del self._entries[entry.node.name]
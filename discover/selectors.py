@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Selectors module
+   Implements the selection of nodes by name, range, glob or rack.
+
+   A selector is a comma separated list of:
+       - node names: node-10-1
+       - ranges: node-10-[1-19], node-[10-11]-[1,3,5-7]
+       - globs: node-10-*
+       - racks: rack:10, the nodes with that rack in nodes.yml
+       - all: every node
+"""
+from __future__ import print_function, with_statement
+import fnmatch
+import itertools
+import re
+from . import config
+from .inventory import natural_key
+
+# Prefix of the selectors that choose the nodes of a rack
+RACK_PREFIX = 'rack:'
+
+_range = re.compile(r'\[([0-9,\-]+)\]')
+_glob = re.compile(r'[*?\[]')
+
+
+class SelectorError(ValueError):
+    """The selector is invalid or it does not match any node"""
+    pass
+
+
+def _split(selector):
+    """Split a selector by the commas that are not inside a range"""
+    parts = []
+    depth = 0
+    current = ''
+    for char in selector:
+        if char == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        depth += {'[': 1, ']': -1}.get(char, 0)
+        current += char
+    parts.append(current)
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _numbers(spec):
+    """Expand the contents of a range like 1,3,5-7 keeping the zero padding"""
+    numbers = []
+    for item in spec.split(','):
+        first, sep, last = item.partition('-')
+        if not first or (sep and not last):
+            raise SelectorError('Invalid range: [{}]'.format(spec))
+        width = len(first) if first.startswith('0') else 0
+        for number in range(int(first), int(last or first) + 1):
+            numbers.append('{:0{}d}'.format(number, width) if width else str(number))
+    return numbers
+
+
+def expand(pattern):
+    """Expand the numeric ranges of a pattern
+
+    >>> expand('node-[10-11]-[1-2]')
+    ['node-10-1', 'node-10-2', 'node-11-1', 'node-11-2']
+    """
+    pieces = _range.split(pattern)
+    # The literal parts are at even positions and the ranges at odd ones
+    choices = [[piece] if i % 2 == 0 else _numbers(piece) for i, piece in enumerate(pieces)]
+    return [''.join(combination) for combination in itertools.product(*choices)]
+
+
+def select(selector, candidates=None):
+    """Return the names of the nodes chosen by a selector in natural order
+
+    Plain node names are returned as given, even if they are not among
+    the candidates, so nodes only found in the inventory can be selected.
+
+    :param candidates: names to match the ranges and globs against, by
+                       default the nodes in the configuration
+    :raises SelectorError: if a range, glob or rack does not match any node
+    """
+    if candidates is None:
+        candidates = config.nodes
+    candidates = list(candidates)
+    known = set(candidates)
+    selected = set()
+    for part in _split(selector):
+        if part.lower() == 'all':
+            matches = candidates
+        elif part.startswith(RACK_PREFIX):
+            rack = part[len(RACK_PREFIX):]
+            matches = [name for name in config.nodes
+                       if str(config.nodes[name].get('rack')) == rack]
+        elif _glob.search(part):
+            matches = []
+            for pattern in expand(part):
+                if _glob.search(pattern):
+                    matches.extend(fnmatch.filter(candidates, pattern))
+                elif pattern in known:
+                    matches.append(pattern)
+        else:
+            matches = [part]
+        if not matches:
+            raise SelectorError('No node matches {}'.format(part))
+        selected.update(matches)
+    if not selected:
+        raise SelectorError('No node selected')
+    return sorted(selected, key=natural_key)
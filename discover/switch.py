@@ -3,18 +3,47 @@
    Implements the switch object and its functionality
 """
 from __future__ import print_function, with_statement
+import contextlib
+import hashlib
+import json
 import logging
-from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+import os
+import struct
+import threading
 import time
-from snimpy.manager import Manager as M
-from snimpy.manager import load
-from snimpy.snmp import SNMPException
+from numbers import Integral
 import config
+from . import metrics
+from .fdb import FDBTable, mac_to_str
+from .node import config_switchports
 
 # Number of seconds during which to cache entries
 CACHE_TIME = 60
+# Maximum number of switches queried at the same time
+WORKERS = 16
+# Number of entries requested in each GETBULK request
+MAX_REPETITIONS = 40
+# Seconds during which the MAC tables saved by a run are reused by later runs
+SNAPSHOT_TTL = 60
+# Directory where the MAC tables are saved
+SNAPSHOT_DIR = os.path.expanduser('~/.discover/fdb')
+# Seconds during which the saved port tables are reused
+PORTS_TTL = 3600
+# lldpRemPortIdSubtype of the neighbors that send the MAC of their port
+LLDP_PORT_ID_MAC = 3
 switches = {}
 
+# Header of the saved MAC tables: time of the walk and hash of its scope
+_SNAPSHOT_HEADER = struct.Struct('=d20s')
+# Set to walk the switches even if there are saved tables
+_refresh = False
+
+# libsmi keeps global state so MIB loading must not run concurrently
+_mib_lock = threading.Lock()
+_loaded_mibs = set()
+_build_lock = threading.Lock()
+
 logger = logging.getLogger(__name__)
 
 
@@ -24,42 +53,155 @@ class SNMPClient(object):
         self.address = address
         self.community = community
 
-    def get_mac_table(self):
-        """Obtain the MAC table"""
-        table = defaultdict(list)
-        load('Q-BRIDGE-MIB')
+    def get_mac_table(self, scope=None, max_repetitions=MAX_REPETITIONS):
+        """Obtain the MAC table
+
+        :param scope: dict mapping each vlan to walk to the set of ports to
+                      keep. By default the whole table is walked.
+        :param max_repetitions: max-repetitions of the GETBULK requests
+        """
+        from snimpy.manager import Manager as M
+        _load_mib('Q-BRIDGE-MIB')
         logger.info('Retrieving MAC table for {}'.format(self.address))
-        with M(host=self.address, community=self.community, version=2) as m:
+        with M(host=self.address, community=self.community, version=2,
+               bulk=max_repetitions) as m:
             dbPort = m.dot1qTpFdbPort
-            for idx in dbPort:
-                vlan, mac = idx
-                # snimpy fails when retrieving an empty value
-                try:
-                    port = int(dbPort[idx])
-                    logger.debug('{} {} {}'.format(port, mac, vlan))
-                    table[port].append({"vlan": int(vlan), "mac": _normalize_mac(mac)})
-                except SNMPException:
-                    logger.error('Unable to get port for mac: {} {}'.format(vlan, mac))
-        logger.debug('Finished retrieving MAC table for {}'.format(self.address))
-        return table
 
-    def get_port_info_table(self):
-        """Obtain the Port table"""
-        table = {}
-        load('IF-MIB')
-        with M(host=self.address, community=self.community, version=2) as m:
-            for idx in m.ifName:
-                name = m.ifName[idx]
-                descr = m.ifDescr[idx]
-                # snimpy fails when retrieving an empty value
-                try:
-                    label = m.ifAlias[idx]
-                except UnboundLocalError:
-                    label = ''
-                print('Adding {} {} {} {}'.format(idx, name, descr, label))
-                table[int(idx)] = {"name": name, "descr": descr, "label": label}
+            def entries():
+                if scope is None:
+                    walks = [dbPort.iteritems()]
+                    wanted = {}
+                else:
+                    # Only walk the subtrees of the wanted vlans
+                    walks = [dbPort.iteritems(vlan) for vlan in sorted(scope)]
+                    wanted = scope
+                for walk in walks:
+                    for (vlan, mac), port in walk:
+                        port = int(port)
+                        ports = wanted.get(int(vlan))
+                        # Drop the entries of the ports we are not interested in
+                        if ports is not None and port not in ports:
+                            continue
+                        yield port, vlan, mac
+
+            table = FDBTable.from_entries(entries())
+        logger.debug('Finished retrieving MAC table for {}: {} entries'.format(
+            self.address, len(table)))
         return table
 
+    def get_port_info_table(self, max_repetitions=MAX_REPETITIONS):
+        """Obtain the Port table
+
+        Each column is retrieved with a single bulk walk instead of one GET
+        per interface and column.
+
+        :returns: a PortTable
+        """
+        from snimpy.manager import Manager as M
+        _load_mib('IF-MIB')
+        _load_mib('BRIDGE-MIB')
+        logger.info('Retrieving port table for {}'.format(self.address))
+        with M(host=self.address, community=self.community, version=2,
+               bulk=max_repetitions) as m:
+            names = dict((int(idx), str(name)) for idx, name in m.ifName.iteritems())
+            descrs = dict((int(idx), str(descr)) for idx, descr in m.ifDescr.iteritems())
+            # snimpy fails when retrieving an empty value
+            try:
+                labels = dict((int(idx), str(label)) for idx, label in m.ifAlias.iteritems())
+            except UnboundLocalError:
+                labels = {}
+            bridge_ports = dict((int(port), int(idx))
+                                for port, idx in m.dot1dBasePortIfIndex.iteritems())
+        interfaces = dict((idx, {'name': name, 'descr': descrs.get(idx, ''),
+                                 'label': labels.get(idx, '')})
+                          for idx, name in names.items())
+        logger.debug('Finished retrieving port table for {}: {} interfaces'.format(
+            self.address, len(interfaces)))
+        return PortTable(interfaces, bridge_ports)
+
+    def get_lldp_neighbors(self, max_repetitions=MAX_REPETITIONS):
+        """Obtain the LLDP neighbors whose port ID is a MAC
+
+        Hosts running an LLDP agent such as lldpd send by default the MAC
+        of the NIC as port ID, so the MACs are known without the host
+        sending a frame on any vlan.
+
+        :returns: a dictionary from each local port number (the bridge
+                  port) to the list of integer MACs seen there
+        """
+        from snimpy.manager import Manager as M
+        _load_mib('LLDP-MIB')
+        logger.info('Retrieving LLDP neighbors for {}'.format(self.address))
+        neighbors = {}
+        with M(host=self.address, community=self.community, version=2,
+               bulk=max_repetitions) as m:
+            subtypes = dict((tuple(index), int(subtype))
+                            for index, subtype in m.lldpRemPortIdSubtype.iteritems())
+            for index, port_id in m.lldpRemPortId.iteritems():
+                # The index is (lldpRemTimeMark, lldpRemLocalPortNum, lldpRemIndex)
+                if subtypes.get(tuple(index)) != LLDP_PORT_ID_MAC:
+                    continue
+                octets = _octets(port_id)
+                if len(octets) != 6:
+                    continue
+                mac = 0
+                for octet in octets:
+                    mac = (mac << 8) | octet
+                macs = neighbors.setdefault(int(index[1]), [])
+                if mac not in macs:
+                    macs.append(mac)
+        logger.debug('Finished retrieving LLDP neighbors for {}: {} ports'.format(
+            self.address, len(neighbors)))
+        return neighbors
+
+
+def _octets(value):
+    """Return the raw octets of an OCTET STRING returned by snimpy"""
+    # snimpy keeps the raw value apart from the one formatted for display
+    return bytearray(getattr(value, '_value', value))
+
+
+class PortTable(object):
+    """Interfaces of a switch
+
+    interfaces maps every ifIndex to its name, description and label
+    (ifName, ifDescr and ifAlias) and bridge_ports maps every bridge port
+    number, the ports of the MAC table, to its ifIndex.
+    """
+    def __init__(self, interfaces=None, bridge_ports=None):
+        self.interfaces = interfaces or {}
+        self.bridge_ports = bridge_ports or {}
+        self._by_name = {}
+        for port, idx in self.bridge_ports.items():
+            interface = self.interfaces.get(idx, {})
+            for key in ('descr', 'name'):
+                if interface.get(key):
+                    self._by_name[interface[key]] = port
+
+    def bridge_port(self, name):
+        """Return the bridge port of an interface given by ifName or ifDescr
+
+        :returns: the bridge port number, None if it is unknown
+        """
+        return self._by_name.get(name)
+
+    def to_dict(self):
+        return {'interfaces': self.interfaces, 'bridge_ports': self.bridge_ports}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create the table from a dictionary, with string keys as in JSON"""
+        return cls(dict((int(idx), interface)
+                        for idx, interface in data['interfaces'].items()),
+                   dict((int(port), int(idx)) for port, idx in data['bridge_ports'].items()))
+
+    def __len__(self):
+        return len(self.interfaces)
+
+    def __repr__(self):
+        return '<{}(interfaces={}, bridge_ports={})>'.format(
+            self.__class__.__name__, len(self.interfaces), len(self.bridge_ports))
+
 
 class Switch(object):
     """Representation of a switch"""
@@ -68,44 +210,426 @@ class Switch(object):
         self.address = address
         self.community = community
         self._snmp = SNMPClient(address, community)
-        self.macs = {}
-        self.ports = {}
+        # Vlans and ports of the MAC table we are interested in
+        self.scope = None
+        self.macs = FDBTable()
+        self.ports = None
+        self.neighbors = {}
         self._last_updated_macs = -1
 
-    def update_macs(self):
-        """Update the cached mac table"""
-        self.macs = self._snmp.get_mac_table()
-        self._last_updated_macs = time.time()
+    def update_macs(self, max_age=0):
+        """Update the cached mac table
+
+        The table is saved so other runs can reuse it.
 
-    def update_port_info(self):
-        """Update the cached port info table"""
-        self.ports = self._snmp.get_port_info_table()
+        :param max_age: seconds a table saved by a previous run can be
+                        reused instead of walking the switch
+        """
+        requested = time.time()
+        if max_age and self.load_snapshot(requested - max_age):
+            return
+        with _snapshot_lock(self.name):
+            # Another process may have walked the switch while we waited
+            if self.load_snapshot(requested - max_age):
+                return
+            max_repetitions = config.settings.get('snmp', {}).get(
+                'max_repetitions', MAX_REPETITIONS)
+            with metrics.timer('snmp_walk', switch=self.name):
+                self.macs = self._snmp.get_mac_table(self._walk_scope(), max_repetitions)
+            metrics.observe('snmp_walk_entries', len(self.macs), switch=self.name)
+            self._last_updated_macs = time.time()
+            self.save_snapshot()
+
+    def _snapshot_file(self):
+        return os.path.join(SNAPSHOT_DIR, self.name + '.fdb')
+
+    def _scope_digest(self):
+        """Hash of the scope, as a table walked with another one is not valid"""
+        scope = sorted((vlan, sorted(ports)) for vlan, ports in (self.scope or {}).items())
+        return hashlib.sha1(repr((self.address, self.scope is None, scope))
+                            .encode('utf-8')).digest()
+
+    def load_snapshot(self, newer_than):
+        """Load the saved table if it was walked after the given time
+
+        :returns: True if the table was loaded
+        """
+        try:
+            with open(self._snapshot_file(), 'rb') as snapshot:
+                data = snapshot.read()
+            walked, digest = _SNAPSHOT_HEADER.unpack_from(data)
+            if walked < newer_than or digest != self._scope_digest():
+                return False
+            self.macs = FDBTable.from_bytes(data[_SNAPSHOT_HEADER.size:])
+        except (IOError, struct.error, ValueError):
+            return False
+        logger.debug('Reusing the MAC table of {} saved {:.0f} seconds ago'.format(
+            self.name, time.time() - walked))
+        self._last_updated_macs = walked
+        return True
+
+    def save_snapshot(self):
+        """Save the table atomically for other runs"""
+        filename = self._snapshot_file()
+        tmpfile = '{}.{}.tmp'.format(filename, os.getpid())
+        try:
+            with open(tmpfile, 'wb') as snapshot:
+                snapshot.write(_SNAPSHOT_HEADER.pack(self._last_updated_macs,
+                                                     self._scope_digest()))
+                snapshot.write(self.macs.to_bytes())
+            os.rename(tmpfile, filename)
+        except (IOError, OSError) as error:
+            logger.warn('Unable to save the MAC table of {}: {}'.format(self.name, error))
+
+    def _walk_scope(self):
+        """Return the scope with the ports given by name as bridge ports
+
+        The vlans without any known port are left out, so they are not
+        walked.
+        """
+        if self.scope is None:
+            return None
+        if self.ports is None and self._has_named_ports():
+            self.update_port_info()
+        scope = {}
+        for vlan, ports in self.scope.items():
+            bridge_ports = set(self.bridge_port(port) for port in ports) - set([None])
+            if bridge_ports:
+                scope[vlan] = bridge_ports
+            else:
+                logger.warn('No known port in vlan {} of switch {}: not walked'.format(
+                    vlan, self.name))
+        return scope
+
+    def _has_named_ports(self):
+        """Check if any port of the scope is given by interface name"""
+        return any(not isinstance(port, Integral)
+                   for ports in (self.scope or {}).values() for port in ports)
+
+    def _ports_file(self):
+        return os.path.join(SNAPSHOT_DIR, self.name + '.ports.json')
+
+    def load_port_info(self, max_age=None):
+        """Load the saved port info table if it is at most max_age seconds old
+
+        :returns: True if the table was loaded
+        """
+        try:
+            with open(self._ports_file()) as saved:
+                data = json.load(saved)
+            if data['address'] != self.address or (
+                    max_age is not None and time.time() - data['time'] > max_age):
+                return False
+            self.ports = PortTable.from_dict(data)
+        except (IOError, ValueError, KeyError):
+            return False
+        return True
+
+    def update_port_info(self, max_age=None):
+        """Update the cached port info table
+
+        The table is saved, as it rarely changes, and reused by the next
+        runs during `max_age` seconds (by default snmp.ports_ttl).
+        """
+        if max_age is None:
+            max_age = config.settings.get('snmp', {}).get('ports_ttl', PORTS_TTL)
+        if self.load_port_info(max_age):
+            return
+        filename = self._ports_file()
+        max_repetitions = config.settings.get('snmp', {}).get(
+            'max_repetitions', MAX_REPETITIONS)
+        with metrics.timer('snmp_port_walk', switch=self.name):
+            self.ports = self._snmp.get_port_info_table(max_repetitions)
+        data = self.ports.to_dict()
+        data.update(address=self.address, time=time.time())
+        tmpfile = '{}.{}.tmp'.format(filename, os.getpid())
+        try:
+            if not os.path.exists(SNAPSHOT_DIR):
+                os.makedirs(SNAPSHOT_DIR)
+            with open(tmpfile, 'w') as saved:
+                json.dump(data, saved)
+            os.rename(tmpfile, filename)
+        except (IOError, OSError) as error:
+            logger.warn('Unable to save the port table of {}: {}'.format(self.name, error))
+
+    def bridge_port(self, port):
+        """Return the bridge port of a port given by number or interface name
+
+        Ports given by number are bridge port numbers already. It never
+        walks the switch: the port table is retrieved by `update_macs` and
+        saved, and otherwise the saved one is used whatever its age.
+
+        :returns: the bridge port number, None if the interface is unknown
+        """
+        if isinstance(port, Integral):
+            return port
+        if port is None:
+            return None
+        if self.ports is None and not self.load_port_info():
+            logger.error('Port table of switch {} not retrieved: unknown interface {}'.format(
+                self.name, port))
+            return None
+        bridge_port = self.ports.bridge_port(port)
+        if bridge_port is None:
+            logger.error('Unknown interface {} on switch {}'.format(port, self.name))
+        return bridge_port
+
+    def update_neighbors(self):
+        """Update the cached LLDP neighbors"""
+        if self.ports is None and self._has_named_ports():
+            self.update_port_info()
+        max_repetitions = config.settings.get('snmp', {}).get(
+            'max_repetitions', MAX_REPETITIONS)
+        with metrics.timer('snmp_lldp_walk', switch=self.name):
+            self.neighbors = self._snmp.get_lldp_neighbors(max_repetitions)
+
+    def neighbor_macs(self, port):
+        """Return the MACs of the LLDP neighbors on a given port"""
+        return [mac_to_str(mac) for mac in self.neighbors.get(self.bridge_port(port), ())]
 
     def get_macs_seen_on_port(self, port, vlan):
         """Return the macs seen on a given port an vlan"""
         elapsed_seconds = time.time() - self._last_updated_macs
         if elapsed_seconds > CACHE_TIME:
             logger.debug('Cached MAC info expired: querying the switch')
-            self.update_macs()
-        macs_seen = []
-        for entry in self.macs[port]:
-            if entry['vlan'] == vlan:
-                logger.info('Found MAC {} on port {} vlan {}'.format(
-                    entry['mac'], port, vlan))
-                macs_seen.append(entry['mac'])
+            # Only the first query of a run can reuse the tables of other runs
+            self.update_macs(snapshot_ttl() if self._last_updated_macs < 0 else 0)
+        macs_seen = self.macs.macs_seen_on_port(self.bridge_port(port), vlan)
+        for mac in macs_seen:
+            logger.info('Found MAC {} on port {} vlan {}'.format(mac, port, vlan))
         return macs_seen
 
 
-def _normalize_mac(mac):
-    """Format a MAC address to a canonical format: A1:F2:03:04:05:06"""
-    mac = str(mac)
-    return ':'.join([i.zfill(2) for i in mac.split(":")]).upper()
+@contextlib.contextmanager
+def _snapshot_lock(name):
+    """Hold the lock of the saved table of a switch
+
+    It serializes the walks of a switch across processes and threads, so
+    a run waiting for another one reuses its table instead of walking the
+    switch again.
+    """
+    import fcntl
+    if not os.path.exists(SNAPSHOT_DIR):
+        try:
+            os.makedirs(SNAPSHOT_DIR)
+        except OSError:
+            # Created by another process in the meantime
+            pass
+    with open(os.path.join(SNAPSHOT_DIR, name + '.lock'), 'a') as lockfile:
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+def snapshot_ttl():
+    """Seconds during which the tables saved by previous runs are reused"""
+    if _refresh:
+        return 0
+    return config.settings.get('snmp', {}).get('snapshot_ttl', SNAPSHOT_TTL)
+
+
+def refresh_all():
+    """Walk the switches instead of reusing the tables of previous runs"""
+    global _refresh
+    _refresh = True
+
+
+def _load_mib(name):
+    """Load the given MIB only once"""
+    from snimpy.manager import load
+    with _mib_lock:
+        if name not in _loaded_mibs:
+            load(name)
+            _loaded_mibs.add(name)
 
 
 def query(name, port, vlan=1):
     """Query the MACs seen a given port and vlan of a switch"""
-    return switches[name].get_macs_seen_on_port(port, vlan)
+    return get(name).get_macs_seen_on_port(port, vlan)
+
+
+def lookup(name, port, vlan=1):
+    """Return the MACs already known on a given port and vlan of a switch
+
+    Unlike query it never walks the switch.
+    """
+    sw = get(name)
+    return sw.macs.macs_seen_on_port(sw.bridge_port(port), vlan)
+
+
+def join(wanted):
+    """Return the MACs already known on many ports of many switches at once
+
+    Like lookup it never walks the switches.
+
+    :param wanted: dictionary from switch name to its (port, vlan) pairs
+    :returns: dictionary from (switch, port, vlan) to the MACs seen there
+    """
+    found = {}
+    for name, keys in wanted.items():
+        sw = get(name)
+        # Ports given by interface name are looked up by bridge port
+        aliases = {}
+        for port, vlan in keys:
+            aliases.setdefault((sw.bridge_port(port), vlan), []).append(port)
+        for key, macs in sw.macs.join(aliases).items():
+            for port in aliases[key]:
+                found[(name, port, key[1])] = [mac_to_str(mac) for mac in macs]
+    return found
+
+
+def neighbors(name, port):
+    """Return the MACs of the LLDP neighbors already known on a port
+
+    Like lookup it never walks the switch.
+    """
+    return get(name).neighbor_macs(port)
+
+
+def learn(name, port, vlan, mac):
+    """Add a MAC learned from a notification to the table of a switch"""
+    get(name).macs.add(port, vlan, mac)
+
+
+def expire(name):
+    """Expire the cached table of a switch so the next query walks it"""
+    # Older than CACHE_TIME but not -1, so the saved table is not reused
+    get(name)._last_updated_macs = 0
+
+
+def locate(mac):
+    """Return the (switch, port, vlan) where a MAC is seen in the known tables
+
+    Like lookup it never walks the switches.
+    """
+    return [(name, port, vlan) for name, sw in sorted(all_switches().items())
+            for port, vlan in sw.macs.find(mac)]
+
+
+def by_address(address):
+    """Return the name of the switch with the given address"""
+    for name, sw in all_switches().items():
+        if sw.address == address:
+            return name
+    return None
+
+
+def update(names, workers=None, max_age=0):
+    """Refresh the MAC tables of the given switches concurrently
+
+    All the walks are started at the same time on a pool of at most
+    `workers` threads, so the refresh takes as long as the slowest switch
+    instead of the sum of all of them.
+
+    :param max_age: seconds a table saved by a previous run can be reused
+                    instead of walking the switch
+    """
+    names = sorted(set(names))
+    if max_age:
+        since = time.time() - max_age
+        names = [name for name in names if not get(name).load_snapshot(since)]
+    if not names:
+        return
+    # Load the MIB before starting the workers
+    _load_mib('Q-BRIDGE-MIB')
+    logger.info('Refreshing MAC tables of {} switches'.format(len(names)))
+    _map(_update_switch, names, workers)
+
+
+def update_neighbors(names, workers=None):
+    """Refresh the LLDP neighbors of the given switches concurrently"""
+    from snimpy.smi import SMIException
+    names = sorted(set(names))
+    if not names:
+        return
+    try:
+        _load_mib('LLDP-MIB')
+    except SMIException as error:
+        logger.warn('LLDP-MIB not available, LLDP neighbors not retrieved: {}'.format(error))
+        return
+    logger.info('Retrieving LLDP neighbors of {} switches'.format(len(names)))
+    _map(_update_neighbors, names, workers)
+
+
+def _map(function, names, workers=None):
+    """Call the function with every switch name on a pool of threads"""
+    if workers is None:
+        workers = config.settings.get('snmp', {}).get('workers', WORKERS)
+    pool = ThreadPool(max(1, min(workers, len(names))))
+    try:
+        pool.map(function, names)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _update_switch(name):
+    """Refresh the MAC table of a switch logging any SNMP error"""
+    from snimpy.snmp import SNMPException
+    try:
+        get(name).update_macs()
+    except SNMPException as error:
+        logger.error('Unable to retrieve MAC table of {}: {}'.format(name, error))
+
+
+def _update_neighbors(name):
+    """Refresh the LLDP neighbors of a switch logging any SNMP error"""
+    from snimpy.snmp import SNMPException
+    try:
+        get(name).update_neighbors()
+    except SNMPException as error:
+        logger.error('Unable to retrieve LLDP neighbors of {}: {}'.format(name, error))
+
+
+def _scopes(nodes):
+    """Return the vlans and ports of each switch referenced by the nodes"""
+    scopes = {}
+    for nodecfg in nodes.values():
+        for swname, swopts in config_switchports(nodecfg).items():
+            vlan = swopts.get('vlan', 1)
+            scopes.setdefault(swname, {}).setdefault(vlan, set()).add(swopts['port'])
+    return scopes
+
+
+def get(name):
+    """Return the switch with the given name"""
+    return all_switches()[name]
+
+
+def all_switches():
+    """Return all the available switches indexed by name
+
+    They are built from the configuration the first time they are needed.
+    """
+    with _build_lock:
+        if not switches:
+            _build({})
+    return switches
+
+
+def reconfigure():
+    """Apply the changes of the configuration to the switches already built
+
+    The switches whose address and community did not change are kept with
+    their MAC tables, and the walk scopes are rebuilt from the nodes.
+    """
+    with _build_lock:
+        if switches:
+            _build(dict(switches))
+
 
-# Export all the available switches inside the switches dict
-for swname, swcfg in config.switches.items():
-    switches[swname] = Switch(swname, swcfg['address'], swcfg['community'])
+def _build(previous):
+    """Build the switches of the configuration reusing the previous ones"""
+    switches.clear()
+    for swname, swcfg in config.switches.items():
+        sw = previous.get(swname)
+        if sw is None or (sw.address, sw.community) != (swcfg['address'], swcfg['community']):
+            sw = Switch(swname, swcfg['address'], swcfg['community'])
+        sw.scope = None
+        switches[swname] = sw
+    # Limit the walks of each switch to the ports used by the configured nodes
+    for swname, scope in _scopes(config.nodes).items():
+        if swname in switches:
+            switches[swname].scope = scope
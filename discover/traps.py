@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Traps module
+   Implements the listener of the MAC-notification and link-up traps sent
+   by the switches, so MACs are learned as soon as the switch sees them
+"""
+from __future__ import print_function, with_statement
+import contextlib
+import logging
+import socket
+import struct
+import threading
+from . import ber
+from . import config
+from . import switch
+from .fdb import mac_to_int
+
+# SNMPv2-MIB::snmpTrapOID.0
+SNMP_TRAP_OID = (1, 3, 6, 1, 6, 3, 1, 1, 4, 1, 0)
+# SNMPv2-MIB::sysUpTime.0
+SYS_UPTIME = (1, 3, 6, 1, 2, 1, 1, 3, 0)
+# IF-MIB::linkUp
+LINK_UP = (1, 3, 6, 1, 6, 3, 1, 1, 5, 4)
+# IF-MIB::ifIndex
+IF_INDEX = (1, 3, 6, 1, 2, 1, 2, 2, 1, 1)
+# CISCO-MAC-NOTIFICATION-MIB::cmnMacChangedNotification
+MAC_CHANGED = (1, 3, 6, 1, 4, 1, 9, 9, 215, 2, 0, 1)
+# CISCO-MAC-NOTIFICATION-MIB::cmnHistMacChangedMsg
+MAC_CHANGED_MSG = (1, 3, 6, 1, 4, 1, 9, 9, 215, 1, 1, 8, 1, 2)
+# SNMPv1 generic trap number of linkUp
+GENERIC_LINK_UP = 3
+
+LEARNED = 'learned'
+REMOVED = 'removed'
+LINK_UP_EVENT = 'linkup'
+
+# Operations encoded in the cmnHistMacChangedMsg octets
+_MAC_OPERATIONS = {1: LEARNED, 2: REMOVED}
+# operation (1 byte), vlan (2 bytes), mac (6 bytes), dot1dBasePort (2 bytes)
+_MAC_CHANGE = struct.Struct('!BH6sH')
+
+logger = logging.getLogger(__name__)
+
+
+def parse_events(message):
+    """Extract the events of a decoded trap message
+
+    :returns: a list of (LEARNED|REMOVED, port, vlan, mac) and
+              (LINK_UP_EVENT, ifindex) tuples
+    """
+    events = []
+    varbinds = message['varbinds']
+    if message['pdu'] == ber.TRAP_V1:
+        trap_oid = LINK_UP if message['generic'] == GENERIC_LINK_UP else None
+    else:
+        trap_oid = dict(varbinds).get(SNMP_TRAP_OID, (None, None))[1]
+    for oid, (_, value) in varbinds:
+        if oid[:len(MAC_CHANGED_MSG)] == MAC_CHANGED_MSG and value:
+            events.extend(_parse_mac_changes(value))
+        elif trap_oid == LINK_UP and oid[:len(IF_INDEX)] == IF_INDEX:
+            events.append((LINK_UP_EVENT, value))
+    return events
+
+
+def _parse_mac_changes(octets):
+    """Parse the MAC changes of a cmnHistMacChangedMsg value"""
+    events = []
+    for offset in range(0, len(octets) - _MAC_CHANGE.size + 1, _MAC_CHANGE.size):
+        operation, vlan, mac, port = _MAC_CHANGE.unpack_from(octets, offset)
+        # A zero operation marks the end of the message
+        if operation not in _MAC_OPERATIONS:
+            break
+        mac = mac_to_int(':'.join('{:02x}'.format(byte) for byte in bytearray(mac)))
+        events.append((_MAC_OPERATIONS[operation], port, vlan, mac))
+    return events
+
+
+def encode_mac_notification(community, changes, uptime=0, request_id=0):
+    """Encode a SNMPv2c cmnMacChangedNotification trap
+
+    It is what a switch sends, so it can be used to stand in for real
+    switches when testing the listener.
+
+    :param changes: list of (LEARNED|REMOVED, port, vlan, mac) tuples
+    """
+    operations = dict((name, code) for code, name in _MAC_OPERATIONS.items())
+    octets = b''.join(
+        _MAC_CHANGE.pack(operations[operation], vlan,
+                         struct.pack('!Q', mac_to_int(mac))[2:], port)
+        for operation, port, vlan, mac in changes) + b'\x00'
+    return ber.encode_message(community, ber.TRAP_V2, request_id, [
+        (SYS_UPTIME, (ber.TIMETICKS, uptime)),
+        (SNMP_TRAP_OID, (ber.OID, MAC_CHANGED)),
+        (MAC_CHANGED_MSG + (1,), (ber.OCTET_STRING, octets)),
+    ])
+
+
+def encode_link_up(community, ifindex, uptime=0, request_id=0):
+    """Encode a SNMPv2c linkUp trap"""
+    return ber.encode_message(community, ber.TRAP_V2, request_id, [
+        (SYS_UPTIME, (ber.TIMETICKS, uptime)),
+        (SNMP_TRAP_OID, (ber.OID, LINK_UP)),
+        (IF_INDEX + (ifindex,), (ber.INTEGER, ifindex)),
+    ])
+
+
+class TrapListener(threading.Thread):
+    """Receives traps on a local UDP socket in a background thread
+
+    The handler is called with the source address, the community and the
+    list of events of every trap received. Informs are acknowledged with a
+    response, so the switches do not retransmit them.
+    """
+    def __init__(self, handler, address='0.0.0.0', port=162):
+        super(TrapListener, self).__init__(name='trap-listener')
+        self.daemon = True
+        self.handler = handler
+        self._stopped = threading.Event()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((address, port))
+        self._sock.settimeout(0.5)
+        self.address = self._sock.getsockname()
+
+    def run(self):
+        logger.info('Listening for traps on {}:{}'.format(*self.address))
+        while not self._stopped.is_set():
+            try:
+                data, sender = self._sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            source = sender[0]
+            try:
+                message = ber.decode_message(data)
+            except (ber.BERError, ValueError, IndexError) as error:
+                logger.debug('Ignoring malformed trap from {}: {}'.format(source, error))
+                continue
+            if message['pdu'] not in (ber.TRAP_V1, ber.TRAP_V2, ber.INFORM):
+                continue
+            if message['pdu'] == ber.INFORM:
+                self._acknowledge(message, sender)
+            community = message['community'].decode('ascii', 'replace')
+            try:
+                self.handler(source, community, parse_events(message))
+            except Exception:
+                logger.exception('Unable to process trap from {}'.format(source))
+        self._sock.close()
+
+    def _acknowledge(self, message, sender):
+        """Answer an inform with a response with its request-id and varbinds"""
+        response = ber.encode_message(message['community'], ber.RESPONSE,
+                                      message['request_id'], message['varbinds'],
+                                      version=message['version'])
+        try:
+            self._sock.sendto(response, sender)
+        except socket.error as error:
+            logger.debug('Unable to acknowledge inform from {}: {}'.format(sender[0], error))
+
+    def stop(self):
+        """Stop listening"""
+        self._stopped.set()
+        self.join()
+
+
+def apply_events(source, community, events, wakeup=None):
+    """Feed the events of a switch into its MAC table
+
+    Learned MACs are added to the table of the switch and a link up
+    expires it so the next poll walks it again.
+    """
+    name = switch.by_address(source)
+    if name is None:
+        logger.debug('Ignoring trap from unknown switch {}'.format(source))
+        return
+    if community != switch.get(name).community:
+        logger.warn('Ignoring trap from {} with wrong community'.format(name))
+        return
+    for event in events:
+        if event[0] == LEARNED:
+            _, port, vlan, mac = event
+            logger.debug('Trap: MAC {} learned on {} port {} vlan {}'.format(
+                mac, name, port, vlan))
+            switch.learn(name, port, vlan, mac)
+        elif event[0] == LINK_UP_EVENT:
+            logger.debug('Trap: link up on {} ifIndex {}'.format(name, event[1]))
+            switch.expire(name)
+    if events and wakeup is not None:
+        wakeup.set()
+
+
+@contextlib.contextmanager
+def listen(wakeup=None, settings=None):
+    """Listen for traps while in the context if enabled in the settings
+
+    :param wakeup: event set whenever a trap brings new information
+    """
+    if settings is None:
+        settings = config.settings.get('traps', {})
+    if not settings.get('enabled', False):
+        yield None
+        return
+    listener = TrapListener(
+        lambda source, community, events: apply_events(source, community, events, wakeup),
+        settings.get('address', '0.0.0.0'), settings.get('port', 162))
+    listener.start()
+    try:
+        yield listener
+    finally:
+        listener.stop()
@@ -11,6 +11,9 @@ setup(
         'Jinja2',
         'snimpy',
     ],
+    extras_require={
+        'pyghmi': ['pyghmi'],
+    },
     entry_points='''
         [console_scripts]
         discover=discover.cli:cli
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import sys
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'benchmarks')
+
+
+def test_discovery_against_the_simulator():
+    # The discovery walks the simulated switches through snimpy
+    pytest.importorskip('snimpy')
+    sys.path.insert(0, BENCHMARKS)
+    try:
+        import discovery as benchmark
+    finally:
+        sys.path.remove(BENCHMARKS)
+    options = argparse.Namespace(arrival=[0.1, 0.5], known=0.1, noise=20, ipmi_latency=0.0,
+                                 ipmi_failure_rate=0.0, timeout=60)
+    result = benchmark.run(100, options)
+    assert result['error'] is None
+    assert result['discovered'] == 100
+    assert result['ipmi_failures'] == 0
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import pytest
+from discover import cobbler
+from discover.node import Node
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'benchmarks'))
+
+from fake_cobbler import FakeCobbler  # noqa: E402
+
+
+@pytest.fixture(params=[True, False], ids=['multicall', 'no-multicall'])
+def server(request):
+    server = FakeCobbler(latency=0, multicall=request.param).start()
+    yield server
+    server.stop()
+
+
+def make_node(i, mac=True):
+    switchports = {'SW10-1': {'nic': 'x1', 'port': i, 'vlan': 119}}
+    if mac:
+        switchports['SW10-1']['mac'] = '00:00:00:00:00:{:02X}'.format(i)
+    return Node('node-10-{}'.format(i), switchports, '10.131.10.{}'.format(i),
+                'USERID', 'PASSW0RD')
+
+
+def test_bulk_export_logs_in_and_syncs_once(server):
+    exporter = cobbler.Exporter(server.url, 'admin', 'secret', workers=4)
+    errors = exporter.export([make_node(i) for i in range(1, 6)] + [make_node(6, mac=False)])
+    assert list(errors) == ['node-10-6']
+    assert server.calls.count('login') == 1
+    assert server.calls.count('sync') == 1
+    assert sorted(server.systems) == ['node-10-{}'.format(i) for i in range(1, 6)]
+    system = server.systems['node-10-1']
+    assert system['power_pass'] == 'PASSW0RD'
+    assert system['interfaces']['ens3f0']['mac_address'] == '00:00:00:00:00:01'
+    assert system['interfaces']['ens3f0']['ip_address'] == '10.119.10.1'
+
+
+def test_reexport_without_changes_skips_sync(server):
+    nodes = [make_node(i) for i in range(1, 4)]
+    cobbler.Exporter(server.url, 'admin', 'secret').export(nodes)
+    server.calls[:] = []
+    errors = cobbler.Exporter(server.url, 'admin', 'secret').export(nodes)
+    assert errors == {}
+    assert server.calls == ['login', 'get_systems']
+
+
+def test_reexport_pushes_only_the_diff(server):
+    server.systems['manual'] = {'name': 'manual', 'interfaces': {}}
+    cobbler.Exporter(server.url, 'admin', 'secret').export(
+        [make_node(i) for i in range(1, 5)])
+    server.calls[:] = []
+    nodes = [make_node(i) for i in range(1, 4)]
+    nodes[0].bmc.password = 'changed'
+    server.systems['node-10-2']['interfaces']['ens3f0']['mac_address'] = '00:00:00:00:00:FF'
+    errors = cobbler.Exporter(server.url, 'admin', 'secret').export(nodes, prune=True)
+    assert errors == {}
+    assert server.calls.count('get_system_handle') == 2
+    assert server.calls.count('new_system') == 0
+    assert server.calls.count('remove_system') == 1
+    assert server.calls.count('sync') == 1
+    # Systems not created by discover are left alone
+    assert sorted(server.systems) == ['manual', 'node-10-1', 'node-10-2', 'node-10-3']
+    assert server.systems['node-10-1']['power_pass'] == 'changed'
+    assert server.systems['node-10-2']['interfaces']['ens3f0']['mac_address'] == '00:00:00:00:00:02'
+
+
+def test_reexport_compares_case(server):
+    nodes = [make_node(10)]
+    cobbler.Exporter(server.url, 'admin', 'secret').export(nodes)
+    # MACs are compared ignoring the case
+    server.systems['node-10-10']['interfaces']['ens3f0']['mac_address'] = '00:00:00:00:00:0a'
+    server.calls[:] = []
+    assert cobbler.Exporter(server.url, 'admin', 'secret').export(nodes) == {}
+    assert server.calls == ['login', 'get_systems']
+    # Other fields are not
+    nodes[0].bmc.password = 'passw0rd'
+    assert cobbler.Exporter(server.url, 'admin', 'secret').export(nodes) == {}
+    assert server.calls.count('get_system_handle') == 1
+    assert server.systems['node-10-10']['power_pass'] == 'passw0rd'
+
+
+def test_multicall_probed_once():
+    server = FakeCobbler(latency=0, multicall=False).start()
+    try:
+        exporter = cobbler.Exporter(server.url, 'admin', 'secret', workers=4, multicall=True)
+        assert exporter.export([make_node(i) for i in range(1, 6)]) == {}
+        assert not exporter.multicall
+        # The server rejects the probe without naming the method
+        assert server.calls.count('system.multicall') == 1
+        assert len(server.systems) == 5
+    finally:
+        server.stop()
@@ -6,3 +6,43 @@ from discover import config
 def test_config():
     cfg = config.Config('../config/')
     print(cfg)
+
+
+def test_config_cache_is_invalidated_on_changes(tmpdir, monkeypatch):
+    confdir = tmpdir.mkdir('conf')
+    monkeypatch.setattr(config, 'DEFAULT_CONF_DIRS', [str(confdir)])
+    monkeypatch.setattr(config, 'CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setattr(config, '_env', None)
+    rendered = []
+    render_file = config._render_file
+    monkeypatch.setattr(config, '_render_file',
+                        lambda *args: rendered.append(args[0]) or render_file(*args))
+    confdir.join('test.yml').write('{% for i in (1, 2) %}\nnode-{{ i }}: {{ i }}\n{% endfor %}\n')
+    assert dict(config.LazyFile('test.yml')) == {'node-1': 1, 'node-2': 2}
+    # A cache hit does not render the template again
+    assert dict(config.LazyFile('test.yml')) == {'node-1': 1, 'node-2': 2}
+    assert rendered == ['test.yml']
+    # Changing any file in the config dirs invalidates the cache
+    confdir.join('other.yml').write('a: 1\n')
+    assert dict(config.LazyFile('test.yml')) == {'node-1': 1, 'node-2': 2}
+    assert rendered == ['test.yml', 'test.yml']
+    assert len(tmpdir.join('cache').listdir()) == 1
+
+
+def test_config_templates_use_the_previous_files(tmpdir, monkeypatch):
+    confdir = tmpdir.mkdir('conf')
+    monkeypatch.setattr(config, 'DEFAULT_CONF_DIRS', [str(confdir)])
+    monkeypatch.setattr(config, 'CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setattr(config, '_env', None)
+    monkeypatch.setattr(config, 'switches', config.LazyFile(config.SWFILE))
+    monkeypatch.setattr(config, 'nodes', config.LazyFile(config.NODESFILE))
+    confdir.join(config.SWFILE).write('SW10-1: {address: 10.1.10.1}\n')
+    confdir.join(config.NODESFILE).write(
+        '{% for sw in switches %}\nnode-1: {switch: {{ sw }}}\n{% endfor %}\n')
+    confdir.join('test.yml').write('count: {{ nodes | length }}\n')
+    # Whatever file is loaded first
+    assert dict(config.LazyFile('test.yml')) == {'count': 1}
+    assert dict(config.nodes) == {'node-1': {'switch': 'SW10-1'}}
+    # And the cached contents are the same
+    monkeypatch.setattr(config, 'nodes', config.LazyFile(config.NODESFILE))
+    assert dict(config.LazyFile('test.yml')) == {'count': 1}
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import pytest
+from discover import config
+from discover import daemon
+from discover import switch
+from discover.fdb import FDBTable
+
+
+@pytest.fixture
+def server(tmpdir, monkeypatch):
+    sw = switch.Switch('SW10-1', '10.1.10.1', 'public')
+    sw.macs = FDBTable.from_entries([(1, 119, '00:00:00:00:00:01')])
+    monkeypatch.setattr(switch, 'switches', {'SW10-1': sw})
+    refreshed = []
+    monkeypatch.setattr(switch, 'update', lambda names: refreshed.append(sorted(names)))
+    server = daemon.Daemon(str(tmpdir.join('discover.sock')), refresh_interval=3600).start()
+    assert server.wait_refreshed(5)
+    assert refreshed == [['SW10-1']]
+    yield server
+    server.stop()
+
+
+def test_lookup(server):
+    assert daemon.request('ping', path=server.path)['ok']
+    reply = daemon.request('lookup', path=server.path, mac='00-00-00-00-00-01')
+    assert reply == {'ok': True, 'locations': [['SW10-1', 1, 119]]}
+    assert daemon.request('lookup', path=server.path, mac='00:00:00:00:00:02')['locations'] == []
+
+
+def test_errors(server):
+    assert daemon.request('reboot', path=server.path) == {'ok': False, 'error': 'Invalid request'}
+    reply = daemon.request('lookup', path=server.path, mac='not a mac')
+    assert not reply['ok']
+    assert reply['error'].startswith('KeyError')
+
+
+def test_stale_socket(tmpdir):
+    path = str(tmpdir.join('discover.sock'))
+    with pytest.raises(daemon.DaemonNotRunning):
+        daemon.request('ping', path=path)
+    tmpdir.join('discover.sock').write('')
+    daemon._remove_stale_socket(path)
+    assert not tmpdir.join('discover.sock').exists()
+
+
+def test_learns_run_one_at_a_time(server, monkeypatch):
+    from discover import discovery
+    from discover import metrics
+    running = []
+    overlapped = []
+
+    def learn(nodename, *args):
+        running.append(nodename)
+        overlapped.append(len(running) > 1)
+        time.sleep(0.2)
+        metrics.inc('learned_total')
+        running.remove(nodename)
+        return None
+    monkeypatch.setattr(discovery, 'learn', learn)
+    written = []
+    monkeypatch.setattr(metrics, 'write',
+                        lambda path=None: written.append(metrics.registry.to_dict()))
+    threads = [threading.Thread(target=daemon.request, args=('learn',),
+                                kwargs={'path': server.path, 'nodename': name})
+               for name in ('node-10-1', 'node-10-2')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlapped == [False, False]
+    # Every learn writes its own metrics
+    assert [data['counters'][0]['value'] for data in written] == [1, 1]
+
+
+def test_reload_config(tmpdir, monkeypatch):
+    confdir = tmpdir.mkdir('conf')
+    monkeypatch.setattr(config, 'DEFAULT_CONF_DIRS', [str(confdir)])
+    monkeypatch.setattr(config, 'CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setattr(config, '_env', None)
+    for name in ('switches', 'nodes', 'logconf', 'settings'):
+        monkeypatch.setattr(config, name, config.LazyFile(getattr(config, name).filename))
+    monkeypatch.setattr(switch, 'switches', {})
+    confdir.join(config.SWFILE).write('SW10-1: {address: 10.1.10.1, community: public}\n')
+    for filename in (config.LOGCONFFILE, config.SETTINGSFILE):
+        confdir.join(filename).write('{}\n')
+    nodes = confdir.join(config.NODESFILE)
+    nodes.write('node-10-1: {nics: {nic1: {switch: SW10-1, port: 1, vlan: 119}}}\n')
+    sw = switch.get('SW10-1')
+    assert sw.scope == {119: set([1])}
+
+    # A node racked while the daemon runs
+    nodes.write('node-10-1: {nics: {nic1: {switch: SW10-1, port: 1, vlan: 119}}}\n'
+                'node-99-1: {nics: {nic1: {switch: SW10-1, port: 2, vlan: 119}}}\n')
+    server = daemon.Daemon(str(tmpdir.join('discover.sock')))
+    server.reload_config()
+    assert 'node-99-1' in config.nodes
+    # The switch keeps its MAC table and walks the port of the new node
+    assert switch.get('SW10-1') is sw
+    assert sw.scope == {119: set([1, 2])}
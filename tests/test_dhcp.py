@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+from discover import dhcp
+from discover.fdb import mac_to_int
+
+
+def test_parse_request():
+    mac = mac_to_int('0:1a:2b:3c:4d:5e')
+    assert dhcp.parse_request(dhcp.encode_request(mac)) == mac
+    assert dhcp.parse_request(dhcp.encode_request(mac, dhcp.DHCPREQUEST)) == mac
+    # DHCPRELEASE
+    assert dhcp.parse_request(dhcp.encode_request(mac, 7)) is None
+    # Not sent by the PXE firmware
+    assert dhcp.parse_request(dhcp.encode_request(mac, vendor_class=b'MSFT 5.0')) is None
+    assert dhcp.parse_request(dhcp.encode_request(mac, vendor_class=None)) is None
+    assert dhcp.parse_request(b'garbage') is None
+
+
+def test_parse_log_line():
+    assert dhcp.parse_log_line(
+        'Oct 18 10:00:00 pxe dhcpd: DHCPDISCOVER from 00:1a:2b:3c:4d:5e via eth0') == \
+        mac_to_int('0:1a:2b:3c:4d:5e')
+    assert dhcp.parse_log_line(
+        'Oct 18 10:00:00 pxe dnsmasq-dhcp[42]: DHCPREQUEST(eth0) 10.119.10.1 00:1a:2b:3c:4d:5f') == \
+        mac_to_int('0:1a:2b:3c:4d:5f')
+    assert dhcp.parse_log_line(
+        'Oct 18 10:00:00 pxe dhcpd: DHCPACK on 10.119.10.1 to 00:1a:2b:3c:4d:5e via eth0') is None
+
+
+def collect():
+    received = []
+    done = threading.Event()
+
+    def handler(mac):
+        received.append(mac)
+        done.set()
+    return received, done, handler
+
+
+def test_listener_receives_local_requests():
+    received, done, handler = collect()
+    listener = dhcp.DHCPListener(handler, '127.0.0.1', 0)
+    listener.start()
+    try:
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.sendto(b'garbage', listener.address)
+        sender.sendto(dhcp.encode_request('0:0:0:0:0:5'), listener.address)
+        sender.close()
+        assert done.wait(5)
+    finally:
+        listener.stop()
+    assert received == [5]
+
+
+def test_log_follower_reads_new_lines(tmpdir):
+    log = tmpdir.join('messages')
+    log.write('dhcpd: DHCPDISCOVER from 00:00:00:00:00:01 via eth0\n')
+    received, done, handler = collect()
+    follower = dhcp.LogFollower(handler, str(log), interval=0.05)
+    follower.start()
+    try:
+        # Rotated logs are read from the beginning
+        log.remove()
+        log.write('dhcpd: DHCPDISCOVER from 00:00:00:00:00:02 via eth0\n')
+        assert done.wait(5)
+    finally:
+        follower.stop()
+    assert received == [2]
+
+
+def test_apply_request(monkeypatch):
+    monkeypatch.setattr(dhcp.inventory, 'find_by_mac', lambda mac: mac == '00:00:00:00:00:01')
+    monkeypatch.setattr(dhcp.switch, 'locate', lambda mac: [('SW10-1', 1, 119)] if mac == 2 else [])
+    monkeypatch.setattr(dhcp, '_unlocated', set())
+    monkeypatch.setattr(dhcp, '_last_walk', 0)
+    wakeup = threading.Event()
+    # Already in the inventory
+    dhcp.apply_request(1, wakeup)
+    assert not wakeup.is_set()
+    dhcp.apply_request(2, wakeup)
+    dhcp.apply_request(3, wakeup)
+    assert wakeup.is_set()
+    assert dhcp.take_unlocated() == set([3])
+    assert dhcp.take_unlocated() == set()
+
+
+def test_take_unlocated_throttled(monkeypatch):
+    located = set()
+    monkeypatch.setattr(dhcp.switch, 'locate', lambda mac: [('SW10-1', 1, 119)] if mac in located else [])
+    monkeypatch.setattr(dhcp, '_unlocated', set([3]))
+    monkeypatch.setattr(dhcp, '_last_walk', 0)
+    assert dhcp.take_unlocated(60) == set([3])
+    # Kept until the interval passes
+    dhcp._unlocated.update([4, 5])
+    assert dhcp.take_unlocated(60) == set()
+    # Located in the meantime by another walk
+    located.add(4)
+    dhcp._last_walk -= 60
+    assert dhcp.take_unlocated(60) == set([5])
+    assert dhcp._unlocated == set()
+
+
+def test_request_inside_the_walk_interval(monkeypatch):
+    monkeypatch.setattr(dhcp.inventory, 'find_by_mac', lambda mac: [])
+    monkeypatch.setattr(dhcp.switch, 'locate', lambda mac: [])
+    monkeypatch.setattr(dhcp.config, 'settings', {'dhcp': {'min_walk_interval': 0.3}})
+    monkeypatch.setattr(dhcp, '_unlocated', set())
+    monkeypatch.setattr(dhcp, '_last_walk', time.time())
+    wakeup = threading.Event()
+    # Another node booted just after the last walk
+    dhcp.apply_request(3, wakeup)
+    assert dhcp.take_unlocated() == set()
+    wakeup.clear()
+    # Woken up again as soon as the next walk is allowed
+    assert wakeup.wait(5)
+    assert dhcp.take_unlocated() == set([3])
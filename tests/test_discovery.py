@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import time
+from discover import dhcp
+from discover import discovery
+from discover import power
+from discover import switch
+from discover.fdb import FDBTable
+from discover.node import Node
+
+
+def make_node(name, port):
+    return Node(name, {
+        'SW10-1': {'nic': 'eth0', 'port': port, 'vlan': 119},
+        'SW10-2': {'nic': 'eth1', 'port': port, 'vlan': 119},
+    }, '10.131.10.{}'.format(port), 'USERID', 'PASSW0RD')
+
+
+def test_lldp_resolves_without_power_actions(monkeypatch):
+    neighbors = {
+        ('SW10-1', 1): ['00:00:00:00:00:01'],
+        ('SW10-2', 1): ['00:00:00:00:00:02'],
+        ('SW10-1', 2): ['00:00:00:00:00:03', '00:00:00:00:00:04'],
+    }
+    walked = []
+    monkeypatch.setattr(switch, 'update_neighbors', lambda names: walked.append(sorted(names)))
+    monkeypatch.setattr(switch, 'neighbors', lambda name, port: neighbors.get((name, port), []))
+    running, hub = make_node('node-1', 1), make_node('node-2', 2)
+    discovery._collect_lldp([running, hub])
+    # A single walk of every switch involved
+    assert walked == [['SW10-1', 'SW10-2']]
+    assert running.has_all_macs()
+    assert running.get_mac('eth1') == '00:00:00:00:00:02'
+    # Ports with several neighbors are left to the other sources
+    assert len(hub.missing_ports()) == 2
+
+
+def test_waves_resolved_before_booting(monkeypatch):
+    tables = {
+        # Seen while the wave waited, like a node booted by hand
+        'SW10-1': [(2, 119, '00:00:00:00:00:03')],
+        'SW10-2': [(2, 119, '00:00:00:00:00:04')],
+    }
+    switches = {}
+    for name, entries in tables.items():
+        switches[name] = switch.Switch(name, '10.1.10.1', 'public')
+        switches[name].macs = FDBTable.from_entries(entries)
+    monkeypatch.setattr(switch, 'switches', switches)
+    booted = []
+    monkeypatch.setattr(power, 'boot_for_discovery',
+                        lambda nodes, poweroff: booted.extend(node.name for node in nodes))
+    waiting, found = make_node('node-1', 1), make_node('node-2', 2)
+    assert discovery._boot_wave([waiting, found]) == [waiting]
+    assert booted == ['node-1']
+    assert found.get_mac('eth1') == '00:00:00:00:00:04'
+
+
+def test_dhcp_walks_only_the_switches_of_missing_nodes(monkeypatch):
+    switches = dict((name, switch.Switch(name, '10.1.10.1', 'public'))
+                    for name in ('SW10-1', 'SW10-2', 'SW11-1'))
+    monkeypatch.setattr(switch, 'switches', switches)
+    walked = []
+    monkeypatch.setattr(switch, 'update', lambda wanted, max_age: walked.append(sorted(wanted)))
+    monkeypatch.setattr(dhcp, '_unlocated', set([5]))
+    # A walk for a node booted 10 seconds ago
+    monkeypatch.setattr(dhcp, '_last_walk', time.time() - 10)
+    missing = make_node('node-1', 1)
+    found = Node('node-11-1', {'SW11-1': {'nic': 'eth0', 'port': 1, 'vlan': 119,
+                                          'mac': '00:00:00:00:00:01'}}, None, None, None)
+    discovery._resolve([missing, found])
+    assert walked == [['SW10-1', 'SW10-2']]
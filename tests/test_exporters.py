@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+from discover import config
+from discover import exporters
+from discover import inventory
+from discover.node import Node
+
+
+@pytest.fixture
+def db(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'nodes', {
+        'node-2': {'cobbler': {'nic': 'eth0', 'address': '10.119.10.2'}}})
+    inventory.connect(str(tmpdir.join('inventory.sqlite')))
+    inventory.save_all([
+        Node('node-10', {'SW10-1': {'nic': 'eth0', 'port': 10, 'vlan': 119}},
+             '10.131.10.10', 'USERID', 'PASSW0RD'),
+        Node('node-2', {'SW10-1': {'nic': 'eth0', 'port': 2, 'vlan': 119,
+                                   'mac': '00:00:00:00:00:02'},
+                        'SW10-2': {'nic': 'eth1', 'port': 2, 'vlan': 119}},
+             '10.131.10.2', 'USERID', 'PASSW0RD'),
+    ])
+    yield
+    inventory._connection.close()
+    inventory._connection = None
+
+
+@pytest.fixture
+def export(db, tmpdir):
+    def export(fmt, nodename='all'):
+        output = tmpdir.join('output')
+        with output.open('w') as out:
+            exporters.export(fmt, nodename, out)
+        return output.read().splitlines()
+    return export
+
+
+def test_iter_nodes_in_natural_order(db):
+    inventory.save_all([Node('node-{}'.format(i), {}, None, None, None) for i in range(20)])
+    names = [node.name for node in inventory.iter_nodes(batch=3)]
+    assert names == ['node-{}'.format(i) for i in range(20)]
+
+
+def test_iter_nodes_many_batches(db):
+    names = ['c{}-{}'.format(rack, i) for rack in range(1, 12) for i in range(1, 100)] + ['c', 'c1']
+    inventory.save_all(Node(name, {}, None, None, None) for name in reversed(names))
+    expected = sorted(names + ['node-2', 'node-10'], key=inventory.natural_key)
+    assert [node.name for node in inventory.iter_nodes(batch=50)] == expected
+
+
+def test_csv(export):
+    assert export('csv') == [
+        '#node,eth0,eth1',
+        'node-2,00:00:00:00:00:02,UNKNOWN',
+        'node-10,UNKNOWN,N/A',
+    ]
+    assert export('csv', 'node-10') == ['#node,eth0', 'node-10,UNKNOWN']
+
+
+def test_jsonl(export):
+    nodes = [json.loads(line) for line in export('jsonl')]
+    assert [node['name'] for node in nodes] == ['node-2', 'node-10']
+    assert nodes[0]['nics']['eth0'] == {
+        'switch': 'SW10-1', 'port': 2, 'vlan': 119, 'mac': '00:00:00:00:00:02'}
+    assert 'password' not in nodes[0]['bmc']
+
+
+def test_dhcp_formats(export):
+    assert export('dhcpd') == [
+        'host node-2-eth0 {',
+        '  hardware ethernet 00:00:00:00:00:02;',
+        '  fixed-address 10.119.10.2;',
+        '  option host-name "node-2";',
+        '}',
+    ]
+    assert export('dnsmasq') == ['dhcp-host=00:00:00:00:00:02,node-2,10.119.10.2']
+    assert export('ethers') == ['00:00:00:00:00:02 node-2']
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import pytest
+from discover.fdb import FDBTable, mac_to_int, mac_to_str, normalize_mac
+
+
+def test_mac_conversion():
+    assert mac_to_int('0:1a:2B:3:4:ff') == 0x001a2b0304ff
+    assert mac_to_str(0x001a2b0304ff) == '00:1A:2B:03:04:FF'
+    assert normalize_mac('a:b:c:d:e:f') == '0A:0B:0C:0D:0E:0F'
+
+
+def test_lookup_by_port_and_vlan():
+    table = FDBTable.from_entries([
+        (3, 119, '0:0:0:0:0:3'),
+        (1, 119, '0:0:0:0:0:1'),
+        (1, 1, '0:0:0:0:1:1'),
+        (1, 119, '0:0:0:0:0:2'),
+    ])
+    assert len(table) == 4
+    assert table.macs_seen_on_port(1, 119) == ['00:00:00:00:00:01', '00:00:00:00:00:02']
+    assert table.macs_seen_on_port(1, 1) == ['00:00:00:00:01:01']
+    assert table.macs_seen_on_port(3, 119) == ['00:00:00:00:00:03']
+    assert table.macs_seen_on_port(2, 119) == []
+
+
+def test_add_entries_after_refresh():
+    table = FDBTable.from_entries([(1, 119, '0:0:0:0:0:1')])
+    table.add(1, 119, '0:0:0:0:0:1')
+    table.add(2, 119, '0:0:0:0:0:2')
+    assert table.macs_seen_on_port(1, 119) == ['00:00:00:00:00:01']
+    assert table.macs_seen_on_port(2, 119) == ['00:00:00:00:00:02']
+
+
+def test_find():
+    table = FDBTable.from_entries([(1, 119, '00:00:00:00:00:01'), (2, 119, '00:00:00:00:00:02'),
+                                   (48, 1, '00:00:00:00:00:01')])
+    table.add(3, 119, '00:00:00:00:00:03')
+    assert table.find('00:00:00:00:00:01') == [(1, 119), (48, 1)]
+    assert table.find('00-00-00-00-00-03') == [(3, 119)]
+    assert table.find('00:00:00:00:00:04') == []
+
+
+def test_serialization():
+    table = FDBTable.from_entries([(1, 119, '00:00:00:00:00:01'), (2, 119, 'ff:ff:ff:ff:ff:ff')])
+    table.add(3, 119, '00:00:00:00:00:03')
+    copy = FDBTable.from_bytes(table.to_bytes())
+    assert len(copy) == 2
+    assert copy.macs_seen_on_port(2, 119) == ['FF:FF:FF:FF:FF:FF']
+    with pytest.raises(ValueError):
+        FDBTable.from_bytes(table.to_bytes()[:-1])
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import pytest
+from discover import inventory
+from discover.node import Node
+
+
+@pytest.fixture
+def db(tmpdir):
+    yield inventory.connect(str(tmpdir.join('inventory.sqlite')))
+    inventory._connection.close()
+    inventory._connection = None
+
+
+def make_node(name, mac=None):
+    switchports = {
+        'SW10-1': {'nic': 'eth0', 'port': 1, 'vlan': 119},
+        'SW10-2': {'nic': 'eth1', 'port': 1, 'vlan': 119},
+    }
+    if mac:
+        switchports['SW10-1']['mac'] = mac
+    return Node(name, switchports, '10.131.10.1', 'USERID', 'PASSW0RD')
+
+
+def test_save_and_load(db):
+    inventory.save_all([make_node('node-1', '00:00:00:00:00:01'), make_node('node-2')])
+    node = inventory.load('node-1')
+    assert node.switchports['SW10-1']['mac'] == '00:00:00:00:00:01'
+    assert 'mac' not in node.switchports['SW10-2']
+    assert node.bmc.address == '10.131.10.1'
+    assert [n.name for n in inventory.find_by_mac('00:00:00:00:00:01')] == ['node-1']
+    assert sorted(n.name for n in inventory.load_all()) == ['node-1', 'node-2']
+    with pytest.raises(inventory.NodeNotFoundError):
+        inventory.load('node-3')
+
+
+def test_migrate_pickles(tmpdir):
+    with open(str(tmpdir.join('node-1.p')), 'wb') as dumpfile:
+        pickle.dump(make_node('node-1', '00:00:00:00:00:01'), dumpfile)
+    inventory.connect(str(tmpdir.join('inventory.sqlite')))
+    try:
+        assert inventory.load('node-1').get_mac('eth0') == '00:00:00:00:00:01'
+        assert os.path.exists(str(tmpdir.join('node-1.p.migrated')))
+    finally:
+        inventory._connection.close()
+        inventory._connection = None
+
+
+def test_session_writes_only_changed_nodes(db, monkeypatch):
+    inventory.save_all([make_node('node-1'), make_node('node-2')])
+    written = []
+    save_all = inventory.save_all
+    monkeypatch.setattr(inventory, 'save_all',
+                        lambda nodes: written.extend(n.name for n in nodes) or save_all(nodes))
+    with pytest.raises(KeyboardInterrupt):
+        with inventory.Session() as session:
+            for name in ('node-1', 'node-2'):
+                session.save(session.load(name))
+            session.save(make_node('node-3'))
+            node = inventory.load('node-2')
+            node.add_mac('SW10-1', '00:00:00:00:00:03')
+            session.save(node)
+            raise KeyboardInterrupt
+    assert written == ['node-2', 'node-3']
+    assert inventory.load('node-2').get_mac('eth0') == '00:00:00:00:00:03'
+
+
+def test_load_many(db):
+    inventory.save_all([make_node('node-{}'.format(i)) for i in (1, 2, 10)])
+    nodes = inventory.load_many(['node-10', 'node-2', 'node-3'], batch=2)
+    assert [node.name for node in nodes] == ['node-2', 'node-10']
+    assert sorted(inventory.names()) == ['node-1', 'node-10', 'node-2']
+
+
+def test_config_hash_and_upgrade(tmpdir):
+    import sqlite3
+    filename = str(tmpdir.join('inventory.sqlite'))
+    old = sqlite3.connect(filename)
+    old.execute('CREATE TABLE nodes (name TEXT PRIMARY KEY, bmc_address TEXT, bmc_user TEXT, '
+                'bmc_password TEXT, bmc_timeout REAL)')
+    old.execute("INSERT INTO nodes VALUES ('node-1', '10.131.10.1', 'USERID', 'PASSW0RD', 30)")
+    old.commit()
+    old.close()
+    inventory.connect(filename)
+    try:
+        assert inventory.load('node-1').config_hash is None
+        node = make_node('node-2')
+        node.config_hash = 'abc'
+        inventory.save(node)
+        assert inventory.load('node-2').config_hash == 'abc'
+    finally:
+        inventory._connection.close()
+        inventory._connection = None
@@ -1,15 +1,29 @@
 # -*- coding: utf-8 -*-
 import re
 from discover import cli
+from discover import inventory
 
 
 def test_help(runner):
-    result = runner.invoke(cli, ['--help'])
+    result = runner.invoke(cli.cli, ['--help'])
     assert not result.exception
     assert re.search(r'Discover MAC addresses using SNMP and IPMI', result.output) is not None
 
 
 def test_learn(runner):
-    result = runner.invoke(cli, ['learn'])
-    assert not result.exception
-    assert result.output == 'Output of learn command'
+    # The node to discover, or all, is required
+    result = runner.invoke(cli.cli, ['learn'])
+    assert result.exit_code == 2
+    assert 'Missing argument' in result.output
+
+
+def test_unmatched_selector(runner, tmpdir):
+    inventory.connect(str(tmpdir.join('inventory.sqlite')))
+    try:
+        for args in (['learn', 'nomatch-*'], ['export', 'csv', 'nomatch-*']):
+            result = runner.invoke(cli.cli, args)
+            assert result.exit_code == 1
+            assert result.output == 'Error: No node matches nomatch-*\n'
+    finally:
+        inventory._connection.close()
+        inventory._connection = None
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import json
+import pstats
+import threading
+import pytest
+from discover import metrics
+
+
+def test_timer_counts_failures():
+    registry = metrics.Registry()
+    with registry.timer('ipmi_call', bmc='10.0.0.1'):
+        pass
+    with pytest.raises(ValueError):
+        with registry.timer('ipmi_call', bmc='10.0.0.1'):
+            raise ValueError()
+    data = registry.to_dict()
+    assert data['counters'] == [{'name': 'ipmi_call_failures_total',
+                                 'labels': {'bmc': '10.0.0.1'}, 'value': 1}]
+    summary, = data['summaries']
+    assert summary['name'] == 'ipmi_call_seconds'
+    assert summary['count'] == 2
+
+
+def test_prometheus_format():
+    registry = metrics.Registry()
+    registry.observe('snmp_walk_entries', 10, switch='SW1')
+    registry.observe('snmp_walk_entries', 30, switch='SW1')
+    registry.inc('discovery_poll_rounds_total')
+    assert registry.to_prometheus().splitlines() == [
+        '# TYPE discover_discovery_poll_rounds_total counter',
+        'discover_discovery_poll_rounds_total 1.0',
+        '# TYPE discover_snmp_walk_entries summary',
+        'discover_snmp_walk_entries_sum{switch="SW1"} 40.0',
+        'discover_snmp_walk_entries_count{switch="SW1"} 2',
+        '# TYPE discover_snmp_walk_entries_max gauge',
+        'discover_snmp_walk_entries_max{switch="SW1"} 30.0',
+    ]
+
+
+def test_write(tmpdir):
+    metrics.reset()
+    metrics.inc('discovery_failed_nodes_total', 2)
+    metrics.write(str(tmpdir))
+    data = json.loads(tmpdir.join('metrics.json').read())
+    assert data['counters'][0]['value'] == 2
+    assert 'discover_discovery_failed_nodes_total 2.0' in tmpdir.join('metrics.prom').read()
+    metrics.reset()
+
+
+def test_write_run_logs_unwritable_directory(tmpdir):
+    # A file in the way of the directory makes makedirs fail
+    blocker = tmpdir.join('blocker')
+    blocker.write('')
+    metrics.write_run(str(blocker.join('metrics')))
+    assert not blocker.join('metrics').check()
+
+
+def slow_walk():
+    return sum(range(10000))
+
+
+def test_profile_includes_threads(tmpdir):
+    filename = str(tmpdir.join('profile.pstats'))
+    with metrics.profile(filename):
+        thread = threading.Thread(target=slow_walk)
+        thread.start()
+        thread.join()
+    functions = [function for _, _, function in pstats.Stats(filename).stats]
+    assert 'slow_walk' in functions
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import pytest
+from discover import config
+from discover import switch
+from discover.node import BMC, Node, MacAddressNotFoundError, config_hash
+
+CONFDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config')
+
+
+def make_node():
+    return Node('node-1', {
+        'SW10-1': {'nic': 'eth0', 'port': 1, 'vlan': 119, 'mac': 'a1:f2:3:4:5:6'},
+        'SW10-2': {'nic': 'eth1', 'port': 1, 'vlan': 119, 'mac': ''},
+    }, '10.131.10.1', 'USERID', 'PASSW0RD')
+
+
+def test_missing_macs():
+    node = make_node()
+    assert node.has_missing_macs()
+    assert [port.switch for port in node.missing_ports()] == ['SW10-2']
+    assert node.get_mac('eth0') == 'A1:F2:03:04:05:06'
+    with pytest.raises(MacAddressNotFoundError):
+        node.get_mac('eth1')
+    node.add_mac('SW10-2', '00:00:00:00:00:02')
+    node.add_mac('SW10-2', '00:00:00:00:00:03')
+    assert node.has_all_macs()
+    assert node.switchports['SW10-2']['mac'] == '00:00:00:00:00:03'
+
+
+def test_dict_and_pickle_round_trip():
+    node = make_node()
+    for copy in (Node.from_dict(node.to_dict()),
+                 pickle.loads(pickle.dumps(node, 0)),
+                 pickle.loads(pickle.dumps(node, 2))):
+        assert copy.to_dict() == node.to_dict()
+        assert copy.has_missing_macs()
+        assert copy.bmc.timeout == node.bmc.timeout
+
+
+def test_state_of_older_versions():
+    node = Node.__new__(Node)
+    node.__setstate__({
+        'name': 'node-1',
+        'bmc': BMC.from_dict({'address': '10.131.10.1', 'user': 'USERID',
+                              'password': 'PASSW0RD'}),
+        'switchports': {'SW10-1': {'nic': 'eth0', 'port': 1, 'vlan': 119}},
+    })
+    assert node.bmc.timeout == 30
+    assert node.switchports == {'SW10-1': {'nic': 'eth0', 'port': 1, 'vlan': 119}}
+
+
+def test_config_changes_keep_unchanged_macs():
+    nodecfg = {
+        'bmc': {'address': '10.131.10.1', 'user': 'USERID', 'password': 'PASSW0RD'},
+        'nics': {
+            'eth0': {'switch': 'SW10-1', 'port': 1, 'vlan': 119, 'mac': ''},
+            'eth1': {'switch': 'SW10-2', 'port': 1, 'vlan': 119, 'mac': ''},
+        },
+    }
+    stored = Node.from_config('node-1', nodecfg)
+    stored.add_mac('SW10-1', '00:00:00:00:00:01')
+    stored.add_mac('SW10-2', '00:00:00:00:00:02')
+    assert stored.config_hash == config_hash(nodecfg)
+    assert pickle.loads(pickle.dumps(stored, 2)).config_hash == stored.config_hash
+
+    nodecfg['nics']['eth1']['port'] = 2
+    assert config_hash(nodecfg) != stored.config_hash
+    node = Node.from_config('node-1', nodecfg)
+    node.keep_macs(stored)
+    assert node.get_mac('eth0') == '00:00:00:00:00:01'
+    assert [port.switch for port in node.missing_ports()] == ['SW10-2']
+
+
+def test_shipped_nodes_config(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'DEFAULT_CONF_DIRS', [CONFDIR])
+    monkeypatch.setattr(config, 'CACHE_DIR', str(tmpdir))
+    monkeypatch.setattr(config, '_env', None)
+    nodes = config.LazyFile(config.NODESFILE)
+    node = Node.from_config('node-10-1', nodes['node-10-1'])
+    assert node.switchports == {
+        'SW10-1': {'nic': 'nic1', 'port': 1, 'vlan': 119},
+        'SW10-2': {'nic': 'nic2', 'port': 1, 'vlan': 119},
+    }
+    assert node.bmc.address == '10.131.10.1'
+    assert node.config_hash == config_hash(nodes['node-10-1'])
+    assert switch._scopes(nodes)['SW11-2'] == {119: set(range(1, 20))}
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import pytest
+from discover import ipmi
+from discover import power
+from discover.node import BMC, IPMIError, ON, OFF
+
+
+class FakeBMC(object):
+    def __init__(self, address, state=OFF, fail=False):
+        self.address = address
+        self.state = state
+        self.fail = fail
+        self.commands = []
+
+    def _cmd(self, name):
+        self.commands.append(name)
+        if self.fail:
+            raise IPMIError('{} failed'.format(name))
+
+    def power_status(self, timeout=None, max_age=None):
+        self._cmd('status')
+        return self.state
+
+    def activate_pxe(self, timeout=None):
+        self._cmd('pxe')
+
+    def power_on(self, timeout=None):
+        self._cmd('on')
+        self.state = ON
+
+    def power_soft(self, timeout=None):
+        self._cmd('soft')
+
+    def power_hard_off(self, timeout=None):
+        self._cmd('off')
+        self.state = OFF
+
+
+def test_status_reports_errors_per_bmc():
+    bmcs = [FakeBMC('10.0.0.1', ON), FakeBMC('10.0.0.2', fail=True)]
+    report = power.status(bmcs, workers=2)
+    assert report.results == {'10.0.0.1': ON}
+    assert report.failed() == ['10.0.0.2']
+
+
+def test_boot_for_discovery():
+    off = FakeBMC('10.0.0.1', OFF)
+    running = FakeBMC('10.0.0.2', ON)
+    broken = FakeBMC('10.0.0.3', fail=True)
+    report = power.boot_for_discovery([off, running, broken], workers=3)
+    assert report.results == {'10.0.0.1': 'booted', '10.0.0.2': ON}
+    assert report.failed() == ['10.0.0.3']
+    assert off.commands == ['status', 'pxe', 'on']
+    assert running.commands == ['status']
+
+
+def test_waves_limit_each_group():
+    racks = {'a1': 'A', 'a2': 'A', 'a3': 'A', 'b1': 'B', 'c1': None}
+    waves = power.waves(sorted(racks), size=2, group=racks.get)
+    assert waves == [['a1', 'a2', 'b1', 'c1'], ['a3']]
+    assert power.waves(['a1', 'b1'], size=0) == [['a1', 'b1']]
+    assert power.waves([], size=2) == []
+
+
+def test_power_off_hard_after_grace_time():
+    bmc = FakeBMC('10.0.0.1', ON)
+    report = power.power_off([bmc], workers=1, grace_time=0)
+    assert report.results == {'10.0.0.1': OFF}
+    assert bmc.commands == ['soft', 'off']
+
+
+class FakeTransport(object):
+    def __init__(self, output):
+        self.output = output
+        self.commands = []
+
+    def run(self, bmc, cmd, timeout):
+        self.commands.append(cmd)
+        return self.output
+
+
+def test_power_status_is_cached(monkeypatch):
+    transport = FakeTransport('Chassis Power is off\n')
+    monkeypatch.setattr(ipmi, 'transport', lambda: transport)
+    bmc = BMC('10.0.0.1', 'USERID', 'PASSW0RD')
+    assert bmc.is_off() and not bmc.is_on()
+    assert transport.commands == ['chassis power status']
+    # Power commands and max_age=0 read the status again
+    bmc.power_on()
+    bmc.power_status()
+    bmc.power_status(max_age=0)
+    assert transport.commands == ['chassis power status', 'chassis power on',
+                                  'chassis power status', 'chassis power status']
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.calls = []
+
+    def get_power(self):
+        return {'powerstate': 'on'}
+
+    def set_power(self, state):
+        self.calls.append(('power', state))
+
+    def set_bootdev(self, device):
+        self.calls.append(('bootdev', device))
+
+
+def test_pyghmi_commands():
+    session = FakeSession()
+    assert ipmi.PyghmiTransport._run(session, 'chassis power status') == 'Chassis Power is on\n'
+    ipmi.PyghmiTransport._run(session, 'chassis power soft')
+    ipmi.PyghmiTransport._run(session, 'chassis bootdev pxe')
+    assert session.calls == [('power', 'softoff'), ('bootdev', 'network')]
+    with pytest.raises(IPMIError):
+        ipmi.PyghmiTransport._run(session, 'sel list')
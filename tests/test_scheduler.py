@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+from discover.scheduler import RetryPolicy, Scheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeNode(object):
+    def __init__(self, name, found_at):
+        self.name = name
+        self.found_at = found_at
+        self.polls = []
+
+    def has_all_macs(self):
+        return bool(self.polls) and self.polls[-1] >= self.found_at
+
+
+def test_delay_backs_off_up_to_max_delay():
+    policy = RetryPolicy(initial_delay=5, backoff=2, max_delay=30, timeout=100)
+    assert [policy.delay(i) for i in range(5)] == [5, 10, 20, 30, 30]
+
+
+def test_nodes_finish_independently():
+    clock = FakeClock()
+    policy = RetryPolicy(initial_delay=5, backoff=2, max_delay=30, timeout=60)
+    scheduler = Scheduler(policy, clock=clock.time, sleep=clock.sleep)
+    fast = FakeNode('fast', found_at=5)
+    slow = FakeNode('slow', found_at=40)
+    lost = FakeNode('lost', found_at=1000)
+    scheduler.add([fast, slow, lost])
+
+    def poll(nodes):
+        for node in nodes:
+            node.polls.append(clock.now)
+
+    failed = scheduler.run(poll)
+    assert failed == [lost]
+    assert fast.polls == [5]
+    assert slow.polls == [5, 15, 35, 60]
+    assert lost.polls == [5, 15, 35, 60]
+    assert clock.now == 60
+    assert scheduler.pending() == []
+
+
+def test_calls_run_between_polls():
+    clock = FakeClock()
+    policy = RetryPolicy(initial_delay=5, backoff=1, max_delay=5, timeout=60)
+    scheduler = Scheduler(policy, clock=clock.time, sleep=clock.sleep)
+    first = FakeNode('first', found_at=10)
+    second = FakeNode('second', found_at=30)
+    booted = []
+
+    def boot(node):
+        booted.append((node.name, clock.now))
+        scheduler.add([node])
+
+    scheduler.call_later(0, boot, first)
+    scheduler.call_later(20, boot, second)
+
+    def poll(nodes):
+        for node in nodes:
+            node.polls.append(clock.now)
+
+    assert scheduler.run(poll) == []
+    assert booted == [('first', 0), ('second', 20)]
+    # The first node is polled while the second one waits to be booted
+    assert first.polls == [5, 10]
+    assert second.polls == [25, 30]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import pytest
+from discover import config
+from discover import selectors
+
+NODES = ['node-10-{}'.format(i) for i in range(1, 20)] + ['node-11-1', 'login-01']
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    data = dict((name, {'rack': int(name.split('-')[1])} if name.startswith('node') else {})
+                for name in NODES)
+    monkeypatch.setattr(config, 'nodes', data)
+
+
+def test_expand():
+    assert selectors.expand('node-[10-11]-[1,3]') == [
+        'node-10-1', 'node-10-3', 'node-11-1', 'node-11-3']
+    assert selectors.expand('login-[01-02]') == ['login-01', 'login-02']
+
+
+def test_select(nodes):
+    assert selectors.select('node-10-1') == ['node-10-1']
+    assert selectors.select('node-10-[9-11]') == ['node-10-9', 'node-10-10', 'node-10-11']
+    assert selectors.select('node-1?-1') == ['node-10-1', 'node-11-1']
+    assert selectors.select('rack:11,login-*') == ['login-01', 'node-11-1']
+    assert len(selectors.select('all')) == len(NODES)
+    # Plain names are accepted even if they are not in the configuration
+    assert selectors.select('node-12-1') == ['node-12-1']
+
+
+def test_no_match(nodes):
+    with pytest.raises(selectors.SelectorError):
+        selectors.select('node-12-[1-5]')
+    with pytest.raises(selectors.SelectorError):
+        selectors.select('rack:12')
+    with pytest.raises(selectors.SelectorError):
+        selectors.select('node-[1-]')
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+PROBE = """
+import sys
+from click.testing import CliRunner
+from discover import cli
+CliRunner().invoke(cli.cli, ['show'])
+CliRunner().invoke(cli.cli, ['export', 'csv', 'all'])
+heavy = ('snimpy', 'xmlrpclib', 'xmlrpc.client', 'discover.switch', 'discover.cobbler')
+print('loaded:' + ','.join(m for m in heavy if m in sys.modules))
+"""
+
+
+def test_read_only_commands_do_not_load_subsystems(tmpdir):
+    # Keep the inventory and caches of ~/.discover out of reach
+    env = dict(os.environ, HOME=str(tmpdir))
+    output = subprocess.check_output([sys.executable, '-c', PROBE], env=env,
+                                     universal_newlines=True)
+    assert output.strip().splitlines()[-1] == 'loaded:'
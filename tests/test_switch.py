@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+import pytest
+from discover import switch
+from discover.fdb import FDBTable
+
+
+class FakeSNMPClient(object):
+    def __init__(self, entries):
+        self.entries = entries
+        self.walks = 0
+
+    def get_mac_table(self, scope, max_repetitions):
+        self.walks += 1
+        return FDBTable.from_entries(self.entries)
+
+
+@pytest.fixture
+def snapshots(tmpdir, monkeypatch):
+    monkeypatch.setattr(switch, 'SNAPSHOT_DIR', str(tmpdir))
+    monkeypatch.setattr(switch, '_refresh', False)
+    return tmpdir
+
+
+def make_switch(entries):
+    sw = switch.Switch('SW10-1', '10.1.10.1', 'public')
+    sw.scope = {1: set([119])}
+    sw._snmp = FakeSNMPClient(entries)
+    return sw
+
+
+def test_snapshot_reused(snapshots):
+    first = make_switch([(1, 119, '00:00:00:00:00:01')])
+    first.update_macs()
+    assert first._snmp.walks == 1
+    assert snapshots.join('SW10-1.fdb').exists()
+
+    # A later run reuses the table while it is young enough
+    second = make_switch([])
+    second.update_macs(max_age=60)
+    assert second._snmp.walks == 0
+    assert second.macs.find('00:00:00:00:00:01') == [(1, 119)]
+    assert second._last_updated_macs == first._last_updated_macs
+
+    # Unless it asks for a fresh one
+    second.update_macs()
+    assert second._snmp.walks == 1
+    assert second.macs.find('00:00:00:00:00:01') == []
+
+
+def test_snapshot_ignored(snapshots):
+    make_switch([(1, 119, '00:00:00:00:00:01')]).update_macs()
+
+    # Walked with another scope
+    other = make_switch([])
+    other.scope = {1: set([120])}
+    other.update_macs(max_age=60)
+    assert other._snmp.walks == 1
+
+    # Corrupt
+    snapshots.join('SW10-1.fdb').write(b'broken', mode='wb')
+    corrupt = make_switch([])
+    corrupt.update_macs(max_age=60)
+    assert corrupt._snmp.walks == 1
+
+
+def test_refresh_all(snapshots):
+    assert switch.snapshot_ttl() == switch.SNAPSHOT_TTL
+    switch.refresh_all()
+    assert switch.snapshot_ttl() == 0
+
+
+def test_join(monkeypatch):
+    sw = make_switch([])
+    sw.macs = FDBTable.from_entries([(1, 119, '00:00:00:00:00:01'),
+                                     (2, 119, '00:00:00:00:00:02')])
+    monkeypatch.setattr(switch, 'switches', {'SW10-1': sw})
+    assert switch.join({'SW10-1': set([(1, 119), (3, 119)])}) == {
+        ('SW10-1', 1, 119): ['00:00:00:00:00:01'],
+        ('SW10-1', 3, 119): [],
+    }
+
+
+class FakePortClient(FakeSNMPClient):
+    def get_port_info_table(self, max_repetitions):
+        self.walks += 1
+        return switch.PortTable(
+            {10101: {'name': 'Gi1/0/1', 'descr': 'GigabitEthernet1/0/1', 'label': 'node-10-1'},
+             10102: {'name': 'Gi1/0/2', 'descr': 'GigabitEthernet1/0/2', 'label': ''}},
+            {1: 10101, 2: 10102})
+
+
+def test_ports_by_interface_name(snapshots, monkeypatch):
+    sw = make_switch([])
+    sw._snmp = FakePortClient([(1, 119, '00:00:00:00:00:01'), (2, 119, '00:00:00:00:00:02')])
+    sw.scope = {119: set(['Gi1/0/2', 3])}
+    assert sw._walk_scope() == {119: set([2, 3])}
+    sw.update_macs()
+    monkeypatch.setattr(switch, 'switches', {'SW10-1': sw})
+    assert switch.lookup('SW10-1', 'GigabitEthernet1/0/1', 119) == ['00:00:00:00:00:01']
+    assert switch.join({'SW10-1': [('Gi1/0/2', 119), (2, 119), ('Gi9/9', 119)]}) == {
+        ('SW10-1', 'Gi1/0/2', 119): ['00:00:00:00:00:02'],
+        ('SW10-1', 2, 119): ['00:00:00:00:00:02'],
+        ('SW10-1', 'Gi9/9', 119): [],
+    }
+    # The port table is walked once and saved for the next runs
+    assert sw._snmp.walks == 2
+    again = make_switch([])
+    again._snmp = FakePortClient([])
+    assert again.bridge_port('Gi1/0/2') == 2
+    assert again._snmp.walks == 0
+
+
+def test_ports_by_interface_name_unknown(snapshots, monkeypatch):
+    sw = make_switch([])
+    sw._snmp = FakePortClient([])
+    # Lookups never walk the port table
+    assert sw.bridge_port('Gi1/0/2') is None
+    monkeypatch.setattr(switch, 'switches', {'SW10-1': sw})
+    assert switch.join({'SW10-1': [('Gi1/0/2', 119)]}) == {('SW10-1', 'Gi1/0/2', 119): []}
+    assert sw._snmp.walks == 0
+    # A vlan without any known port is not walked
+    sw.scope = {119: set(['Gi9/9']), 120: set(['Gi1/0/1'])}
+    assert sw._walk_scope() == {120: set([1])}
+    assert sw._snmp.walks == 1
+
+
+def test_lldp_neighbors(snapshots):
+    sw = make_switch([])
+    sw._snmp = FakePortClient([])
+    sw.update_port_info()
+    sw.neighbors = {1: [0x000000000001], 2: [0x000000000002, 0x000000000003]}
+    assert sw.neighbor_macs('Gi1/0/1') == ['00:00:00:00:00:01']
+    assert sw.neighbor_macs(2) == ['00:00:00:00:00:02', '00:00:00:00:00:03']
+    assert sw.neighbor_macs(3) == []
+    assert switch._octets(b'\x00\x1a\x2b\x3c\x4d\x5e') == bytearray(b'\x00\x1a\x2b\x3c\x4d\x5e')
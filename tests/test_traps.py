@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+from discover import ber
+from discover import switch
+from discover import traps
+from discover.fdb import mac_to_int
+
+
+def test_parse_mac_notification():
+    data = traps.encode_mac_notification('public', [
+        (traps.LEARNED, 12, 119, '0:1a:2b:3c:4d:5e'),
+        (traps.REMOVED, 3, 1, '0:0:0:0:0:1'),
+    ])
+    message = ber.decode_message(data)
+    assert message['community'] == b'public'
+    assert traps.parse_events(message) == [
+        (traps.LEARNED, 12, 119, mac_to_int('0:1a:2b:3c:4d:5e')),
+        (traps.REMOVED, 3, 1, 1),
+    ]
+
+
+def test_parse_link_up():
+    message = ber.decode_message(traps.encode_link_up('public', 10112))
+    assert traps.parse_events(message) == [(traps.LINK_UP_EVENT, 10112)]
+
+
+def test_listener_receives_local_traps():
+    received = []
+    done = threading.Event()
+
+    def handler(source, community, events):
+        received.append((source, community, events))
+        done.set()
+
+    listener = traps.TrapListener(handler, '127.0.0.1', 0)
+    listener.start()
+    try:
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.sendto(b'garbage', listener.address)
+        sender.sendto(traps.encode_mac_notification(
+            'public', [(traps.LEARNED, 5, 119, '0:0:0:0:0:5')]), listener.address)
+        sender.close()
+        assert done.wait(5)
+    finally:
+        listener.stop()
+    assert received == [('127.0.0.1', 'public', [(traps.LEARNED, 5, 119, 5)])]
+
+
+def test_listener_acknowledges_informs():
+    listener = traps.TrapListener(lambda *args: None, '127.0.0.1', 0)
+    listener.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sender.settimeout(5)
+        varbinds = [(traps.SYS_UPTIME, (ber.TIMETICKS, 42)),
+                    (traps.SNMP_TRAP_OID, (ber.OID, traps.LINK_UP))]
+        sender.sendto(ber.encode_message('public', ber.INFORM, 1234, varbinds),
+                      listener.address)
+        response = ber.decode_message(sender.recvfrom(65535)[0])
+    finally:
+        sender.close()
+        listener.stop()
+    assert response['pdu'] == ber.RESPONSE
+    assert response['request_id'] == 1234
+    assert response['community'] == b'public'
+    assert response['varbinds'] == varbinds
+
+
+def test_traps_feed_the_mac_tables(monkeypatch):
+    sw = switch.Switch('SW10-1', '127.0.0.1', 'public')
+    monkeypatch.setattr(switch, 'switches', {'SW10-1': sw})
+    wakeup = threading.Event()
+    settings = {'enabled': True, 'address': '127.0.0.1', 'port': 0}
+    with traps.listen(wakeup, settings) as listener:
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Ignored: wrong community
+        sender.sendto(traps.encode_mac_notification(
+            'private', [(traps.LEARNED, 6, 119, '0:0:0:0:0:6')]), listener.address)
+        sender.sendto(traps.encode_mac_notification(
+            'public', [(traps.LEARNED, 5, 119, '0:0:0:0:0:5')]), listener.address)
+        sender.close()
+        assert wakeup.wait(5)
+    assert switch.lookup('SW10-1', 5, 119) == ['00:00:00:00:00:05']
+    assert switch.lookup('SW10-1', 6, 119) == []